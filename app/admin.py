@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Role, User, Publisher, Recipe, RecipeMethod
+from .models import Role, User, Publisher, Recipe, RecipeMethod, SavedRecipe
 
 @admin.register(Role)
 class RoleAdmin(admin.ModelAdmin):
@@ -27,3 +27,8 @@ class RecipeMethodAdmin(admin.ModelAdmin):
     list_display = ('id', 'recipe', 'step_number')
     list_filter = ('recipe',)
     ordering = ('recipe', 'step_number')
+
+@admin.register(SavedRecipe)
+class SavedRecipeAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'recipe', 'created_at')
+    raw_id_fields = ('user', 'recipe')
@@ -0,0 +1,362 @@
+import bisect
+import heapq
+import itertools
+import re
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .tasks import enqueue
+
+RECIPE = 'recipe'
+PUBLISHER = 'publisher'
+TOKEN = re.compile(r'\w+')
+# Above the end of any prefix range in a sorted list of strings
+PREFIX_END = '\U0010ffff'
+# Words this short match a large share of the vocabulary, so each such
+# prefix also keeps all of its words' postings merged into one list
+SHORT_PREFIX = 2
+# Phrase ranges up to this long are ranked by scanning them
+PHRASE_SCAN = 500
+# Bounds a best-first walk when matches are sparse
+MAX_CANDIDATES = 2000
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+def _phrase_matches(tokens, terms):
+    # terms appear in order in tokens, the last one as a prefix
+    *words, prefix = terms
+    for i in range(len(tokens) - len(words)):
+        if list(tokens[i:i + len(words)]) == words and tokens[i + len(words)].startswith(prefix):
+            return True
+    return False
+
+
+class AutocompleteIndex:
+    """
+    In-memory prefix index over (key, label, weight) entries; a query
+    matches labels with its words in order, the last one as a prefix.
+
+    Every distinct word of every label is kept in one sorted list, so the
+    words starting with a prefix are a bisect away, and has a posting list
+    of (-weight, key) pairs, best first. One- and two-letter prefixes also
+    keep their words' postings merged. A one-word lookup walks those lists
+    best first and stops once it has `limit` suggestions. For longer queries
+    each word also has a sorted list of the label text that follows it, in
+    which the rest of the query is a bisect range. No lookup walks every
+    entry under a common prefix.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.words = []
+        self.postings = {}
+        # One- and two-letter prefix -> merged postings of its words
+        self.prefix_postings = {}
+        # word -> sorted [(text after it in a label, key)]
+        self.phrases = {}
+        # key -> (weight, label, tokens)
+        self.entries = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _following(tokens):
+        for i in range(len(tokens) - 1):
+            yield tokens[i], ' '.join(tokens[i + 1:])
+
+    @staticmethod
+    def _short_prefixes(token):
+        return {token[:length] for length in range(1, SHORT_PREFIX + 1)}
+
+    def load(self, rows):
+        # Sorting once is much faster than inserting entries one by one
+        entries, postings, prefix_postings, phrases = {}, {}, {}, {}
+        for key, label, weight in rows:
+            tokens = tuple(tokenize(label))
+            entries[key] = (weight, label, tokens)
+            for token in set(tokens):
+                posting = (-weight, key)
+                postings.setdefault(token, []).append(posting)
+                for prefix in self._short_prefixes(token):
+                    prefix_postings.setdefault(prefix, []).append(posting)
+            for token, rest in self._following(tokens):
+                phrases.setdefault(token, []).append((rest, key))
+        for sorted_list in (*postings.values(), *prefix_postings.values(), *phrases.values()):
+            sorted_list.sort()
+        with self._lock:
+            self.entries, self.postings, self.prefix_postings, self.phrases = entries, postings, prefix_postings, phrases
+            self.words = sorted(postings)
+
+    def add(self, key, label, weight):
+        with self._lock:
+            self._remove(key)
+            tokens = tuple(tokenize(label))
+            self.entries[key] = (weight, label, tokens)
+            for token in set(tokens):
+                posting = (-weight, key)
+                if token not in self.postings:
+                    self.postings[token] = []
+                    bisect.insort(self.words, token)
+                bisect.insort(self.postings[token], posting)
+                for prefix in self._short_prefixes(token):
+                    bisect.insort(self.prefix_postings.setdefault(prefix, []), posting)
+            for token, rest in self._following(tokens):
+                bisect.insort(self.phrases.setdefault(token, []), (rest, key))
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    @staticmethod
+    def _discard(lists, name, item):
+        sorted_list = lists[name]
+        del sorted_list[bisect.bisect_left(sorted_list, item)]
+        if not sorted_list:
+            del lists[name]
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        weight, _, tokens = entry
+        for token in set(tokens):
+            posting = (-weight, key)
+            self._discard(self.postings, token, posting)
+            if token not in self.postings:
+                del self.words[bisect.bisect_left(self.words, token)]
+            for prefix in self._short_prefixes(token):
+                self._discard(self.prefix_postings, prefix, posting)
+        for token, rest in self._following(tokens):
+            self._discard(self.phrases, token, (rest, key))
+
+    def raise_weight(self, key, weight):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and weight > entry[0]:
+                self.add(key, entry[1], weight)
+
+    def weight(self, key):
+        entry = self.entries.get(key)
+        return entry[0] if entry else None
+
+    def suggest(self, query):
+        """
+        [(key, label)] for the best-weighted entries whose label has the
+        query's words in order, the last one as a prefix.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            if len(terms) == 1:
+                keys = self._best(self._walk(terms[0]), terms)
+            else:
+                keys = self._phrase(terms)
+            return [(key, self.entries[key][1]) for key in keys]
+
+    def _prefix_words(self, prefix):
+        start = bisect.bisect_left(self.words, prefix)
+        return self.words[start:bisect.bisect_left(self.words, prefix + PREFIX_END, start)]
+
+    def _walk(self, prefix):
+        # Postings of every word starting with prefix, best first
+        if len(prefix) <= SHORT_PREFIX:
+            return iter(self.prefix_postings.get(prefix, ()))
+        return heapq.merge(*(self.postings[word] for word in self._prefix_words(prefix)))
+
+    def _walk_size(self, prefix):
+        if len(prefix) <= SHORT_PREFIX:
+            return len(self.prefix_postings.get(prefix, ()))
+        return sum(len(self.postings[word]) for word in self._prefix_words(prefix))
+
+    def _best(self, postings, terms):
+        # The first `limit` distinct entries matching terms
+        found, seen = [], set()
+        for _, key in itertools.islice(postings, MAX_CANDIDATES):
+            if key not in seen:
+                seen.add(key)
+                if len(terms) == 1 or _phrase_matches(self.entries[key][2], terms):
+                    found.append(key)
+                    if len(found) == self.limit:
+                        break
+        return found
+
+    def _phrase(self, terms):
+        following = self.phrases.get(terms[0], [])
+        rest = ' '.join(terms[1:])
+        start = bisect.bisect_left(following, (rest,))
+        end = bisect.bisect_left(following, (rest + PREFIX_END,), start)
+        if end - start <= PHRASE_SCAN:
+            keys = {key for _, key in following[start:end]}
+            return heapq.nsmallest(self.limit, keys, key=lambda key: (-self.entries[key][0], key))
+        # Too many to rank one by one, so walk a best-first list instead.
+        # About one entry in (list length / matches) is a match, so pick the
+        # shorter list: the first word's, or the last word's.
+        first_word = self.postings.get(terms[0], [])
+        if len(first_word) <= self._walk_size(terms[-1]):
+            return self._best(first_word, terms)
+        return self._best(self._walk(terms[-1]), terms)
+
+
+def _publisher_ranks(publisher_ids=None):
+    # Publishers rank by their best recipe
+    from django.db.models import Max
+    from .models import Recipe
+
+    recipes = Recipe.objects.order_by()
+    if publisher_ids is not None:
+        recipes = recipes.filter(publisher__in=publisher_ids)
+    return dict(recipes.values('publisher').annotate(rank=Max('social_rank')).values_list('publisher', 'rank'))
+
+
+def _rows():
+    from .models import Publisher, Recipe
+
+    for recipe_id, title, social_rank in Recipe.objects.order_by().values_list('id', 'title', 'social_rank').iterator():
+        yield (RECIPE, recipe_id), title, social_rank
+    ranks = _publisher_ranks()
+    for publisher_id, name in Publisher.objects.values_list('id', 'publisher_name').iterator():
+        yield (PUBLISHER, publisher_id), name, ranks.get(publisher_id) or 0
+
+
+def _live_keys():
+    from .models import Publisher, Recipe
+
+    keys = {(RECIPE, pk) for pk in Recipe.objects.order_by().values_list('id', flat=True).iterator()}
+    keys.update((PUBLISHER, pk) for pk in Publisher.objects.order_by().values_list('id', flat=True).iterator())
+    return keys
+
+
+# This process's index. Signals keep it current for changes made here;
+# other processes' changes arrive with the next sync, at most
+# AUTOCOMPLETE_SYNC_SECONDS later.
+_index = None
+# When the last build or sync finished (monotonic), and the database time
+# it started reading at
+_synced_at = None
+_synced_since = None
+# Updates that arrive while a build reads the database, to replay on the
+# new index before it replaces the old one
+_pending = None
+_refresh_queued = False
+_index_lock = threading.RLock()
+_build_lock = threading.Lock()
+# Rows are stamped with updated_at a little before they commit, so each
+# sync also re-reads this much from before the previous one started
+SYNC_OVERLAP = timedelta(minutes=1)
+
+
+def _rebuild():
+    global _index, _synced_at, _synced_since, _pending, _refresh_queued
+    with _index_lock:
+        _pending = []
+    started = timezone.now()
+    try:
+        index = AutocompleteIndex(settings.AUTOCOMPLETE_LIMIT)
+        index.load(_rows())
+    except Exception:
+        with _index_lock:
+            # Let the next lookup queue another attempt
+            _pending, _refresh_queued = None, False
+        raise
+    with _index_lock:
+        for update in _pending:
+            update(index)
+        _index, _synced_at, _synced_since, _pending, _refresh_queued = index, time.monotonic(), started, None, False
+
+
+def _sync():
+    # Apply the recipes and publishers saved since the last build or sync,
+    # then drop deleted ones. Only when the index holds more entries than
+    # the database has rows are the (indexed) ids read to find which.
+    global _synced_at, _synced_since, _refresh_queued
+    from .models import Publisher, Recipe
+
+    started = timezone.now()
+    since = _synced_since - SYNC_OVERLAP
+    try:
+        recipes = list(
+            Recipe.objects.filter(updated_at__gte=since).order_by()
+            .values_list('id', 'title', 'social_rank', 'publisher_id')
+        )
+        publishers = list(Publisher.objects.filter(updated_at__gte=since).values_list('id', 'publisher_name'))
+        ranks = _publisher_ranks([publisher_id for publisher_id, _ in publishers])
+        total = Recipe.objects.count() + Publisher.objects.count()
+        with _index_lock:
+            for recipe_id, title, social_rank, publisher_id in recipes:
+                _index.add((RECIPE, recipe_id), title, social_rank)
+                _index.raise_weight((PUBLISHER, publisher_id), social_rank)
+            for publisher_id, name in publishers:
+                _index.add((PUBLISHER, publisher_id), name, ranks.get(publisher_id) or 0)
+            deleted = len(_index.entries) > total
+        if deleted:
+            # An entry added here after the ids were read is dropped too,
+            # and comes back with the next sync
+            live = _live_keys()
+            with _index_lock:
+                for key in [key for key in _index.entries if key not in live]:
+                    _index.remove(key)
+    except Exception:
+        with _index_lock:
+            _refresh_queued = False
+        raise
+    with _index_lock:
+        _synced_at, _synced_since, _refresh_queued = time.monotonic(), started, False
+
+
+def rebuild_autocomplete_index():
+    with _build_lock:
+        _rebuild()
+
+
+def refresh_autocomplete_index():
+    # Build this process's index, or bring the one it has up to date
+    with _build_lock:
+        if _index is None:
+            _rebuild()
+        else:
+            _sync()
+
+
+def get_autocomplete_index():
+    """
+    This process's index, or None until its first build has finished.
+    Building reads every recipe and publisher title and holds the GIL for
+    most of the time (about 30s at a million titles), so it never runs in
+    a request: the first lookup queues it as a background job. After that
+    the first lookup every AUTOCOMPLETE_SYNC_SECONDS queues a sync, which
+    only reads what changed.
+    """
+    global _refresh_queued
+    max_age = settings.AUTOCOMPLETE_SYNC_SECONDS
+    with _index_lock:
+        stale = _index is None or (max_age and time.monotonic() - _synced_at > max_age)
+        queue_refresh = stale and not _refresh_queued
+        if queue_refresh:
+            _refresh_queued = True
+    if queue_refresh:
+        # Outside the lock: in eager mode the job runs right here
+        enqueue(refresh_autocomplete_index)
+    return _index
+
+
+def update_autocomplete_index(update):
+    # update(index) is applied to the live index, if one was built, and to
+    # any index being built
+    with _index_lock:
+        if _index is not None:
+            update(_index)
+        if _pending is not None:
+            _pending.append(update)
+
+
+def reset_autocomplete_index():
+    global _index, _synced_at, _synced_since, _refresh_queued
+    with _index_lock:
+        _index, _synced_at, _synced_since, _refresh_queued = None, None, None, False
@@ -0,0 +1,42 @@
+import logging
+import time
+
+import requests
+from django.conf import settings
+from django.core.files import File
+from django.core.files.temp import NamedTemporaryFile
+
+from .fetch import ImageFetchError, fetch_image, is_transient
+from .models import User
+from .thumbnails import process_profile_picture
+
+logger = logging.getLogger(__name__)
+
+
+def download_avatar(user_id, url):
+    """
+    Background job: store the remote avatar as the user's profile picture,
+    retrying transient failures with exponential backoff. Until it succeeds
+    the user keeps the default picture.
+    """
+    for attempt in range(settings.AVATAR_RETRIES + 1):
+        try:
+            with NamedTemporaryFile() as img_temp:
+                fetch_image(
+                    url, img_temp,
+                    timeout=(settings.AVATAR_CONNECT_TIMEOUT, settings.AVATAR_READ_TIMEOUT),
+                    max_bytes=settings.AVATAR_MAX_BYTES,
+                )
+                user = User.objects.get(id=user_id)
+                # The user may have uploaded a picture while we were fetching
+                if user.profile_picture:
+                    return
+                user.profile_picture.save(f'google_avatar_{user.id}.jpg', File(img_temp), save=False)
+                user.save(update_fields=['profile_picture'])
+            process_profile_picture(user_id)
+            return
+        except (requests.RequestException, ImageFetchError) as e:
+            if attempt == settings.AVATAR_RETRIES or not is_transient(e):
+                logger.warning('Giving up on avatar for user %s: %s', user_id, e)
+                return
+            time.sleep(settings.AVATAR_RETRY_BACKOFF * 2 ** attempt)
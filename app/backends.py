@@ -0,0 +1,51 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+UserModel = get_user_model()
+
+
+class RoleModelBackend(ModelBackend):
+    """
+    ModelBackend that loads the session user together with their role, so
+    request.user.role costs no query of its own.
+    """
+
+    def get_user(self, user_id):
+        try:
+            user = UserModel._default_manager.select_related('role').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+
+class EmailOrUsernameBackend(RoleModelBackend):
+    """
+    Accepts either a username or a (case-insensitive) email address in one
+    indexed query, and hashes the password exactly once whether or not the
+    account exists.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if not username or password is None:
+            return None
+
+        users = list(
+            UserModel._default_manager.select_related('role')
+            .alias(email_lower=Lower('email'))
+            .filter(Q(username=username) | UserModel._default_manager.email_q(username))[:2]
+        )
+        # Someone's username could be someone else's email; the username wins
+        users.sort(key=lambda user: user.username != username)
+        if not users:
+            # Spend the same hashing time as a real check, so response times
+            # don't reveal which accounts exist
+            UserModel().set_password(password)
+            return None
+        user = users[0]
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,174 @@
+import platform
+import random
+import time
+from datetime import timedelta
+
+import django
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .metrics import percentile
+from .models import Publisher, Recipe, RecipeMethod, Role, User
+from .search import get_search_backend
+from .trending import trending_score
+
+# Vocabulary for generated titles and descriptions; search scenarios query
+# words from the same lists so they always have hits.
+ADJECTIVES = ['Spicy', 'Creamy', 'Smoky', 'Crispy', 'Roasted', 'Grilled', 'Zesty', 'Hearty', 'Sticky', 'Fresh']
+INGREDIENTS = ['Chicken', 'Tofu', 'Salmon', 'Lentil', 'Mushroom', 'Pumpkin', 'Chickpea', 'Beef', 'Halloumi', 'Aubergine']
+DISHES = ['Curry', 'Salad', 'Soup', 'Tacos', 'Stew', 'Pasta', 'Risotto', 'Burger', 'Traybake', 'Noodles']
+VERBS = ['Chop', 'Stir', 'Simmer', 'Whisk', 'Fold', 'Roast', 'Season', 'Drain', 'Toast', 'Serve']
+
+HOME_FILTERS = ['', 'popular', 'recent', 'trending', 'vegetarian', 'vegan', 'gluten-free']
+SEARCH_TERMS = ['chicken', 'curry', 'spicy lentil', 'mush', 'roasted pumpkin soup']
+
+
+def generate_catalog(publishers=20, recipes=2000, methods=6, seed=0, batch_size=500):
+    """
+    Create a reproducible synthetic catalog: the same arguments always
+    produce the same titles, ranks, dates and flags. Returns the admin user
+    the recipes belong to.
+    """
+    rng = random.Random(seed)
+    role, _ = Role.objects.get_or_create(role_name='admin')
+    user, _ = User.objects.get_or_create(username=f'benchmark-{seed}', defaults={'role': role})
+    publisher_ids = [
+        publisher.id for publisher in Publisher.objects.bulk_create([
+            Publisher(publisher_name=f'Benchmark Publisher {seed}-{i}', publisher_url=f'https://publisher{i}.example.com')
+            for i in range(publishers)
+        ])
+    ]
+
+    now = timezone.now()
+    for start in range(0, recipes, batch_size):
+        batch = []
+        for i in range(start, min(start + batch_size, recipes)):
+            words = [rng.choice(ADJECTIVES), rng.choice(INGREDIENTS), rng.choice(DISHES)]
+            vegan = rng.random() < 0.15
+            recipe = Recipe(
+                title=' '.join(words),
+                description=f'A {words[0].lower()} {words[2].lower()} with {rng.choice(INGREDIENTS).lower()}.',
+                source_url=f'https://example.com/recipes/{seed}-{i}',
+                image_url=f'https://images.example.com/{seed}-{i}.jpg',
+                recipe_id=f'benchmark-{seed}-{i}',
+                social_rank=round(rng.uniform(0, 100), 2),
+                cooking_time=rng.randrange(5, 120),
+                publisher_id=rng.choice(publisher_ids),
+                created_by=user,
+                created_at=now - timedelta(minutes=rng.randrange(60 * 24 * 90)),
+                is_vegan=vegan,
+                is_vegetarian=vegan or rng.random() < 0.3,
+                is_gluten_free=rng.random() < 0.25,
+            )
+            # bulk_create skips Recipe.save()
+            recipe.trending_score = trending_score(recipe.social_rank, recipe.created_at)
+            batch.append(recipe)
+        created = Recipe.objects.bulk_create(batch)
+        RecipeMethod.objects.bulk_create([
+            RecipeMethod(
+                recipe_id=recipe.id, step_number=step,
+                instruction=f'{rng.choice(VERBS)} the {rng.choice(INGREDIENTS).lower()} for {rng.randrange(1, 20)} minutes.',
+            )
+            for recipe in created
+            for step in range(1, methods + 1)
+        ])
+        get_search_backend().index_recipes(recipe.id for recipe in created)
+    return user
+
+
+def build_scenarios(user, rng):
+    """
+    (name, url factory) pairs; factories are called once per request so
+    detail and search scenarios spread over many rows.
+    """
+    recipe_ids = list(Recipe.objects.filter(created_by=user).values_list('id', flat=True))
+    scenarios = [
+        (f'home:{filter_type or "default"}', lambda f=filter_type: reverse('home') + (f'?filter={f}' if f else ''))
+        for filter_type in HOME_FILTERS
+    ]
+    scenarios += [
+        ('home:combined', lambda: reverse('home') + '?diet=vegan,gluten-free&max_time=30&sort=popular'),
+        ('search', lambda: reverse('home') + '?search=' + rng.choice(SEARCH_TERMS).replace(' ', '+')),
+        ('search:popular', lambda: reverse('home') + '?filter=popular&search=' + rng.choice(SEARCH_TERMS).replace(' ', '+')),
+        ('recipe_detail', lambda: reverse('recipe_detail', args=[rng.choice(recipe_ids)])),
+        ('manage_recipes', lambda: reverse('manage_recipes')),
+        ('api_recipes', lambda: reverse('api_recipes')),
+    ]
+    return scenarios
+
+
+def run_scenario(client, url_factory, requests, warmup=5):
+    for _ in range(warmup):
+        client.get(url_factory(), secure=True)
+
+    latencies, queries, statuses = [], [], set()
+    for _ in range(requests):
+        url = url_factory()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.get(url, secure=True)
+            latencies.append(time.perf_counter() - started)
+        queries.append(len(captured))
+        statuses.add(response.status_code)
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'requests': requests,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': total / requests * 1000,
+        'throughput_rps': requests / total if total else 0,
+        'queries_mean': sum(queries) / requests,
+        'queries_max': max(queries),
+        'statuses': sorted(statuses),
+    }
+
+
+def run_benchmarks(user, requests=100, warmup=5, seed=0, only=None):
+    rng = random.Random(seed)
+    client = Client(HTTP_HOST='localhost')
+    client.force_login(user)
+
+    results = {}
+    for name, url_factory in build_scenarios(user, rng):
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        results[name] = run_scenario(client, url_factory, requests, warmup)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'platform': platform.platform(),
+    }
+
+
+def compare(baseline, current, threshold=10.0):
+    """
+    Per-scenario changes between two result files' 'scenarios'. A scenario
+    regresses when its p95 grows by more than threshold percent or it runs
+    more queries than before.
+    """
+    rows = []
+    for name, new in current.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        change = (new['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 if old['p95_ms'] else 0
+        rows.append({
+            'scenario': name,
+            'p50_ms': (old['p50_ms'], new['p50_ms']),
+            'p95_ms': (old['p95_ms'], new['p95_ms']),
+            'p95_change_pct': change,
+            'queries_mean': (old['queries_mean'], new['queries_mean']),
+            'regressed': change > threshold or new['queries_mean'] > old['queries_mean'],
+        })
+    return rows
@@ -0,0 +1,80 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Every listing is versioned by one or more generation counters. Changing a
+# recipe bumps only the generations whose listings it can appear in, which
+# retires those cached pages without touching the rest.
+ALL = 'all'
+SEARCH = 'search'
+FILTER_GENERATIONS = {
+    'trending': 'trending',
+    'vegetarian': 'vegetarian',
+    'vegan': 'vegan',
+    'gluten-free': 'gluten-free',
+}
+
+
+def listing_cache():
+    return caches[settings.RECIPE_LISTING_CACHE]
+
+
+def normalize_search(search_query):
+    return ' '.join(search_query.split()).lower()
+
+
+def _generation_key(name):
+    return f'recipe-listing:generation:{name}'
+
+
+def _generations(cache, names):
+    keys = [_generation_key(name) for name in names]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # Seed from the clock rather than 0 so that a counter which was
+            # evicted can never line up with pages cached under its old value.
+            cache.add(key, time.time_ns(), timeout=None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def _get_versioned(kind, names, parts, build):
+    cache = listing_cache()
+    version = ':'.join(str(generation) for generation in _generations(cache, names))
+    digest = hashlib.md5('|'.join(parts).encode()).hexdigest()
+    key = f'recipe-listing:{kind}:{digest}:{version}'
+
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value)
+    return value
+
+
+def get_listing(filters, cursor, build):
+    """
+    Return the cached page for these app.filters.RecipeFilters and cursor,
+    calling build() and caching its result on a miss.
+    """
+    return _get_versioned('page', filters.generations(), [filters.key, cursor or ''], build)
+
+
+def get_facets(filters, build):
+    return _get_versioned('facets', filters.generations(), [filters.key], build)
+
+
+def invalidate_listings(*names):
+    cache = listing_cache()
+    for name in names:
+        key = _generation_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def invalidate_all_listings():
+    invalidate_listings(ALL, SEARCH, *FILTER_GENERATIONS.values())
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+# Stored in the database file rather than set per connection
+PERSISTENT_PRAGMAS = ('journal_mode',)
+
+
+def sqlite_pragmas(profile=None):
+    return settings.SQLITE_PRAGMA_PROFILES[profile or settings.SQLITE_PRAGMA_PROFILE]
+
+
+def connection_pragmas(journal_mode):
+    # Changing journal_mode rewrites the file's header, so it is applied
+    # (if at all) before these. synchronous=NORMAL is only safe in WAL mode:
+    # with a rollback journal a power loss could corrupt the database.
+    pragmas = {name: value for name, value in sqlite_pragmas().items() if name not in PERSISTENT_PRAGMAS}
+    if journal_mode.lower() != 'wal' and str(pragmas.get('synchronous', '')).upper() == 'NORMAL':
+        pragmas['synchronous'] = 'FULL'
+    return pragmas
+
+
+def apply_pragmas(cursor, pragmas):
+    # Names and values come from settings, never from requests
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    # Django 4.2's SQLite backend has no init_command, so new connections
+    # are tuned here. With CONN_MAX_AGE this runs once per connection, not
+    # once per request.
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            # By default the first command run would otherwise switch (and
+            # dirty) the checked-in database
+            journal_mode = sqlite_pragmas().get('journal_mode')
+            if settings.SQLITE_SET_JOURNAL_MODE and journal_mode:
+                cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+            else:
+                cursor.execute('PRAGMA journal_mode')
+            apply_pragmas(cursor, connection_pragmas(cursor.fetchone()[0]))
@@ -0,0 +1,88 @@
+import csv
+import json
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Recipe, RecipeMethod
+from .pagination import KeysetPaginator
+
+# Same columns import_recipes reads, so an export can be re-imported as-is
+EXPORT_FIELDS = (
+    'recipe_id', 'title', 'publisher', 'publisher_url', 'source_url', 'image_url',
+    'description', 'social_rank', 'cooking_time', 'is_vegetarian', 'is_vegan',
+    'is_gluten_free', 'created_at', 'updated_at', 'methods',
+)
+
+
+def iter_recipes(since=None, chunk_size=1000):
+    """
+    Yield export records for every recipe (or those updated at or after
+    `since`) in (updated_at, id) order. Each chunk is its own keyset query
+    plus one query for all of its methods, so memory stays flat no matter
+    how large the catalog is.
+    """
+    queryset = Recipe.objects.select_related('publisher')
+    if since is not None:
+        queryset = queryset.filter(updated_at__gte=since)
+    paginator = KeysetPaginator(queryset, ('updated_at', 'id'), chunk_size)
+
+    cursor = None
+    while True:
+        page = paginator.page(cursor)
+        steps = defaultdict(list)
+        methods = (
+            RecipeMethod.objects.filter(recipe_id__in=[recipe.id for recipe in page])
+            .order_by('recipe_id', 'step_number')
+            .values_list('recipe_id', 'instruction')
+        )
+        for recipe_id, instruction in methods:
+            steps[recipe_id].append(instruction)
+
+        for recipe in page:
+            yield {
+                'recipe_id': recipe.recipe_id,
+                'title': recipe.title,
+                'publisher': recipe.publisher.publisher_name,
+                'publisher_url': recipe.publisher.publisher_url,
+                'source_url': recipe.source_url,
+                'image_url': recipe.image_url,
+                'description': recipe.description,
+                'social_rank': recipe.social_rank,
+                'cooking_time': recipe.cooking_time,
+                'is_vegetarian': recipe.is_vegetarian,
+                'is_vegan': recipe.is_vegan,
+                'is_gluten_free': recipe.is_gluten_free,
+                'created_at': recipe.created_at.isoformat(),
+                'updated_at': recipe.updated_at.isoformat(),
+                'methods': steps[recipe.id],
+            }
+
+        if not page.has_next:
+            return
+        cursor = page.next_cursor
+
+
+class Echo:
+    # csv.writer wants a file; this one hands each line straight back
+    def write(self, value):
+        return value
+
+
+def iter_jsonl(records):
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+def iter_csv(records):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for record in records:
+        record = dict(record, methods='\n'.join(record['methods']))
+        yield writer.writerow([record[field] for field in EXPORT_FIELDS])
+
+
+EXPORT_FORMATS = {
+    'jsonl': (iter_jsonl, 'application/x-ndjson'),
+    'csv': (iter_csv, 'text/csv'),
+}
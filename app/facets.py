@@ -0,0 +1,83 @@
+from django.db.models import Count, Q
+
+from .cache import get_facets
+from .filters import DIETS, RELEVANCE, SORTS, time_q
+from .models import Recipe
+from .search import get_search_backend
+
+SORT_LABELS = {
+    RELEVANCE: 'Best match',
+    'popular': 'Popular',
+    'recent': 'Recent',
+    'trending': 'Trending',
+}
+DIET_LABELS = {
+    'vegetarian': 'Vegetarian',
+    'vegan': 'Vegan',
+    'gluten-free': 'Gluten-free',
+}
+# Upper cooking_time bounds offered as "Under N min"
+MAX_TIME_OPTIONS = (15, 30, 60)
+
+
+def _max_time_options(filters):
+    return [minutes for minutes in MAX_TIME_OPTIONS if not filters.min_time or minutes >= filters.min_time]
+
+
+def _count(condition):
+    return Count('id', filter=condition) if condition else Count('id')
+
+
+def count_facets(filters):
+    """
+    How many recipes each option would list, given the rest of the
+    criteria: the current total (which every sort shares), the total with
+    each dietary flag added, and the total under each cooking-time bound in
+    place of the current one. One aggregate query.
+    """
+    recipes = filters.replace(max_time=None).apply(Recipe.objects.order_by())
+    if filters.search:
+        recipes = recipes.filter(id__in=get_search_backend().search(filters.search))
+    current_time = time_q(filters.min_time, filters.max_time)
+    aggregates = {'total': _count(current_time)}
+    for diet, field in DIETS.items():
+        aggregates[field] = _count(Q(**{field: True}) & current_time)
+    for minutes in _max_time_options(filters):
+        aggregates[f'max_time_{minutes}'] = _count(time_q(filters.min_time, minutes))
+    return recipes.aggregate(**aggregates)
+
+
+def filter_facets(filters):
+    """
+    The home filter bar: sort, dietary and cooking-time options with their
+    counts and the canonical URL that selects (or deselects) each.
+    """
+    # Counts don't depend on the sort, so every sort shares them
+    unsorted = filters.replace(sort=None)
+    counts = get_facets(unsorted, lambda: count_facets(unsorted))
+
+    sorts = [RELEVANCE, *SORTS] if filters.search else list(SORTS)
+    return {
+        'sorts': [
+            {
+                'label': SORT_LABELS[sort], 'count': counts['total'], 'active': filters.sort == sort,
+                'url': '?' + filters.replace(sort=sort).query_dict().urlencode(),
+            }
+            for sort in sorts
+        ],
+        'diets': [
+            {
+                'label': DIET_LABELS[diet], 'count': counts[field], 'active': diet in filters.diets,
+                'url': '?' + filters.toggle_diet(diet).query_dict().urlencode(),
+            }
+            for diet, field in DIETS.items()
+        ],
+        'times': [
+            {
+                'label': f'Under {minutes} min', 'count': counts[f'max_time_{minutes}'],
+                'active': filters.max_time == minutes,
+                'url': '?' + filters.replace(max_time=None if filters.max_time == minutes else minutes).query_dict().urlencode(),
+            }
+            for minutes in _max_time_options(filters)
+        ],
+    }
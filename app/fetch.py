@@ -0,0 +1,82 @@
+import ipaddress
+import socket
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from django.conf import settings
+
+MAX_REDIRECTS = 5
+
+
+class ImageFetchError(Exception):
+    pass
+
+
+class ImageTooLarge(ImageFetchError):
+    pass
+
+
+def check_public_url(url):
+    """
+    Raise ImageFetchError unless url is http(s) and every address its host
+    resolves to is public or in IMAGE_FETCH_ALLOWED_NETWORKS. Image URLs
+    come from users, and the server must not fetch internal services (or
+    cloud metadata at 169.254.169.254) on their behalf.
+    """
+    parts = urlsplit(url)
+    try:
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError:
+        raise ImageFetchError(f'Unsupported image URL: {url}')
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ImageFetchError(f'Unsupported image URL: {url}')
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)}
+    except (socket.gaierror, UnicodeError) as e:
+        raise requests.ConnectionError(f'Cannot resolve {parts.hostname}: {e}')
+    allowed = [ipaddress.ip_network(network) for network in settings.IMAGE_FETCH_ALLOWED_NETWORKS]
+    for address in addresses:
+        # Scoped IPv6 addresses carry a %interface suffix
+        address = ipaddress.ip_address(address.split('%')[0])
+        if not address.is_global and not any(address in network for network in allowed):
+            raise ImageFetchError(f'Refusing to fetch {url}: {address} is not a public address')
+
+
+def _get(url, timeout):
+    # Redirects are followed by hand so every hop is checked
+    for _ in range(MAX_REDIRECTS + 1):
+        check_public_url(url)
+        response = requests.get(url, stream=True, timeout=timeout, allow_redirects=False)
+        if not response.is_redirect:
+            return response
+        response.close()
+        url = urljoin(url, response.headers['Location'])
+    raise ImageFetchError(f'Too many redirects fetching {url}')
+
+
+def fetch_image(url, dest, timeout, max_bytes):
+    """
+    Stream the image at url into the open file dest. timeout is a
+    (connect, read) pair; anything over max_bytes is abandoned early.
+    """
+    with _get(url, timeout) as response:
+        response.raise_for_status()
+        if not response.headers.get('Content-Type', '').startswith('image/'):
+            raise ImageFetchError(f'Not an image: {response.headers.get("Content-Type")}')
+        if int(response.headers.get('Content-Length') or 0) > max_bytes:
+            raise ImageTooLarge(f'Image is larger than {max_bytes} bytes')
+
+        size = 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            size += len(chunk)
+            if size > max_bytes:
+                raise ImageTooLarge(f'Image is larger than {max_bytes} bytes')
+            dest.write(chunk)
+    dest.flush()
+
+
+def is_transient(error):
+    # Worth retrying: connection problems and server-side errors
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code >= 500
+    return isinstance(error, requests.RequestException)
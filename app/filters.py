@@ -0,0 +1,208 @@
+from django.db.models import Q
+from django.http import QueryDict
+
+from .cache import ALL, FILTER_GENERATIONS, SEARCH, normalize_search
+
+# Sort keys and the ordering each pages through. Every ordering has an index
+# of its own and one led by publisher, and ends in 'id' so the keyset cursor
+# has a stable tie-breaker.
+SORTS = {
+    'popular': ('-social_rank', '-id'),
+    'recent': ('-created_at', '-id'),
+    'trending': ('-trending_score', '-id'),
+}
+# Search results in the backend's order; only valid with a search term
+RELEVANCE = 'relevance'
+DIETS = {
+    'vegetarian': 'is_vegetarian',
+    'vegan': 'is_vegan',
+    'gluten-free': 'is_gluten_free',
+}
+# The single ?filter= values home used to take, as the criteria they mean
+LEGACY_FILTERS = {
+    'popular': {'sort': 'popular'},
+    'recent': {'sort': 'recent'},
+    'trending': {'sort': 'trending'},
+    'vegetarian': {'diet': 'vegetarian'},
+    'vegan': {'diet': 'vegan'},
+    'gluten-free': {'diet': 'gluten-free'},
+}
+MAX_COOKING_TIME = 24 * 60
+# Largest value SQLite stores in an INTEGER column
+MAX_ID = 2 ** 63 - 1
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+def _parse_minutes(params, name):
+    value = params.get(name, '').strip()
+    if not value:
+        return None
+    try:
+        minutes = int(value)
+    except ValueError:
+        raise InvalidFilter(f'{name} must be a whole number of minutes.')
+    if not 0 <= minutes <= MAX_COOKING_TIME:
+        raise InvalidFilter(f'{name} must be between 0 and {MAX_COOKING_TIME}.')
+    return minutes or None
+
+
+def time_q(min_time=None, max_time=None):
+    # cooking_time 0 means "not given", which no time range matches
+    if not (min_time or max_time):
+        return Q()
+    q = Q(cooking_time__gt=0)
+    if min_time:
+        q &= Q(cooking_time__gte=min_time)
+    if max_time:
+        q &= Q(cooking_time__lte=max_time)
+    return q
+
+
+class RecipeFilters:
+    """
+    Validated listing criteria for home and the JSON API: any combination
+    of dietary flags, a cooking_time range, one publisher, a search term and
+    a sort key. Equivalent query strings give equal filters with the same
+    canonical key. The filters become WHERE clauses on a walk of the sort's
+    index. Combinations that would need a different plan are rejected with
+    InvalidFilter rather than run slowly.
+    """
+
+    def __init__(self, diets=(), min_time=None, max_time=None, publisher=None, sort=None, search=''):
+        self.diets = tuple(sorted(set(diets)))
+        self.min_time = min_time
+        self.max_time = max_time
+        self.publisher = publisher
+        self.search = normalize_search(search)
+        # Relevance for searches; otherwise dietary listings default to
+        # newest first, which their partial indexes are ordered by
+        self.sort = sort or (RELEVANCE if self.search else 'recent' if self.diets else 'popular')
+
+        unknown = [diet for diet in self.diets if diet not in DIETS]
+        if unknown:
+            raise InvalidFilter(f'Unknown diet: {unknown[0]}.')
+        if self.sort != RELEVANCE and self.sort not in SORTS:
+            raise InvalidFilter(f'Unknown sort: {self.sort}.')
+        if self.sort == RELEVANCE and not self.search:
+            raise InvalidFilter('Sorting by relevance needs a search term.')
+        if min_time and max_time and min_time > max_time:
+            raise InvalidFilter('min_time is greater than max_time.')
+
+    @classmethod
+    def from_params(cls, params):
+        diets = [diet.strip() for value in params.getlist('diet') for diet in value.split(',') if diet.strip()]
+        sort = params.get('sort', '').strip() or None
+
+        legacy = params.get('filter', '').strip()
+        if legacy:
+            if legacy not in LEGACY_FILTERS:
+                raise InvalidFilter(f'Unknown filter: {legacy}.')
+            meaning = LEGACY_FILTERS[legacy]
+            if 'diet' in meaning:
+                diets.append(meaning['diet'])
+            sort = sort or meaning.get('sort')
+
+        # A publisher list would need one index walk per publisher and a
+        # merge, i.e. a sort of everything they published
+        publishers = [value for value in params.getlist('publisher') if value.strip()]
+        if len(publishers) > 1 or (publishers and ',' in publishers[0]):
+            raise InvalidFilter('Only one publisher can be selected.')
+        publisher = None
+        if publishers:
+            try:
+                publisher = int(publishers[0])
+            except ValueError:
+                raise InvalidFilter('publisher must be a publisher id.')
+            if not 0 < publisher <= MAX_ID:
+                raise InvalidFilter('publisher must be a publisher id.')
+
+        return cls(
+            diets=diets,
+            min_time=_parse_minutes(params, 'min_time'),
+            max_time=_parse_minutes(params, 'max_time'),
+            publisher=publisher,
+            sort=sort,
+            search=params.get('search', ''),
+        )
+
+    def replace(self, **changes):
+        criteria = {
+            'diets': self.diets, 'min_time': self.min_time, 'max_time': self.max_time,
+            'publisher': self.publisher, 'sort': self.sort, 'search': self.search,
+        }
+        criteria.update(changes)
+        return RecipeFilters(**criteria)
+
+    def toggle_diet(self, diet):
+        diets = set(self.diets) ^ {diet}
+        # Keep an explicit sort, but let a default one follow the new criteria
+        return self.replace(diets=diets, sort=self.sort if self.sort != self._default_sort() else None)
+
+    def _default_sort(self):
+        return RecipeFilters(diets=self.diets, search=self.search).sort
+
+    def query_dict(self, cursor=None):
+        params = QueryDict(mutable=True)
+        if self.search:
+            params['search'] = self.search
+        if self.diets:
+            params['diet'] = ','.join(self.diets)
+        if self.min_time:
+            params['min_time'] = self.min_time
+        if self.max_time:
+            params['max_time'] = self.max_time
+        if self.publisher:
+            params['publisher'] = self.publisher
+        if self.sort != self._default_sort():
+            params['sort'] = self.sort
+        if cursor:
+            params['cursor'] = cursor
+        return params
+
+    @property
+    def key(self):
+        # The resolved sort is always part of the key: ?filter=vegan,
+        # ?diet=vegan and ?diet=vegan&sort=recent are the same listing
+        return '|'.join([
+            ','.join(self.diets), str(self.min_time or ''), str(self.max_time or ''),
+            str(self.publisher or ''), self.sort, self.search,
+        ])
+
+    @property
+    def ordering(self):
+        return SORTS.get(self.sort)
+
+    def apply(self, recipes):
+        # Everything but the search term, which the paginators handle
+        recipes = recipes.filter(**{DIETS[diet]: True for diet in self.diets})
+        if self.publisher:
+            recipes = recipes.filter(publisher_id=self.publisher)
+        return recipes.filter(time_q(self.min_time, self.max_time))
+
+    def generations(self):
+        """
+        Listing cache generations a page for these criteria depends on. Any
+        recipe change bumps ALL and 'trending', so one name covers a listing
+        unless a dietary one, which is bumped less often, can stand in.
+        """
+        names = []
+        if self.diets:
+            # Every recipe in it has the first flag, so changes to it bump that
+            names.append(FILTER_GENERATIONS[self.diets[0]])
+        if self.sort == 'trending':
+            # refresh_trending_scores bumps only 'trending' and SEARCH
+            names.append('trending')
+        if not names:
+            names.append(ALL)
+        if self.search:
+            names.append(SEARCH)
+        return names
+
+    def __eq__(self, other):
+        return isinstance(other, RecipeFilters) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
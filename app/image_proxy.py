@@ -0,0 +1,183 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from PIL import Image, ImageOps
+
+from .fetch import ImageFetchError, fetch_image
+from .tasks import enqueue
+
+SIGNING_SALT = 'app.image_proxy'
+# Hits refresh a file's mtime (its LRU position) at most this often
+TOUCH_INTERVAL = 60 * 60
+# Eviction spares files this new (seconds), which the request that wrote
+# them may not have served yet
+EVICT_GRACE = 60
+
+# Bytes this process has written since it last queued an eviction
+_written = 0
+_written_lock = threading.Lock()
+
+
+def sign_url(url):
+    # Only URLs we signed can be proxied, so the view isn't an open proxy
+    return signing.Signer(salt=SIGNING_SALT).sign_object(url, compress=True)
+
+
+def unsign_url(token):
+    return signing.Signer(salt=SIGNING_SALT).unsign_object(token)
+
+
+def cache_dir():
+    return os.path.join(settings.MEDIA_ROOT, settings.IMAGE_PROXY_DIR)
+
+
+def _url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def _pointer_path(url):
+    # Maps a source URL to the content hash its variants are stored under
+    return os.path.join(cache_dir(), 'sources', _url_key(url))
+
+
+def variant_path(digest, variant):
+    return os.path.join(cache_dir(), digest[:2], f'{digest}-{variant}.jpg')
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _touch(path):
+    if time.time() - os.path.getmtime(path) > TOUCH_INTERVAL:
+        os.utime(path)
+
+
+def resize(image, width, height, crop):
+    if not crop:
+        image = image.copy()
+        image.thumbnail((width, height), Image.LANCZOS)
+        return image
+    # Crop to the variant's aspect ratio, but never upscale small sources
+    scale = min(1, image.width / width, image.height / height)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return ImageOps.fit(image, size, Image.LANCZOS)
+
+
+def render_variants(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        # JPEG has no alpha; flatten onto the white card background
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    else:
+        image = image.convert('RGB')
+
+    for variant, options in settings.IMAGE_PROXY_VARIANTS.items():
+        buffer = io.BytesIO()
+        resize(image, *options['size'], options['crop']).save(
+            buffer, 'JPEG', quality=settings.IMAGE_PROXY_QUALITY, optimize=True, progressive=True,
+        )
+        yield variant, buffer.getvalue()
+
+
+def get_variant(url, variant):
+    """
+    Return (path, digest) of the cached variant of the image at url,
+    fetching the source and rendering every variant on a miss. Raises the
+    fetch or decode error if the image can't be had.
+    """
+    pointer = _pointer_path(url)
+    try:
+        with open(pointer) as f:
+            digest = f.read().strip()
+        path = variant_path(digest, variant)
+        _touch(path)
+        _touch(pointer)
+        return path, digest
+    except FileNotFoundError:
+        pass
+
+    failed_key = f'image-proxy-failed:{_url_key(url)}'
+    if cache.get(failed_key):
+        raise ImageFetchError(f'Recently failed to fetch {url}')
+    try:
+        buffer = io.BytesIO()
+        fetch_image(
+            url, buffer,
+            timeout=(settings.IMAGE_PROXY_CONNECT_TIMEOUT, settings.IMAGE_PROXY_READ_TIMEOUT),
+            max_bytes=settings.IMAGE_PROXY_MAX_SOURCE_BYTES,
+        )
+        data = buffer.getvalue()
+        digest = hashlib.sha256(data).hexdigest()
+        written = len(digest)
+        for name, content in render_variants(data):
+            written += len(content)
+            _write_atomic(variant_path(digest, name), content)
+    except Exception:
+        # Don't hammer a broken host on every page view
+        cache.set(failed_key, True, settings.IMAGE_PROXY_FAILURE_TIMEOUT)
+        raise
+    _write_atomic(pointer, digest.encode())
+    _account(written)
+    return variant_path(digest, variant), digest
+
+
+def _account(size):
+    # Eviction walks the whole cache, so it runs as a background job once
+    # every IMAGE_PROXY_EVICT_EVERY_BYTES written rather than on each miss
+    global _written
+    with _written_lock:
+        _written += size
+        if _written < settings.IMAGE_PROXY_EVICT_EVERY_BYTES:
+            return
+        _written = 0
+    enqueue(evict)
+
+
+def evict(max_bytes=None):
+    """
+    Delete least recently used files until the cache fits in
+    IMAGE_PROXY_MAX_BYTES. A source whose pointer or variant is evicted is
+    simply fetched again on its next request.
+    """
+    if max_bytes is None:
+        max_bytes = settings.IMAGE_PROXY_MAX_BYTES
+    files, total = [], 0
+    spared_since = time.time() - EVICT_GRACE
+    for root, _, names in os.walk(cache_dir()):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            total += stat.st_size
+            if stat.st_mtime < spared_since:
+                files.append((stat.st_mtime, stat.st_size, path))
+    if total <= max_bytes:
+        return
+    files.sort()
+    for _, size, path in files:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        if total <= max_bytes:
+            break
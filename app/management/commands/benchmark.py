@@ -0,0 +1,105 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+from django.utils import timezone
+
+from app.benchmark import compare, environment, generate_catalog, run_benchmarks
+from app.cache import invalidate_all_listings
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Load a seeded synthetic catalog and measure latency, throughput and query counts of the '
+        'main pages; everything is rolled back afterwards'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--publishers', type=int, default=20)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--methods', type=int, default=6, help='Steps per recipe')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=100, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--scenario', action='append', help='Only scenarios starting with this (repeatable)')
+        parser.add_argument('--no-cache', action='store_true', help='Run with every cache disabled')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='Compare against an earlier --output file')
+        parser.add_argument('--threshold', type=float, default=10.0, help='p95 growth (percent) that counts as a regression')
+
+    def handle(self, *args, **options):
+        if options['no_cache']:
+            dummy = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+            with override_settings(CACHES={alias: dummy for alias in settings.CACHES}):
+                scenarios = self.run(options)
+        else:
+            scenarios = self.run(options)
+
+        results = {
+            'created_at': timezone.now().isoformat(),
+            'environment': environment(),
+            'options': {
+                name: options[name]
+                for name in ('publishers', 'recipes', 'methods', 'seed', 'requests', 'warmup', 'no_cache')
+            },
+            'scenarios': scenarios,
+        }
+        self.report(scenarios)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            report_comparison(self.stdout, self.style, baseline, results, options['threshold'])
+
+    def run(self, options):
+        # Everything runs inside one transaction that is rolled back at the end
+        try:
+            with transaction.atomic():
+                user = generate_catalog(options['publishers'], options['recipes'], options['methods'], options['seed'])
+                scenarios = run_benchmarks(
+                    user, options['requests'], options['warmup'], options['seed'], options['scenario'],
+                )
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            # Pages of the rolled-back catalog may still be cached
+            invalidate_all_listings()
+        return scenarios
+
+    def report(self, scenarios):
+        self.stdout.write(
+            f'{"scenario":<22} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>8} {"queries":>8}  status'
+        )
+        for name, result in scenarios.items():
+            self.stdout.write(
+                f'{name:<22} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+                f'{result["throughput_rps"]:>8.0f} {result["queries_mean"]:>8.1f}  '
+                f'{",".join(map(str, result["statuses"]))}'
+            )
+
+
+def report_comparison(stdout, style, baseline, current, threshold):
+    rows = compare(baseline['scenarios'], current['scenarios'], threshold)
+    if baseline.get('options') != current.get('options'):
+        stdout.write(style.WARNING('The runs used different options; differences may not be meaningful.'))
+    stdout.write(f'{"scenario":<22} {"p50 ms":>17} {"p95 ms":>17} {"p95 %":>8} {"queries":>13}')
+    for row in rows:
+        line = (
+            f'{row["scenario"]:<22} {row["p50_ms"][0]:>7.2f} → {row["p50_ms"][1]:<7.2f} '
+            f'{row["p95_ms"][0]:>7.2f} → {row["p95_ms"][1]:<7.2f} {row["p95_change_pct"]:>+7.1f}% '
+            f'{row["queries_mean"][0]:>5.1f} → {row["queries_mean"][1]:<5.1f}'
+        )
+        stdout.write(style.ERROR(line) if row['regressed'] else line)
+    regressions = [row['scenario'] for row in rows if row['regressed']]
+    if regressions:
+        raise CommandError(f'Regressed: {", ".join(regressions)}')
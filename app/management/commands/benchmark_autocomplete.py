@@ -0,0 +1,77 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.autocomplete import RECIPE, AutocompleteIndex
+from app.metrics import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure autocomplete lookups keystroke by keystroke, and incremental updates, '
+        'on an in-memory index of synthetic titles (no database)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--titles', type=int, default=1_000_000)
+        parser.add_argument('--vocabulary', type=int, default=50_000, help='Distinct words to build titles from')
+        parser.add_argument('--queries', type=int, default=2000, help='Titles to type, one keystroke at a time')
+        parser.add_argument('--updates', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = [
+            ''.join(rng.choices(string.ascii_lowercase, k=rng.randrange(3, 11)))
+            for _ in range(options['vocabulary'])
+        ]
+        # Zipf-like word frequencies, as in real titles
+        cum_weights = []
+        total = 0
+        for rank in range(1, len(vocabulary) + 1):
+            total += 1 / rank
+            cum_weights.append(total)
+
+        def title():
+            return ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randrange(2, 6))).title()
+
+        started = time.perf_counter()
+        titles = [title() for _ in range(options['titles'])]
+        index = AutocompleteIndex(limit=8)
+        index.load(((RECIPE, i), label, rng.uniform(0, 100)) for i, label in enumerate(titles))
+        self.stdout.write(
+            f'{options["titles"]} titles, {len(index.words)} distinct words, '
+            f'built in {time.perf_counter() - started:.1f}s'
+        )
+
+        timings = {'first keystroke': [], 'later keystrokes': [], 'all keystrokes': []}
+        for _ in range(options['queries']):
+            typed = rng.choice(titles).lower()
+            for end in range(1, len(typed) + 1):
+                query = typed[:end]
+                started = time.perf_counter()
+                index.suggest(query)
+                duration = time.perf_counter() - started
+                timings['first keystroke' if end == 1 else 'later keystrokes'].append(duration)
+                timings['all keystrokes'].append(duration)
+
+        next_id = len(titles)
+        for _ in range(options['updates']):
+            started = time.perf_counter()
+            if rng.random() < 0.5:
+                index.add((RECIPE, next_id), title(), rng.uniform(0, 100))
+                next_id += 1
+            else:
+                index.remove((RECIPE, rng.randrange(next_id)))
+            timings.setdefault('add or remove', []).append(time.perf_counter() - started)
+
+        self.stdout.write(f'{"":<18} {"count":>8} {"p50":>8} {"p95":>8} {"p99":>8} {"max":>8}  (ms)')
+        for label, values in timings.items():
+            values.sort()
+            self.stdout.write(
+                f'{label:<18} {len(values):>8} {percentile(values, 50) * 1000:>8.3f} '
+                f'{percentile(values, 95) * 1000:>8.3f} {percentile(values, 99) * 1000:>8.3f} '
+                f'{values[-1] * 1000:>8.3f}'
+            )
@@ -0,0 +1,69 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.loader import get_template
+
+from app.fragments import fragment_cache, render_recipe_fragments
+from app.models import Publisher, Recipe, Role, User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare rendering a page of recipe cards with and without the fragment cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        results = []
+        # Everything runs inside one transaction that is rolled back at the end
+        try:
+            with transaction.atomic():
+                results = self.run_scenarios(options['cards'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f'{options["cards"]} cards, median of {options["repeat"]} renders (ms)')
+        for label, timings in results:
+            self.stdout.write(f'  {label:<40} {statistics.median(timings) * 1000:>8.2f}')
+
+    def measure(self, results, label, func, repeat, before=None):
+        timings = []
+        for _ in range(repeat):
+            if before:
+                before()
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        results.append((label, timings))
+
+    def run_scenarios(self, cards, repeat):
+        role, _ = Role.objects.get_or_create(role_name='admin')
+        user = User.objects.create_user('benchmark-card-cache', role=role)
+        publisher = Publisher.objects.create(publisher_name='Benchmark', publisher_url='')
+        Recipe.objects.bulk_create([
+            Recipe(
+                title=f'Benchmark {i}', source_url='https://example.com/', social_rank=0,
+                image_url=f'https://example.com/{i}.jpg', recipe_id=f'benchmark-{i}',
+                publisher=publisher, created_by=user,
+            )
+            for i in range(cards)
+        ])
+        recipes = list(Recipe.objects.select_related('publisher').filter(publisher=publisher))
+
+        template = get_template('recipe-card.html')
+        results = []
+        self.measure(results, 'uncached', lambda: [template.render({'recipe': r}) for r in recipes], repeat)
+        self.measure(
+            results, 'fragment cache, cold', lambda: render_recipe_fragments('recipe-card.html', recipes),
+            repeat, before=fragment_cache().clear,
+        )
+        self.measure(results, 'fragment cache, warm', lambda: render_recipe_fragments('recipe-card.html', recipes), repeat)
+        return results
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from app.methods import create_methods, sync_methods
+from app.models import Publisher, Recipe, RecipeMethod, Role, User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare query counts of per-row and diff-based RecipeMethod writes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--steps', type=int, default=50)
+
+    def handle(self, *args, **options):
+        steps = [f'Step {i} instruction' for i in range(1, options['steps'] + 1)]
+        results = []
+        # Everything runs inside one transaction that is rolled back at the end
+        try:
+            with transaction.atomic():
+                results = self.run_scenarios(steps)
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f'{len(steps)}-step recipe: queries per operation')
+        for label, count in results:
+            self.stdout.write(f'  {label:<40} {count:>5}')
+
+    def measure(self, results, label, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        results.append((label, len(queries)))
+
+    def run_scenarios(self, steps):
+        role, _ = Role.objects.get_or_create(role_name='admin')
+        user = User.objects.create_user('benchmark-method-sync', role=role)
+        publisher = Publisher.objects.create(publisher_name='Benchmark', publisher_url='')
+        naive, synced = [
+            Recipe.objects.create(
+                title=f'Benchmark {i}', source_url='', social_rank=0, image_url='',
+                recipe_id=f'benchmark-{i}', publisher=publisher, created_by=user,
+            )
+            for i in range(2)
+        ]
+
+        def naive_write():
+            naive.methods.all().delete()
+            for i, instruction in enumerate(steps, 1):
+                RecipeMethod.objects.create(recipe=naive, step_number=i, instruction=instruction)
+
+        edited = steps[:10] + ['A rewritten step'] + steps[11:]
+        results = []
+        self.measure(results, 'per-row insert', naive_write)
+        self.measure(results, 'per-row re-insert on edit', naive_write)
+        self.measure(results, 'bulk insert (add_recipe)', lambda: create_methods(synced, steps))
+        self.measure(results, 'sync, nothing changed', lambda: sync_methods(synced, steps))
+        self.measure(results, 'sync, one step rewritten', lambda: sync_methods(synced, edited))
+        self.measure(results, 'sync, one step appended', lambda: sync_methods(synced, edited + ['Serve']))
+        self.measure(results, 'sync, first step removed', lambda: sync_methods(synced, edited[1:]))
+        return results
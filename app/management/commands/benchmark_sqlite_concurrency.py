@@ -0,0 +1,142 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.db import apply_pragmas
+from app.metrics import percentile
+
+# A cut-down app_recipe: enough for the home listing read and the
+# add_recipe/edit_recipe writes to touch the same pages they do for real
+SCHEMA = """
+    CREATE TABLE recipe (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT NOT NULL,
+        social_rank REAL NOT NULL,
+        created_at TEXT NOT NULL
+    );
+    CREATE INDEX recipe_rank_idx ON recipe (social_rank, id);
+    CREATE INDEX recipe_created_idx ON recipe (created_at, id);
+"""
+READ = 'SELECT id, title, description, social_rank FROM recipe ORDER BY social_rank DESC, id DESC LIMIT 24'
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare SQLITE_PRAGMA_PROFILES under concurrent readers and writers, with persistent '
+        'and per-request connections, on a scratch database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', action='append', help='Profiles to compare (default: all)')
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=3)
+        parser.add_argument('--rows', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        profiles = options['profile'] or list(settings.SQLITE_PRAGMA_PROFILES)
+        self.stdout.write(
+            f'{options["readers"]} readers, {options["writers"]} writers, {options["seconds"]:g}s per run'
+        )
+        self.stdout.write(
+            f'{"profile":<10} {"connections":<12} {"reads/s":>9} {"read p95":>9} '
+            f'{"writes/s":>9} {"write p95":>10} {"errors":>7}'
+        )
+        for profile in profiles:
+            for persistent in (True, False):
+                result = self.run(settings.SQLITE_PRAGMA_PROFILES[profile], persistent, options)
+                self.stdout.write(
+                    f'{profile:<10} {"persistent" if persistent else "per request":<12} '
+                    f'{result["reads"]:>9.0f} {result["read_p95"]:>7.1f}ms '
+                    f'{result["writes"]:>9.0f} {result["write_p95"]:>8.1f}ms {result["errors"]:>7}'
+                )
+
+    def run(self, pragmas, persistent, options):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.sqlite3')
+
+            def connect():
+                connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+                apply_pragmas(connection, pragmas)
+                return connection
+
+            setup = connect()
+            setup.executescript(SCHEMA)
+            setup.executemany(
+                'INSERT INTO recipe (title, description, social_rank, created_at) VALUES (?, ?, ?, ?)',
+                [(f'Recipe {i}', 'x' * 500, random.uniform(0, 100), f'2024-01-01T00:00:{i}') for i in range(options['rows'])],
+            )
+            setup.close()
+
+            deadline = time.perf_counter() + options['seconds']
+            latencies = {'read': [], 'write': []}
+            errors = []
+            lock = threading.Lock()
+
+            def read(connection):
+                connection.execute(READ).fetchall()
+
+            def write(connection):
+                connection.execute('BEGIN IMMEDIATE')
+                try:
+                    connection.execute(
+                        'INSERT INTO recipe (title, description, social_rank, created_at) VALUES (?, ?, ?, ?)',
+                        ('New', 'x' * 2000, random.uniform(0, 100), '2024-06-01T00:00:00'),
+                    )
+                    connection.execute(
+                        'UPDATE recipe SET social_rank = ? WHERE id = ?',
+                        (random.uniform(0, 100), random.randrange(1, options['rows'])),
+                    )
+                    connection.execute('COMMIT')
+                except sqlite3.Error:
+                    connection.execute('ROLLBACK')
+                    raise
+
+            def worker(kind, operation):
+                connection = connect() if persistent else None
+                timings = []
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        # Without persistent connections every request pays
+                        # for connecting and for the PRAGMA setup
+                        if persistent:
+                            operation(connection)
+                        else:
+                            per_request = connect()
+                            try:
+                                operation(per_request)
+                            finally:
+                                per_request.close()
+                    except sqlite3.OperationalError as e:
+                        with lock:
+                            errors.append(e)
+                        continue
+                    timings.append(time.perf_counter() - started)
+                if connection:
+                    connection.close()
+                with lock:
+                    latencies[kind].extend(timings)
+
+            threads = [threading.Thread(target=worker, args=('read', read)) for _ in range(options['readers'])]
+            threads += [threading.Thread(target=worker, args=('write', write)) for _ in range(options['writers'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        reads, writes = sorted(latencies['read']), sorted(latencies['write'])
+        return {
+            'reads': len(reads) / options['seconds'],
+            'read_p95': percentile(reads, 95) * 1000 if reads else 0,
+            'writes': len(writes) / options['seconds'],
+            'write_p95': percentile(writes, 95) * 1000 if writes else 0,
+            'errors': len(errors),
+        }
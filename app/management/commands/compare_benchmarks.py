@@ -0,0 +1,21 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from .benchmark import report_comparison
+
+
+class Command(BaseCommand):
+    help = 'Compare two benchmark --output files; fails if any scenario regressed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('baseline')
+        parser.add_argument('current')
+        parser.add_argument('--threshold', type=float, default=10.0, help='p95 growth (percent) that counts as a regression')
+
+    def handle(self, *args, **options):
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        with open(options['current']) as f:
+            current = json.load(f)
+        report_comparison(self.stdout, self.style, baseline, current, options['threshold'])
@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from app.export import EXPORT_FORMATS, iter_recipes
+
+
+class Command(BaseCommand):
+    help = 'Stream every recipe (or those updated since a timestamp) as JSONL or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='jsonl')
+        parser.add_argument('--since', help='Only export recipes updated at or after this ISO timestamp')
+        parser.add_argument('--output', help='File to write (defaults to stdout)')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = parse_datetime(options['since'])
+            except ValueError:
+                # Well formed but impossible, e.g. February 30th
+                since = None
+            if since is None:
+                raise CommandError(f"Invalid --since timestamp: {options['since']}")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        serialize, _ = EXPORT_FORMATS[options['format']]
+        chunks = serialize(iter_recipes(since, options['chunk_size']))
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                f.writelines(chunks)
+        else:
+            sys.stdout.writelines(chunks)
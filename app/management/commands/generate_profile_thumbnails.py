@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from app.models import User
+from app.thumbnails import process_profile_picture
+
+
+class Command(BaseCommand):
+    help = 'Generate profile picture thumbnails for users that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate existing thumbnails too')
+
+    def handle(self, *args, **options):
+        users = User.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True)
+        if not options['force']:
+            users = users.filter(profile_thumbnails_ready=False)
+
+        processed = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            process_profile_picture(user_id)
+            processed += 1
+        ready = User.objects.filter(profile_thumbnails_ready=True).count()
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} pictures; {ready} users have thumbnails.'))
@@ -0,0 +1,213 @@
+import csv
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from app.cache import invalidate_all_listings
+from app.methods import clean_steps
+from app.models import Publisher, Recipe, RecipeMethod, User
+from app.search import get_search_backend
+from app.trending import trending_score
+
+# Columns copied onto Recipe as-is (after type conversion)
+TEXT_FIELDS = ('title', 'source_url', 'image_url', 'description')
+FLAG_FIELDS = ('is_vegetarian', 'is_vegan', 'is_gluten_free')
+UPDATE_FIELDS = TEXT_FIELDS + FLAG_FIELDS + ('social_rank', 'cooking_time', 'publisher', 'updated_at', 'trending_score')
+
+
+def parse_flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y', 'on')
+    return bool(value)
+
+
+def parse_methods(value):
+    # JSONL carries a list of steps; CSV carries one step per line
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.splitlines()
+    return clean_steps(str(step) for step in value)
+
+
+def parse_created_at(value):
+    # Missing means "now"; anything else must be a real ISO 8601 datetime.
+    # parse_datetime raises ValueError for well-formed but impossible dates
+    # (2024-02-30) and returns None for malformed ones.
+    if not value:
+        return None
+    created_at = parse_datetime(str(value))
+    if created_at is None:
+        raise ValueError(f'Invalid created_at: {value}')
+    if timezone.is_naive(created_at):
+        created_at = timezone.make_aware(created_at)
+    return created_at
+
+
+class Command(BaseCommand):
+    help = 'Stream recipes from a JSONL or CSV file into the database, upserting on recipe_id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--offset', type=int, default=0, help='Byte offset to resume from')
+        parser.add_argument('--user', help='Username recorded as created_by (defaults to the first admin)')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('csv' if options['path'].lower().endswith('.csv') else 'jsonl')
+        self.batch_size = options['batch_size']
+        self.created_by = self.get_user(options['user'])
+        # publisher_name -> id for every publisher seen so far
+        self.publishers = dict(Publisher.objects.values_list('publisher_name', 'id'))
+
+        started = time.monotonic()
+        imported = skipped = 0
+        batch, offset = [], options['offset']
+        with open(options['path'], 'rb') as f:
+            reader = self.read_csv if fmt == 'csv' else self.read_jsonl
+            for record, end in reader(f, options['offset']):
+                row = self.clean(record)
+                if row is None:
+                    skipped += 1
+                    self.stderr.write(f'Skipping invalid record ending at byte {end}')
+                else:
+                    batch.append(row)
+                if len(batch) >= self.batch_size:
+                    imported += self.write_batch(batch)
+                    batch, offset = [], end
+                    self.report(imported, started, offset)
+            if batch:
+                imported += self.write_batch(batch)
+                offset = f.tell()
+
+        # bulk writes bypass the model signals that normally do this
+        invalidate_all_listings()
+        self.report(imported, started, offset)
+        self.stdout.write(self.style.SUCCESS(f'Imported {imported} recipes ({skipped} skipped).'))
+
+    def get_user(self, username):
+        users = User.objects.all()
+        if username:
+            users = users.filter(username=username)
+        else:
+            users = users.filter(role__role_name='admin').order_by('id')
+        user = users.first()
+        if user is None:
+            raise CommandError('No user to record as created_by; pass --user.')
+        return user
+
+    def read_jsonl(self, f, offset):
+        f.seek(offset)
+        for line in iter(f.readline, b''):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield record, f.tell()
+
+    def read_csv(self, f, offset):
+        header = next(csv.reader([f.readline().decode('utf-8-sig')]))
+        if offset:
+            f.seek(offset)
+        lines = (line.decode('utf-8') for line in iter(f.readline, b''))
+        # csv.reader pulls lines on demand, so f.tell() after each row is
+        # the offset just past it, even for quoted multi-line fields.
+        for values in csv.reader(lines):
+            if values:
+                yield dict(zip(header, values)), f.tell()
+
+    def clean(self, record):
+        if not isinstance(record, dict):
+            return None
+        recipe_id = str(record.get('recipe_id') or '').strip()
+        title = str(record.get('title') or '').strip()
+        publisher_name = str(record.get('publisher') or record.get('publisher_name') or '').strip()
+        if not recipe_id or not title or not publisher_name:
+            return None
+        try:
+            row = {
+                'recipe_id': recipe_id,
+                'publisher_name': publisher_name,
+                'publisher_url': str(record.get('publisher_url') or ''),
+                'social_rank': float(record.get('social_rank') or 0),
+                'cooking_time': int(record.get('cooking_time') or 0),
+                'methods': parse_methods(record.get('methods')),
+                'created_at': parse_created_at(record.get('created_at')),
+            }
+        except (TypeError, ValueError):
+            return None
+        for field in TEXT_FIELDS:
+            row[field] = str(record.get(field) or '')
+        row['title'] = title
+        for field in FLAG_FIELDS:
+            row[field] = parse_flag(record.get(field))
+        return row
+
+    def resolve_publishers(self, batch):
+        missing = {}
+        for row in batch:
+            if row['publisher_name'] not in self.publishers:
+                missing.setdefault(row['publisher_name'], row['publisher_url'])
+        if missing:
+            created = Publisher.objects.bulk_create([
+                Publisher(publisher_name=name, publisher_url=url) for name, url in missing.items()
+            ])
+            self.publishers.update((publisher.publisher_name, publisher.id) for publisher in created)
+
+    @transaction.atomic
+    def write_batch(self, batch):
+        # Later rows win when a file repeats a recipe_id
+        rows = {row['recipe_id']: row for row in batch}
+        self.resolve_publishers(rows.values())
+        # recipe_id -> (id, created_at); updates keep the stored created_at
+        existing = {
+            recipe_id: (pk, created_at)
+            for recipe_id, pk, created_at in Recipe.objects.filter(recipe_id__in=rows).values_list('recipe_id', 'id', 'created_at')
+        }
+
+        now = timezone.now()
+        to_create, to_update = [], []
+        for recipe_id, row in rows.items():
+            recipe = Recipe(
+                recipe_id=recipe_id,
+                publisher_id=self.publishers[row['publisher_name']],
+                created_by=self.created_by,
+                social_rank=row['social_rank'],
+                cooking_time=row['cooking_time'],
+                updated_at=now,
+                **{field: row[field] for field in TEXT_FIELDS + FLAG_FIELDS},
+            )
+            if recipe_id in existing:
+                recipe.id, recipe.created_at = existing[recipe_id]
+            elif row['created_at']:
+                recipe.created_at = row['created_at']
+            # bulk writes skip Recipe.save(), which normally does this
+            recipe.trending_score = trending_score(recipe.social_rank, recipe.created_at)
+            (to_update if recipe.id else to_create).append(recipe)
+
+        if to_update:
+            Recipe.objects.bulk_update(to_update, UPDATE_FIELDS)
+            RecipeMethod.objects.filter(recipe_id__in=[recipe.id for recipe in to_update]).delete()
+        created = Recipe.objects.bulk_create(to_create)
+
+        recipes = to_update + created
+        RecipeMethod.objects.bulk_create([
+            RecipeMethod(recipe_id=recipe.id, step_number=number, instruction=instruction)
+            for recipe in recipes
+            for number, instruction in enumerate(rows[recipe.recipe_id]['methods'], 1)
+        ])
+        get_search_backend().index_recipes(recipe.id for recipe in recipes)
+        return len(recipes)
+
+    def report(self, imported, started, offset):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stdout.write(
+            f'{imported} recipes, {imported / elapsed:.0f} rows/sec; '
+            f'resume with --offset {offset}'
+        )
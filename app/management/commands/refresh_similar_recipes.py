@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.similar import refresh_similar_recipes
+
+
+class Command(BaseCommand):
+    help = (
+        'Precompute the similar recipes shown on each recipe page, for recipes changed since '
+        'the last run (or all of them with --full)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every recipe')
+        parser.add_argument('--count', type=int, help='Neighbours per recipe (default: SIMILAR_RECIPES_COUNT)')
+        parser.add_argument('--chunk-size', type=int, help='Rows per matrix product (default: SIMILAR_RECIPES_CHUNK_SIZE)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        run = refresh_similar_recipes(full=options['full'], k=options['count'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Recomputed similar recipes for {run.recomputed} recipes '
+            f'({"full" if run.full else "incremental"} run, {time.perf_counter() - started:.1f}s).'
+        ))
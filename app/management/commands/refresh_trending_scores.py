@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from app.cache import SEARCH, invalidate_listings
+from app.models import Recipe
+from app.pagination import KeysetPaginator
+from app.trending import trending_score
+
+
+class Command(BaseCommand):
+    help = 'Recompute stored trending scores, writing only the recipes whose score moved'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        queryset = Recipe.objects.only('id', 'social_rank', 'created_at', 'trending_score')
+        paginator = KeysetPaginator(queryset, ('id',), options['chunk_size'])
+
+        checked = changed = 0
+        cursor = None
+        while True:
+            page = paginator.page(cursor)
+            moved = []
+            for recipe in page:
+                score = trending_score(recipe.social_rank, recipe.created_at)
+                if abs(score - recipe.trending_score) > 1e-9:
+                    recipe.trending_score = score
+                    moved.append(recipe)
+            # bulk_update leaves updated_at alone, so exports and ETags don't churn
+            Recipe.objects.bulk_update(moved, ['trending_score'])
+            checked += len(page)
+            changed += len(moved)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+
+        if changed:
+            invalidate_listings('trending', SEARCH)
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} recipes; updated {changed} trending scores.'))
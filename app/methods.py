@@ -0,0 +1,51 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RecipeMethod
+
+
+def clean_steps(instructions):
+    return [instruction.strip() for instruction in instructions if instruction.strip()]
+
+
+def create_methods(recipe, instructions):
+    # A new recipe has nothing to diff against: insert every step at once
+    return RecipeMethod.objects.bulk_create([
+        RecipeMethod(recipe=recipe, step_number=number, instruction=instruction)
+        for number, instruction in enumerate(clean_steps(instructions), 1)
+    ])
+
+
+@transaction.atomic
+def sync_methods(recipe, instructions):
+    """
+    Make the recipe's methods match the submitted instructions, numbered
+    from 1. Steps are compared by position and only the difference is
+    written: one bulk INSERT for new steps, one bulk UPDATE for changed
+    ones and one DELETE for steps that were removed.
+    """
+    steps = clean_steps(instructions)
+    existing = list(recipe.methods.order_by('step_number'))
+
+    now = timezone.now()
+    to_create, to_update = [], []
+    for number, instruction in enumerate(steps, 1):
+        if number <= len(existing):
+            method = existing[number - 1]
+            if method.step_number != number or method.instruction != instruction:
+                method.step_number = number
+                method.instruction = instruction
+                # bulk_update skips auto_now
+                method.updated_at = now
+                to_update.append(method)
+        else:
+            to_create.append(RecipeMethod(recipe=recipe, step_number=number, instruction=instruction))
+    to_delete = [method.id for method in existing[len(steps):]]
+
+    if to_delete:
+        RecipeMethod.objects.filter(id__in=to_delete).delete()
+    if to_update:
+        RecipeMethod.objects.bulk_update(to_update, ['step_number', 'instruction', 'updated_at'])
+    if to_create:
+        RecipeMethod.objects.bulk_create(to_create)
+    return len(to_create), len(to_update), len(to_delete)
@@ -0,0 +1,146 @@
+import heapq
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+# Metrics of the request being handled, if it's being measured
+_current = ContextVar('request_metrics', default=None)
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class RequestMetrics:
+    """
+    Totals for one request. Installed as a connection execute wrapper, it
+    times every query and keeps the slowest few for the slow-request log.
+    """
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.slowest_queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.sql_count += 1
+            self.sql_time += duration
+            if len(self.slowest_queries) < settings.REQUEST_METRICS_SLOWEST_QUERIES:
+                heapq.heappush(self.slowest_queries, (duration, sql))
+            else:
+                heapq.heappushpop(self.slowest_queries, (duration, sql))
+
+    def activate(self):
+        return _current.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        _current.reset(token)
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.sql_count} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f};desc="Templates"',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+_templates_instrumented = False
+
+
+def instrument_templates():
+    """
+    Time top-level template renders of measured requests. Templates
+    rendered while another is rendering (includes, cached fragments) are
+    part of the outer render's time.
+    """
+    global _templates_instrumented
+    if _templates_instrumented:
+        return
+    from django.template.backends.django import Template
+
+    render = Template.render
+
+    @wraps(render)
+    def timed_render(self, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is None or metrics.template_depth:
+            return render(self, *args, **kwargs)
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            metrics.template_depth -= 1
+            metrics.template_time += time.perf_counter() - started
+
+    Template.render = timed_render
+    _templates_instrumented = True
+
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.recent = deque(maxlen=settings.REQUEST_METRICS_SAMPLES)
+
+    def add(self, metrics, total):
+        self.count += 1
+        self.total_time += total
+        self.max_time = max(self.max_time, total)
+        self.sql_count += metrics.sql_count
+        self.sql_time += metrics.sql_time
+        self.template_time += metrics.template_time
+        self.recent.append(total)
+
+    def summary(self):
+        recent = sorted(self.recent)
+        return {
+            'requests': self.count,
+            'mean_ms': self.total_time / self.count * 1000,
+            'p50_ms': percentile(recent, 50) * 1000,
+            'p95_ms': percentile(recent, 95) * 1000,
+            'max_ms': self.max_time * 1000,
+            'queries_mean': self.sql_count / self.count,
+            'sql_mean_ms': self.sql_time / self.count * 1000,
+            'template_mean_ms': self.template_time / self.count * 1000,
+        }
+
+
+# URL name -> RouteStats, for this process since it started
+_routes = {}
+_routes_lock = threading.Lock()
+
+
+def record(route, metrics, total):
+    with _routes_lock:
+        if route not in _routes:
+            _routes[route] = RouteStats()
+        _routes[route].add(metrics, total)
+
+
+def route_stats():
+    with _routes_lock:
+        return {route: stats.summary() for route, stats in sorted(_routes.items())}
+
+
+def reset_stats():
+    with _routes_lock:
+        _routes.clear()
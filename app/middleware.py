@@ -0,0 +1,86 @@
+import cProfile
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metrics import RequestMetrics, instrument_templates, record
+from .profiling import profile_trigger, save_capture
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware:
+    """
+    Measure each request's SQL (count and time), template rendering and
+    total time. Report them in a Server-Timing header, log requests slower
+    than REQUEST_METRICS_SLOW_MS with their slowest queries and aggregate
+    them per URL name for the request_stats view. With
+    REQUEST_METRICS_ENABLED off, Django drops the middleware at startup.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = metrics.activate()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            metrics.deactivate(token)
+        total = time.perf_counter() - started
+
+        response['Server-Timing'] = metrics.server_timing(total)
+        match = request.resolver_match
+        route = match.view_name if match else 'unresolved'
+        record(route, metrics, total)
+        if total * 1000 >= settings.REQUEST_METRICS_SLOW_MS:
+            queries = '\n'.join(
+                f'  {duration * 1000:.1f}ms {sql}' for duration, sql in sorted(metrics.slowest_queries, reverse=True)
+            )
+            logger.warning(
+                'Slow request %s %s (%s): %.0fms, %d queries in %.0fms, templates %.0fms\n%s',
+                request.method, request.path, route, total * 1000,
+                metrics.sql_count, metrics.sql_time * 1000, metrics.template_time * 1000, queries,
+            )
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Run the view under cProfile when app.profiling.profile_trigger asks for
+    it, and store the capture for the profiles page. It must come last in
+    MIDDLEWARE: calling the view from process_view skips the process_view
+    of any middleware after it, CSRF checks included.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        trigger = profile_trigger(request)
+        if trigger is None:
+            return None
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            response = profiler.runcall(view_func, request, *view_args, **view_kwargs)
+        finally:
+            # Failed requests are worth a look too
+            capture_id = save_capture(profiler, request, trigger, time.perf_counter() - started)
+        response['X-Profile-Id'] = capture_id
+        return response
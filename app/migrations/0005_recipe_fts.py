@@ -0,0 +1,40 @@
+from django.db import migrations
+
+FTS_TABLE = 'app_recipe_fts'
+
+INDEX_SELECT = """
+    SELECT r.id, r.title, r.description, p.publisher_name,
+           COALESCE((SELECT group_concat(m.instruction, ' ')
+                     FROM app_recipemethod m WHERE m.recipe_id = r.id), '')
+    FROM app_recipe r
+    JOIN app_publisher p ON p.id = r.publisher_id
+"""
+
+
+def create_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+        f"title, description, publisher_name, instructions, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        f'INSERT INTO {FTS_TABLE} (rowid, title, description, publisher_name, instructions) {INDEX_SELECT}'
+    )
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_alter_recipe_options_recipe_cooking_time_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
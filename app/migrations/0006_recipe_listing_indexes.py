@@ -0,0 +1,41 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_recipe_fts'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipe',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['social_rank', 'id'], name='recipe_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['created_at', 'id'], name='recipe_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('is_vegetarian', True)), fields=['created_at', 'id'], name='recipe_vegetarian_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('is_vegan', True)), fields=['created_at', 'id'], name='recipe_vegan_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('is_gluten_free', True)), fields=['created_at', 'id'], name='recipe_gluten_free_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipemethod',
+            index=models.Index(fields=['recipe', 'step_number'], name='method_recipe_step_idx'),
+        ),
+    ]
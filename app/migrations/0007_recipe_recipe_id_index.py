@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_recipe_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='recipe_id',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_recipe_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='publisher',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='recipemethod',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
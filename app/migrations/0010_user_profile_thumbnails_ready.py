@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_publisher_method_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='profile_thumbnails_ready',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+from app.trending import trending_score
+
+
+def populate_trending_scores(apps, schema_editor):
+    Recipe = apps.get_model('app', 'Recipe')
+    recipes = list(Recipe.objects.only('social_rank', 'created_at'))
+    for recipe in recipes:
+        recipe.trending_score = trending_score(recipe.social_rank, recipe.created_at)
+    Recipe.objects.bulk_update(recipes, ['trending_score'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_user_profile_thumbnails_ready'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['trending_score', 'id'], name='recipe_trending_idx'),
+        ),
+        migrations.RunPython(populate_trending_scores, migrations.RunPython.noop),
+    ]
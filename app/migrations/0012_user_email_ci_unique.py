@@ -0,0 +1,49 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:57
+
+import logging
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_email_collisions(apps, schema_editor):
+    # Emails that differ only in case would break the new constraint. Each
+    # one stays with the account that logged in last (then the oldest);
+    # the others have their email cleared, and can still log in by username
+    # and set a new one. Every cleared account is logged as a warning
+    # (logger app.migrations.0012_user_email_ci_unique) with its id and the
+    # address it lost; afterwards they are among the accounts whose email is
+    # empty, User.objects.filter(email='').
+    User = apps.get_model('app', 'User')
+    accounts = defaultdict(list)
+    for user in User.objects.exclude(email='').only('id', 'username', 'email', 'last_login'):
+        accounts[user.email.lower()].append(user)
+    for email, users in accounts.items():
+        if len(users) < 2:
+            continue
+        users.sort(key=lambda user: (-user.last_login.timestamp() if user.last_login else float('inf'), user.id))
+        keeper, *others = users
+        User.objects.filter(id__in=[user.id for user in others]).update(email='')
+        for user in others:
+            logger.warning(
+                'Cleared email %s on user %s (id %s); it stays with user %s (id %s).',
+                user.email, user.username, user.id, keeper.username, keeper.id,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_recipe_trending_score'),
+    ]
+
+    operations = [
+        migrations.RunPython(resolve_email_collisions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), condition=models.Q(('email', ''), _negated=True), name='user_email_ci_unique'),
+        ),
+    ]
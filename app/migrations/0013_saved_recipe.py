@@ -0,0 +1,34 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_user_email_ci_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SavedRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.recipe')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='saved_recipes',
+            field=models.ManyToManyField(related_name='saved_by', through='app.SavedRecipe', to='app.recipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='savedrecipe',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='saved_recipe_user_recipe_unique'),
+        ),
+    ]
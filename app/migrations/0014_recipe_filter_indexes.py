@@ -0,0 +1,35 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_saved_recipe'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='publisher',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='app.publisher'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['publisher', 'social_rank', 'id'], name='recipe_publisher_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['publisher', 'created_at', 'id'], name='recipe_publisher_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['publisher', 'trending_score', 'id'], name='recipe_publisher_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['is_vegetarian', 'is_vegan', 'is_gluten_free', 'cooking_time'], name='recipe_facet_idx'),
+        ),
+    ]
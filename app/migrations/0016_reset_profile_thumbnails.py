@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def reset_thumbnails(apps, schema_editor):
+    # Thumbnails used to be named after the upload's stem only; profiles
+    # show the original until generate_profile_thumbnails writes them again
+    User = apps.get_model('app', 'User')
+    User.objects.filter(profile_thumbnails_ready=True).update(profile_thumbnails_ready=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_similar_recipes'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_thumbnails, migrations.RunPython.noop),
+    ]
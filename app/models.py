@@ -1,6 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser, UserManager as DjangoUserManager
+from django.db.models.functions import Lower
 from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .trending import trending_score
 
 class Role(models.Model):
     role_name = models.CharField(max_length=100)
@@ -21,24 +25,67 @@ class CustomUserManager(DjangoUserManager):
             extra_fields['role'] = role
         return super().create_superuser(username, email, password, **extra_fields)
 
+    def email_q(self, email):
+        # Spelled exactly like user_email_ci_unique so lookups can use it
+        return models.Q(email_lower=email.lower()) & ~models.Q(email='')
+
+    def with_email(self, email):
+        return self.alias(email_lower=Lower('email')).filter(self.email_q(email))
+
 class User(AbstractUser):
     profile_picture = models.ImageField(upload_to='profile_pics/', null=True, blank=True)
     role = models.ForeignKey(Role, on_delete=models.CASCADE)
+    profile_thumbnails_ready = models.BooleanField(default=False)
+    saved_recipes = models.ManyToManyField('Recipe', through='SavedRecipe', related_name='saved_by')
 
     objects = CustomUserManager()
 
+    @cached_property
+    def is_admin(self):
+        return self.role.role_name == 'admin'
+
     @property
     def profile_picture_url(self):
         if self.profile_picture and hasattr(self.profile_picture, 'url'):
             return self.profile_picture.url
         return '/static/assets/image.jpg'
 
+    def profile_thumbnail_url(self, size, fmt='jpeg'):
+        # Falls back to the original until app.thumbnails has processed it
+        if not self.profile_thumbnails_ready:
+            return self.profile_picture_url
+        from .thumbnails import thumbnail_name
+        return self.profile_picture.storage.url(thumbnail_name(self.profile_picture.name, size, fmt))
+
+    @property
+    def profile_picture_small_url(self):
+        return self.profile_thumbnail_url('small')
+
+    @property
+    def profile_picture_small_webp_url(self):
+        return self.profile_thumbnail_url('small', 'webp')
+
+    @property
+    def profile_picture_large_url(self):
+        return self.profile_thumbnail_url('large')
+
+    @property
+    def profile_picture_large_webp_url(self):
+        return self.profile_thumbnail_url('large', 'webp')
+
     def __str__(self):
         return self.username
 
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # Emails log users in, so at most one account may own each one
+            models.UniqueConstraint(Lower('email'), name='user_email_ci_unique', condition=~models.Q(email='')),
+        ]
+
 class Publisher(models.Model):
     publisher_name = models.CharField(max_length=100)
     publisher_url = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.publisher_name
@@ -48,8 +95,9 @@ class Recipe(models.Model):
     source_url = models.CharField(max_length=255)
     social_rank = models.FloatField()
     image_url = models.CharField(max_length=255)
-    recipe_id = models.CharField(max_length=100)
-    publisher = models.ForeignKey(Publisher, on_delete=models.CASCADE)
+    recipe_id = models.CharField(max_length=100, db_index=True)
+    # Indexed by the publisher listing indexes below
+    publisher = models.ForeignKey(Publisher, on_delete=models.CASCADE, db_index=False)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
@@ -58,20 +106,105 @@ class Recipe(models.Model):
     is_gluten_free = models.BooleanField(default=False)
     cooking_time = models.IntegerField(default=0)
     description = models.TextField(blank=True)
+    # Maintained by save(); see app.trending
+    trending_score = models.FloatField(default=0)
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.trending_score = trending_score(self.social_rank, self.created_at)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'social_rank', 'created_at'}.isdisjoint(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'trending_score'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember which listings the stored row belonged to, so an edit can
+        # invalidate the ones it leaves as well as the ones it joins.
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values)
+            if name in ('created_at', 'is_vegetarian', 'is_vegan', 'is_gluten_free')
+        }
+        return instance
+
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        # One index per listing order in home. The dietary ones are partial,
+        # so each filter reads its rows already sorted from a small index.
+        indexes = [
+            models.Index(fields=['social_rank', 'id'], name='recipe_rank_idx'),
+            models.Index(fields=['created_at', 'id'], name='recipe_created_idx'),
+            models.Index(fields=['updated_at', 'id'], name='recipe_updated_idx'),
+            models.Index(fields=['trending_score', 'id'], name='recipe_trending_idx'),
+            models.Index(fields=['created_at', 'id'], name='recipe_vegetarian_idx', condition=models.Q(is_vegetarian=True)),
+            models.Index(fields=['created_at', 'id'], name='recipe_vegan_idx', condition=models.Q(is_vegan=True)),
+            models.Index(fields=['created_at', 'id'], name='recipe_gluten_free_idx', condition=models.Q(is_gluten_free=True)),
+            # A publisher's listings, one per sort (see app.filters)
+            models.Index(fields=['publisher', 'social_rank', 'id'], name='recipe_publisher_rank_idx'),
+            models.Index(fields=['publisher', 'created_at', 'id'], name='recipe_publisher_created_idx'),
+            models.Index(fields=['publisher', 'trending_score', 'id'], name='recipe_publisher_trending_idx'),
+            # Covers the facet counts (app.facets), which then read this
+            # narrow index instead of every recipe row
+            models.Index(fields=['is_vegetarian', 'is_vegan', 'is_gluten_free', 'cooking_time'], name='recipe_facet_idx'),
+        ]
+
+class SavedRecipe(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            # Its index answers "has this user saved these recipes" directly
+            models.UniqueConstraint(fields=['user', 'recipe'], name='saved_recipe_user_recipe_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.recipe}"
 
 class RecipeMethod(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='methods')
     step_number = models.IntegerField()
     instruction = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['step_number']
+        indexes = [
+            models.Index(fields=['recipe', 'step_number'], name='method_recipe_step_idx'),
+        ]
 
     def __str__(self):
         return f"{self.recipe.title} - Step {self.step_number}"
+
+class SimilarRecipe(models.Model):
+    # Precomputed by app.similar; recipe_detail reads a recipe's rows in rank order
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='similar_recipes', db_index=False)
+    # Cleared when the neighbour is deleted, so the next run recomputes the list
+    similar = models.ForeignKey(Recipe, on_delete=models.SET_NULL, null=True, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            # Its index is the (recipe, rank) walk recipe_detail does
+            models.UniqueConstraint(fields=['recipe', 'rank'], name='similar_recipe_rank_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.recipe} ~ {self.similar}"
+
+class SimilarityRun(models.Model):
+    # The next incremental run recomputes recipes updated since started_at
+    started_at = models.DateTimeField()
+    full = models.BooleanField(default=False)
+    recomputed = models.IntegerField(default=0)
+
+    class Meta:
+        get_latest_by = 'started_at'
+
+    def __str__(self):
+        return f"{self.started_at:%Y-%m-%d %H:%M} ({self.recomputed} recipes)"
@@ -0,0 +1,187 @@
+import base64
+import datetime
+import json
+import math
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from .filters import MAX_ID
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder rounds to milliseconds; a seek value must be exact
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _seekable(value):
+    # Values the database can compare against without overflowing
+    if isinstance(value, int):
+        return -MAX_ID <= value <= MAX_ID
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return True
+
+
+def encode_cursor(data):
+    raw = json.dumps(data, cls=CursorEncoder, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    # Tampered or stale cursors just fall back to the first page
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.next_url = None
+        self.previous_url = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination that seeks past the last row seen instead of using
+    OFFSET, so every page costs the same. The ordering must end with a
+    unique field (normally '-id') to break ties.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.keys = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def _key_values(self, obj):
+        return [getattr(obj, name) for name, _ in self.keys]
+
+    def _cursor(self, obj, direction):
+        return encode_cursor({'s': self.ordering, 'k': self._key_values(obj), 'd': direction})
+
+    def _seek(self, values, backwards):
+        # (a, b) after (x, y) == a > x OR (a = x AND b > y), flipped per
+        # descending key and again when paging backwards.
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(self.keys, values):
+            lookup = 'lt' if descending != backwards else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        # The redundant bound on the leading key lets the database start an
+        # index range scan at the cursor instead of filtering from the top.
+        name, descending = self.keys[0]
+        lookup = 'lte' if descending != backwards else 'gte'
+        return Q(**{f'{name}__{lookup}': values[0]}) & condition
+
+    def _parse(self, data):
+        if not data or data.get('s') != list(self.ordering) or data.get('d') not in ('n', 'p'):
+            return None
+        values = data.get('k')
+        if not isinstance(values, list) or len(values) != len(self.keys):
+            return None
+        model = self.queryset.model
+        try:
+            values = [model._meta.get_field(name).to_python(value) for (name, _), value in zip(self.keys, values)]
+        except (ValidationError, TypeError, ValueError):
+            return None
+        return values if all(map(_seekable, values)) else None
+
+    def page(self, cursor=None):
+        data = decode_cursor(cursor)
+        values = self._parse(data)
+        backwards = values is not None and data['d'] == 'p'
+
+        queryset = self.queryset.order_by(*self.ordering)
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, backwards))
+            if backwards:
+                queryset = queryset.reverse()
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows)
+
+        if backwards:
+            next_cursor = self._cursor(rows[-1], 'n')
+            previous_cursor = self._cursor(rows[0], 'p') if has_more else None
+        else:
+            next_cursor = self._cursor(rows[-1], 'n') if has_more else None
+            previous_cursor = self._cursor(rows[0], 'p') if values is not None else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+class RankedPaginator:
+    """
+    Pages through a precomputed ranking (e.g. search relevance). The ranking
+    is capped by the search backend, so the cursor is simply an offset.
+    """
+
+    def __init__(self, queryset, ranked_ids, per_page):
+        self.queryset = queryset
+        self.ranked_ids = ranked_ids
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        data = decode_cursor(cursor) or {}
+        offset = data.get('o')
+        if not isinstance(offset, int) or offset < 0:
+            offset = 0
+
+        matching = set(self.queryset.filter(id__in=self.ranked_ids).values_list('id', flat=True))
+        ids = [recipe_id for recipe_id in self.ranked_ids if recipe_id in matching]
+        page_ids = ids[offset:offset + self.per_page]
+        objects = self.queryset.in_bulk(page_ids)
+        rows = [objects[recipe_id] for recipe_id in page_ids if recipe_id in objects]
+
+        end = offset + self.per_page
+        next_cursor = encode_cursor({'o': end}) if end < len(ids) else None
+        previous_cursor = encode_cursor({'o': max(offset - self.per_page, 0)}) if offset else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+def page_urls(request, page):
+    # Build links that keep the other query parameters (search, filter) intact
+    for attr in ('next', 'previous'):
+        cursor = getattr(page, f'{attr}_cursor')
+        if cursor is not None:
+            params = request.GET.copy()
+            params['cursor'] = cursor
+            setattr(page, f'{attr}_url', '?' + params.urlencode())
+    return page
+
+
+def paginate(request, paginator):
+    # Fetch the page named by ?cursor= along with its links
+    return page_urls(request, paginator.page(request.GET.get('cursor')))
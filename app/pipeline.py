@@ -1,7 +1,7 @@
-from urllib.request import urlopen
-from django.core.files import File
-from django.core.files.temp import NamedTemporaryFile
-import os
+from django.db import transaction
+
+from .avatars import download_avatar
+from .tasks import enqueue
 
 def get_avatar(backend, strategy, details, response, user=None, *args, **kwargs):
     if backend.name == 'google-oauth2':
@@ -9,20 +9,10 @@ def get_avatar(backend, strategy, details, response, user=None, *args, **kwargs)
             # Update user's profile picture from Google
             picture_url = response.get('picture')
             if not user.profile_picture or user.profile_picture.name == '':
-                try:
-                    # Download the image
-                    img_temp = NamedTemporaryFile(delete=True)
-                    img_temp.write(urlopen(picture_url).read())
-                    img_temp.flush()
-                    
-                    # Save the image to the user's profile
-                    user.profile_picture.save(
-                        f"google_avatar_{user.id}.jpg",
-                        File(img_temp),
-                        save=True
-                    )
-                except Exception as e:
-                    print(f"Error downloading Google avatar: {str(e)}")
+                # Download in the background so a slow image host can't hold
+                # up the login; the default picture shows until it lands.
+                user_id = user.id
+                transaction.on_commit(lambda: enqueue(download_avatar, user_id, picture_url))
 
         # Update user's additional information if available
         if user and not user.first_name and not user.last_name:
@@ -30,5 +20,6 @@ def get_avatar(backend, strategy, details, response, user=None, *args, **kwargs)
                 user.first_name = response.get('given_name')
             if response.get('family_name'):
                 user.last_name = response.get('family_name')
-            user.save()
+            # Only these fields, so a finished avatar job isn't overwritten
+            user.save(update_fields=['first_name', 'last_name'])
     return None 
\ No newline at end of file
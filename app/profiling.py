@@ -0,0 +1,117 @@
+import io
+import json
+import os
+import pstats
+import random
+import re
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+SIGNING_SALT = 'app.profiling'
+TOKEN_VALUE = 'profile'
+# Query flag (?_profile=...) and header that ask for a profile
+QUERY_PARAM = '_profile'
+HEADER = 'X-Profile'
+CAPTURE_ID = re.compile(r'^[\w-]+$')
+
+
+def profile_token():
+    # Lets a request be profiled without an admin session, e.g. from curl
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign(TOKEN_VALUE)
+
+
+def _valid_token(token):
+    try:
+        value = signing.TimestampSigner(salt=SIGNING_SALT).unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return value == TOKEN_VALUE
+
+
+def profile_trigger(request):
+    """
+    Why this request should be profiled ('token', 'admin' or 'sample'), or
+    None. The flag needs a valid signed token, or any value from a logged-in
+    admin; otherwise PROFILE_SAMPLE_RATES picks a fraction of requests per
+    URL name.
+    """
+    flag = request.headers.get(HEADER) or request.GET.get(QUERY_PARAM)
+    if flag:
+        if _valid_token(flag):
+            return 'token'
+        if request.user.is_authenticated and request.user.is_admin:
+            return 'admin'
+    rate = settings.PROFILE_SAMPLE_RATES.get(request.resolver_match.view_name)
+    if rate and random.random() < rate:
+        return 'sample'
+    return None
+
+
+def _path(capture_id, ext):
+    return os.path.join(settings.PROFILE_DIR, f'{capture_id}.{ext}')
+
+
+def save_capture(profiler, request, trigger, duration):
+    """
+    Store the profile as <id>.pstats plus <id>.json (metadata and a top-N
+    summary), then drop the oldest captures beyond PROFILE_MAX_CAPTURES.
+    """
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    route = request.resolver_match.view_name
+    capture_id = f'{time.time_ns()}-{re.sub(r"[^A-Za-z0-9_-]", "_", route)}'
+
+    summary = io.StringIO()
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats('cumulative').print_stats(settings.PROFILE_TOP_N)
+    stats.dump_stats(_path(capture_id, 'pstats'))
+    with open(_path(capture_id, 'json'), 'w') as f:
+        json.dump({
+            'id': capture_id,
+            'created_at': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'route': route,
+            'trigger': trigger,
+            'duration_ms': duration * 1000,
+            'summary': summary.getvalue(),
+        }, f)
+
+    # Ring buffer: ids start with a timestamp, so name order is age order
+    for old_id in list_capture_ids()[settings.PROFILE_MAX_CAPTURES:]:
+        for ext in ('pstats', 'json'):
+            try:
+                os.remove(_path(old_id, ext))
+            except FileNotFoundError:
+                pass
+    return capture_id
+
+
+def list_capture_ids():
+    # Newest first
+    try:
+        names = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted((name[:-5] for name in names if name.endswith('.json')), reverse=True)
+
+
+def get_capture(capture_id):
+    if not CAPTURE_ID.match(capture_id):
+        return None
+    try:
+        with open(_path(capture_id, 'json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def list_captures():
+    return [capture for capture in map(get_capture, list_capture_ids()) if capture]
+
+
+def capture_pstats_path(capture_id):
+    return _path(capture_id, 'pstats')
+
@@ -0,0 +1,138 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+FTS_TABLE = 'app_recipe_fts'
+
+# Rows fed into the full-text index: one per recipe, with every step of the
+# method flattened into a single column.
+_INDEX_SELECT = """
+    SELECT r.id, r.title, r.description, p.publisher_name,
+           COALESCE((SELECT group_concat(m.instruction, ' ')
+                     FROM app_recipemethod m WHERE m.recipe_id = r.id), '')
+    FROM app_recipe r
+    JOIN app_publisher p ON p.id = r.publisher_id
+"""
+
+
+class BaseSearchBackend:
+    """Interface every recipe search backend implements."""
+
+    def search(self, query, limit=None):
+        # Return recipe ids ordered by relevance (best first)
+        raise NotImplementedError
+
+    def index_recipe(self, recipe_id):
+        pass
+
+    def index_recipes(self, recipe_ids):
+        for recipe_id in recipe_ids:
+            self.index_recipe(recipe_id)
+
+    def index_publisher(self, publisher_id):
+        pass
+
+    def remove_recipe(self, recipe_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """Unindexed LIKE search, for databases without a full-text engine."""
+
+    def _queryset(self, query):
+        from .models import Recipe
+        return Recipe.objects.filter(
+            Q(title__icontains=query) |
+            Q(publisher__publisher_name__icontains=query)
+        )
+
+    def search(self, query, limit=None):
+        if not query.strip():
+            return []
+        limit = limit or settings.RECIPE_SEARCH_MAX_RESULTS
+        ids = self._queryset(query).order_by('-social_rank', '-id').values_list('id', flat=True)
+        return list(ids[:limit])
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """SQLite FTS5 index over title, description, publisher and method steps."""
+
+    # bm25 column weights: title, description, publisher_name, instructions
+    column_weights = (10.0, 2.0, 4.0, 1.0)
+
+    def match_expression(self, query):
+        # Quote each term so user input can't inject FTS5 syntax, and
+        # prefix-match the last one so partially typed words still hit.
+        terms = re.findall(r'\w+', query.lower())
+        if not terms:
+            return ''
+        parts = ['"%s"' % term for term in terms]
+        parts[-1] += '*'
+        return ' '.join(parts)
+
+    def search(self, query, limit=None):
+        match = self.match_expression(query)
+        if not match:
+            return []
+        limit = limit or settings.RECIPE_SEARCH_MAX_RESULTS
+        weights = ', '.join(str(w) for w in self.column_weights)
+        # bm25() is negative (lower is better), so scaling it up by
+        # social_rank pushes popular recipes further up the ranking.
+        sql = (
+            f'SELECT f.rowid FROM {FTS_TABLE} f '
+            f'JOIN app_recipe r ON r.id = f.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TABLE}, {weights}) * (1.0 + %s * r.social_rank), f.rowid DESC '
+            f'LIMIT %s'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [match, settings.RECIPE_SEARCH_SOCIAL_RANK_WEIGHT, limit])
+            return [row[0] for row in cursor.fetchall()]
+
+    def _reindex(self, where, params):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT r.id FROM app_recipe r {where})',
+                params,
+            )
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description, publisher_name, instructions) '
+                f'{_INDEX_SELECT} {where}',
+                params,
+            )
+
+    def index_recipe(self, recipe_id):
+        self._reindex('WHERE r.id = %s', [recipe_id])
+
+    def index_recipes(self, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        if recipe_ids:
+            placeholders = ', '.join(['%s'] * len(recipe_ids))
+            self._reindex(f'WHERE r.id IN ({placeholders})', recipe_ids)
+
+    def index_publisher(self, publisher_id):
+        self._reindex('WHERE r.publisher_id = %s', [publisher_id])
+
+    def remove_recipe(self, recipe_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [recipe_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, description, publisher_name, instructions) '
+                f'{_INDEX_SELECT}'
+            )
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    return import_string(settings.RECIPE_SEARCH_BACKEND)()
@@ -0,0 +1,74 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .autocomplete import PUBLISHER, RECIPE, update_autocomplete_index
+from .cache import ALL, SEARCH, invalidate_all_listings, invalidate_listings
+from .models import Publisher, Recipe
+
+DIETARY_FLAGS = {
+    'is_vegetarian': 'vegetarian',
+    'is_vegan': 'vegan',
+    'is_gluten_free': 'gluten-free',
+}
+
+
+def _affected_listings(recipe):
+    # A recipe shows up in the unfiltered and trending listings and in search,
+    # and in each dietary listing it matches now or matched before this change.
+    states = [recipe.__dict__]
+    if getattr(recipe, '_loaded_values', None):
+        states.append(recipe._loaded_values)
+
+    names = {ALL, SEARCH, 'trending'}
+    for state in states:
+        for flag, name in DIETARY_FLAGS.items():
+            if state.get(flag):
+                names.add(name)
+    return names
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_listings(sender, instance, **kwargs):
+    names = _affected_listings(instance)
+    transaction.on_commit(lambda: invalidate_listings(*names))
+
+
+@receiver(post_save, sender=Publisher)
+@receiver(post_delete, sender=Publisher)
+def invalidate_publisher_listings(sender, instance, created=False, **kwargs):
+    # A brand-new publisher has no recipes to show yet
+    if not created:
+        transaction.on_commit(invalidate_all_listings)
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe_suggestion(sender, instance, **kwargs):
+    key, title, social_rank = (RECIPE, instance.id), instance.title, instance.social_rank
+    publisher_key = (PUBLISHER, instance.publisher_id)
+
+    def update(index):
+        index.add(key, title, social_rank)
+        # Publishers rank by their best recipe. Between full builds their
+        # weight only rises, which spares a query per save.
+        index.raise_weight(publisher_key, social_rank)
+    transaction.on_commit(lambda: update_autocomplete_index(update))
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_suggestion(sender, instance, **kwargs):
+    key = (RECIPE, instance.id)
+    transaction.on_commit(lambda: update_autocomplete_index(lambda index: index.remove(key)))
+
+
+@receiver(post_save, sender=Publisher)
+def index_publisher_suggestion(sender, instance, **kwargs):
+    key, name = (PUBLISHER, instance.id), instance.publisher_name
+    transaction.on_commit(lambda: update_autocomplete_index(lambda index: index.add(key, name, index.weight(key) or 0)))
+
+
+@receiver(post_delete, sender=Publisher)
+def remove_publisher_suggestion(sender, instance, **kwargs):
+    key = (PUBLISHER, instance.id)
+    transaction.on_commit(lambda: update_autocomplete_index(lambda index: index.remove(key)))
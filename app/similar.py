@@ -0,0 +1,277 @@
+import math
+import re
+from array import array
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .models import Recipe, RecipeMethod, SimilarityRun, SimilarRecipe
+
+TOKEN = re.compile(r'[^\W\d_]{2,}')
+# How much one occurrence of a word counts for, by field
+FIELD_WEIGHTS = {'title': 3.0, 'description': 1.0, 'instructions': 1.0, 'flag': 2.0}
+# Dietary flags are features of their own, kept whatever their frequency
+FLAG_FEATURES = {
+    'is_vegetarian': 'diet:vegetarian',
+    'is_vegan': 'diet:vegan',
+    'is_gluten_free': 'diet:gluten-free',
+}
+# Words in more than this share of recipes say little about any of them
+MAX_DOCUMENT_FREQUENCY = 0.5
+# Recipes per query when reading the catalog, and recipe ids per IN (...)
+# when looking up stored lists
+BATCH_SIZE = 500
+# Score rows per argpartition or comparison, each of which allocates a
+# temporary as wide as the catalog (8 or 1 bytes per recipe per row)
+SLICE_ROWS = 32
+# Vectors made dense at a time when scoring a chunk against the catalog
+BLOCK_ROWS = 4096
+
+
+def _count_words(terms, text, weight):
+    for word in TOKEN.findall(text.lower()):
+        terms[word] += weight
+
+
+def iter_recipe_terms():
+    """
+    Yield (recipe id, Counter of weighted term occurrences) for every
+    recipe in id order, from its title, description, method steps and
+    dietary flags. Two queries per BATCH_SIZE recipes, so only one batch's
+    terms are in memory at a time.
+    """
+    fields = ('id', 'title', 'description', *FLAG_FEATURES)
+    recipes = Recipe.objects.order_by('id').values_list(*fields)
+    last_id = None
+    while True:
+        batch = recipes if last_id is None else recipes.filter(id__gt=last_id)
+        batch = list(batch[:BATCH_SIZE])
+        if not batch:
+            return
+        last_id = batch[-1][0]
+        documents = {}
+        for recipe_id, title, description, *flags in batch:
+            terms = Counter()
+            _count_words(terms, title, FIELD_WEIGHTS['title'])
+            _count_words(terms, description, FIELD_WEIGHTS['description'])
+            for feature, flag in zip(FLAG_FEATURES.values(), flags):
+                if flag:
+                    terms[feature] += FIELD_WEIGHTS['flag']
+            documents[recipe_id] = terms
+        methods = RecipeMethod.objects.filter(recipe_id__in=list(documents)).order_by().values_list('recipe_id', 'instruction')
+        for recipe_id, instruction in methods:
+            _count_words(documents[recipe_id], instruction, FIELD_WEIGHTS['instructions'])
+        yield from documents.items()
+
+
+def build_vocabulary(documents, max_features):
+    """
+    {term: (column, idf)} for the max_features words shared by the most
+    documents, among those in at least two (a word in one recipe can't make
+    it similar to another) and at most MAX_DOCUMENT_FREQUENCY of them, plus
+    the dietary flags. Reads documents once, keeping only word counts.
+    """
+    total = 0
+    frequency = Counter()
+    for _, terms in documents:
+        total += 1
+        frequency.update(terms.keys())
+    flags = [feature for feature in FLAG_FEATURES.values() if feature in frequency]
+    words = sorted(
+        (term for term, count in frequency.items()
+         if term not in flags and 1 < count <= total * MAX_DOCUMENT_FREQUENCY),
+        key=lambda term: (-frequency[term], term),
+    )
+    return {
+        term: (column, math.log((1 + total) / (1 + frequency[term])) + 1)
+        for column, term in enumerate(flags + words[:max(max_features - len(flags), 0)])
+    }
+
+
+class TermVectors:
+    """
+    One L2-normalised TF-IDF row per recipe, so the dot product of two rows
+    is their cosine similarity. Rows are stored sparsely: row r's nonzero
+    columns are indices[indptr[r]:indptr[r + 1]], its values the same slice
+    of data. Scoring makes blocks of rows dense as it goes.
+    """
+
+    def __init__(self, ids, indptr, indices, data, width):
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.width = width
+
+    @classmethod
+    def build(cls, documents, vocabulary):
+        ids, indptr, indices, data = array('q'), array('q', [0]), array('i'), array('f')
+        for recipe_id, terms in documents:
+            row = [
+                (vocabulary[term][0], (1 + math.log(count)) * vocabulary[term][1])
+                for term, count in terms.items() if term in vocabulary
+            ]
+            norm = math.sqrt(sum(weight * weight for _, weight in row)) or 1
+            ids.append(recipe_id)
+            for column, weight in row:
+                indices.append(column)
+                data.append(weight / norm)
+            indptr.append(len(indices))
+        return cls(
+            np.frombuffer(ids, dtype=np.int64), np.frombuffer(indptr, dtype=np.int64),
+            np.frombuffer(indices, dtype=np.int32), np.frombuffer(data, dtype=np.float32), len(vocabulary),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def dense(self, rows):
+        # float32 len(rows) x width block of the given rows
+        starts, ends = self.indptr[rows], self.indptr[np.asarray(rows) + 1]
+        lengths = ends - starts
+        positions = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        block = np.zeros((len(rows), self.width), dtype=np.float32)
+        block[np.repeat(np.arange(len(rows)), lengths), self.indices[positions]] = self.data[positions]
+        return block
+
+
+def score_chunks(vectors, rows, chunk_size):
+    """
+    Yield (rows, scores) for consecutive chunks of `rows`, where scores is
+    the chunk's float32 similarity to every row of vectors, its own
+    excluded. Only one chunk x len(vectors) block of scores and one
+    BLOCK_ROWS x width block of vectors are in memory at a time.
+    """
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        queries = vectors.dense(chunk)
+        scores = np.empty((len(chunk), len(vectors)), dtype=np.float32)
+        for block_start in range(0, len(vectors), BLOCK_ROWS):
+            block = np.arange(block_start, min(block_start + BLOCK_ROWS, len(vectors)))
+            scores[:, block_start:block_start + len(block)] = queries @ vectors.dense(block).T
+        scores[np.arange(len(chunk)), chunk] = -1
+        yield chunk, scores
+
+
+def top_neighbours(scores, k):
+    # Per row of scores, (columns, scores) of its best k, best first
+    k = min(k, scores.shape[1] - 1)
+    if k <= 0:
+        return [(np.empty(0, dtype=np.int64), np.empty(0))] * len(scores)
+    neighbours = []
+    for start in range(0, len(scores), SLICE_ROWS):
+        block = scores[start:start + SLICE_ROWS]
+        top = np.argpartition(block, -k, axis=1)[:, -k:]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        neighbours.extend(zip(np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)))
+    return neighbours
+
+
+def _store(ids, neighbours):
+    # Replace the stored rows of every recipe in neighbours (row -> result).
+    # Unrelated recipes (score 0) that fill out a short list are left out.
+    recipe_ids = [int(ids[row]) for row in neighbours]
+    with transaction.atomic():
+        SimilarRecipe.objects.filter(recipe_id__in=recipe_ids).delete()
+        SimilarRecipe.objects.bulk_create([
+            SimilarRecipe(recipe_id=int(ids[row]), similar_id=int(ids[column]), rank=rank, score=float(score))
+            for row, (columns, scores) in neighbours.items()
+            for rank, (column, score) in enumerate(zip(columns, scores), 1)
+            if score > 0
+        ])
+
+
+def _recompute(vectors, rows, k, chunk_size, on_chunk=None):
+    for chunk, scores in score_chunks(vectors, rows, chunk_size):
+        if on_chunk:
+            on_chunk(chunk, scores)
+        _store(vectors.ids, dict(zip(chunk.tolist(), top_neighbours(scores, k))))
+
+
+def _batches(values):
+    values = list(values)
+    for start in range(0, len(values), BATCH_SIZE):
+        yield values[start:start + BATCH_SIZE]
+
+
+def refresh_similar_recipes(full=False, k=None, chunk_size=None, max_features=None):
+    """
+    Recompute stored similar recipes and record the run. A full run (or the
+    first) recomputes every recipe. Otherwise only these are:
+
+    - recipes updated since the last run started, and recipes that lost
+      a neighbour when it was deleted (its row is left with no recipe);
+    - recipes whose list has a changed recipe on it, which may drop off;
+    - recipes whose k-th neighbour a changed recipe now beats, or that
+      have fewer than k and are now related to one.
+
+    Word weights come from the whole catalog each run, but unchanged
+    recipes keep neighbours scored with the weights of their own run; a
+    full run brings everything onto the same weights, e.g. after an import.
+
+    The catalog is read twice, once for the vocabulary and once for the
+    vectors, so that neither pass holds every recipe's words at once.
+    """
+    k = k or settings.SIMILAR_RECIPES_COUNT
+    chunk_size = chunk_size or settings.SIMILAR_RECIPES_CHUNK_SIZE
+    started = timezone.now()
+    last = None if full else SimilarityRun.objects.order_by('-started_at').first()
+
+    vocabulary = build_vocabulary(iter_recipe_terms(), max_features or settings.SIMILAR_RECIPES_MAX_FEATURES)
+    vectors = TermVectors.build(iter_recipe_terms(), vocabulary)
+    ids = vectors.ids
+    positions = {recipe_id: row for row, recipe_id in enumerate(ids.tolist())}
+    if last is None:
+        _recompute(vectors, np.arange(len(ids)), k, chunk_size)
+        return SimilarityRun.objects.create(started_at=started, full=True, recomputed=len(ids))
+
+    wanted = min(k, len(ids) - 1)
+    stored = {
+        recipe_id: (count, lowest) for recipe_id, count, lowest in
+        SimilarRecipe.objects.order_by().values('recipe_id').annotate(count=Count('id'), lowest=Min('score'))
+        .values_list('recipe_id', 'count', 'lowest')
+    }
+    changed = {
+        positions[recipe_id]
+        for recipe_id in Recipe.objects.filter(updated_at__gte=last.started_at).values_list('id', flat=True)
+        if recipe_id in positions
+    }
+    orphaned = {
+        positions[recipe_id]
+        for recipe_id in SimilarRecipe.objects.filter(similar=None).values_list('recipe_id', flat=True)
+        if recipe_id in positions
+    }
+    first = np.array(sorted(changed | orphaned), dtype=np.int64)
+
+    # Scores a newcomer must beat to join each list: any related recipe
+    # joins a short one. Those being recomputed anyway need no check.
+    thresholds = np.zeros(len(ids), dtype=np.float32)
+    for recipe_id, (count, lowest) in stored.items():
+        row = positions.get(recipe_id)
+        if row is not None and count >= wanted:
+            thresholds[row] = lowest
+    thresholds[first] = np.inf
+    joined = np.zeros(len(ids), dtype=bool)
+
+    def find_joins(chunk, scores):
+        # Similarity is symmetric: row r of scores is also column r
+        for start in range(0, len(scores), SLICE_ROWS):
+            joined[:] |= (scores[start:start + SLICE_ROWS] > thresholds).any(axis=0)
+
+    # Read before the first pass rewrites any lists
+    holders = set()
+    for batch in _batches(int(ids[row]) for row in changed):
+        holders.update(SimilarRecipe.objects.filter(similar_id__in=batch).values_list('recipe_id', flat=True))
+
+    _recompute(vectors, first, k, chunk_size, find_joins)
+
+    second = {positions[recipe_id] for recipe_id in holders if recipe_id in positions}
+    second.update(np.flatnonzero(joined).tolist())
+    second = np.array(sorted(second - set(first.tolist())), dtype=np.int64)
+    _recompute(vectors, second, k, chunk_size)
+    return SimilarityRun.objects.create(started_at=started, recomputed=len(first) + len(second))
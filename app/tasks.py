@@ -0,0 +1,50 @@
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# In-process job queue: a few daemon threads pull (func, args, kwargs) jobs
+# off a queue so slow work never runs inside a request. Jobs are lost if the
+# process exits, so they must be safe to simply try again later.
+_jobs = queue.Queue()
+_workers = []
+_lock = threading.Lock()
+
+
+def _work():
+    while True:
+        func, args, kwargs = _jobs.get()
+        close_old_connections()
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception('Background job %s failed', func.__name__)
+        finally:
+            close_old_connections()
+            _jobs.task_done()
+
+
+def _ensure_workers():
+    with _lock:
+        _workers[:] = [worker for worker in _workers if worker.is_alive()]
+        while len(_workers) < settings.BACKGROUND_JOB_WORKERS:
+            worker = threading.Thread(target=_work, name='background-job', daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def enqueue(func, *args, **kwargs):
+    if settings.BACKGROUND_JOBS_EAGER:
+        func(*args, **kwargs)
+        return
+    _ensure_workers()
+    _jobs.put((func, args, kwargs))
+
+
+def wait_for_jobs():
+    # Block until every queued job has finished (used by tests and commands)
+    _jobs.join()
@@ -0,0 +1,16 @@
+from django import template
+
+from app.fragments import render_recipe_fragments
+
+register = template.Library()
+
+
+@register.simple_tag
+def recipe_fragments(recipes, template_name):
+    """
+    {% recipe_fragments recipes 'recipe-card.html' as cards %} renders each
+    recipe through template_name, using the fragment cache, and gives
+    (recipe, html) pairs so per-user markup can sit outside the cached HTML.
+    """
+    recipes = list(recipes)
+    return list(zip(recipes, render_recipe_fragments(template_name, recipes)))
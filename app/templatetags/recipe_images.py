@@ -0,0 +1,17 @@
+from django import template
+from django.urls import reverse
+
+from app.image_proxy import sign_url
+
+register = template.Library()
+
+
+@register.filter
+def proxied_image(url, variant):
+    """
+    {{ recipe.image_url|proxied_image:'card' }} -> URL of the locally cached,
+    resized copy. Anything but a remote http(s) URL is returned unchanged.
+    """
+    if not url or not url.startswith(('http://', 'https://')):
+        return url
+    return reverse('image_proxy', args=[variant, sign_url(url)])
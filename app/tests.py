@@ -1,3 +1,1189 @@
-from django.test import TestCase
+import copy
+import itertools
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.http import QueryDict
+from django.template import Context, Template
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .models import Publisher, Recipe, RecipeMethod, Role, SavedRecipe, SimilarRecipe, User
+from .autocomplete import (
+    RECIPE, AutocompleteIndex, rebuild_autocomplete_index, refresh_autocomplete_index, reset_autocomplete_index,
+)
+from .avatars import download_avatar
+from .benchmark import compare, generate_catalog
+from .db import connection_pragmas
+from .filters import RecipeFilters
+from .fragments import fragment_cache
+from .fetch import ImageFetchError
+from .image_proxy import get_variant
+from .methods import sync_methods
+from .pagination import encode_cursor
+from .metrics import reset_stats, route_stats
+from .pipeline import get_avatar
+from .profiling import list_captures, profile_token
+from .search import get_search_backend
+from .similar import refresh_similar_recipes
+from .throttle import get_throttle_backend, shed_counts
+from .trending import trending_score
+
+
+def make_recipe(publisher, user, **fields):
+    fields.setdefault('title', 'Recipe')
+    fields.setdefault('social_rank', 50.0)
+    return Recipe.objects.create(
+        source_url='https://example.com/recipe',
+        image_url='https://example.com/recipe.jpg',
+        recipe_id=fields.pop('recipe_id', fields['title'].lower().replace(' ', '-')),
+        publisher=publisher,
+        created_by=user,
+        **fields
+    )
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class RecipeTestCase(TestCase):
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        get_throttle_backend.cache_clear()
+        reset_autocomplete_index()
+
+    def recipe_form(self, **fields):
+        form = {
+            'title': 'Recipe',
+            'description': '',
+            'source_url': 'https://example.com/recipe',
+            'image_url': 'https://example.com/recipe.jpg',
+            'cooking_time': '20',
+            'social_rank': '50',
+            'publisher': self.publisher.id,
+        }
+        form.update(fields)
+        return form
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_role = Role.objects.get(role_name='admin')
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', 'pass', role=cls.admin_role)
+        cls.publisher = Publisher.objects.create(publisher_name='Closet Cooking', publisher_url='https://example.com')
+
+
+class SearchTests(RecipeTestCase):
+    def test_search_matches_title_publisher_and_methods(self):
+        soup = make_recipe(self.publisher, self.admin, title='Tomato Soup', description='Warm and simple')
+        RecipeMethod.objects.create(recipe=soup, step_number=1, instruction='Simmer the basil')
+        get_search_backend().index_recipe(soup.id)
+
+        backend = get_search_backend()
+        self.assertEqual(backend.search('tomato'), [soup.id])
+        self.assertEqual(backend.search('tom'), [soup.id])
+        self.assertEqual(backend.search('closet'), [soup.id])
+        self.assertEqual(backend.search('basil'), [soup.id])
+        self.assertEqual(backend.search('basil"'), [soup.id])
+        self.assertEqual(backend.search('pizza'), [])
+
+    def test_social_rank_breaks_relevance_ties(self):
+        low = make_recipe(self.publisher, self.admin, title='Pancakes', social_rank=10)
+        high = make_recipe(self.publisher, self.admin, title='Pancakes deluxe', social_rank=99)
+        get_search_backend().rebuild()
+
+        self.assertEqual(get_search_backend().search('pancakes'), [high.id, low.id])
+
+    def test_views_keep_index_current(self):
+        self.client.force_login(self.admin)
+        self.client.post(reverse('add_recipe'), self.recipe_form(
+            title='Lentil Curry', **{'method[]': ['Rinse the lentils']}
+        ))
+        recipe = Recipe.objects.get(title='Lentil Curry')
+        self.assertEqual(get_search_backend().search('lentils'), [recipe.id])
+
+        self.client.post(reverse('edit_recipe', args=[recipe.id]), self.recipe_form(
+            title='Chickpea Curry', recipe_methods='Drain the chickpeas'
+        ))
+        self.assertEqual(get_search_backend().search('lentils'), [])
+        self.assertEqual(get_search_backend().search('chickpea'), [recipe.id])
+
+        self.client.post(reverse('delete_recipe', args=[recipe.id]))
+        self.assertEqual(get_search_backend().search('chickpea'), [])
+
+        response = self.client.get(reverse('home'), {'search': 'curry'})
+        self.assertEqual(list(response.context['recipes']), [])
+
+
+@override_settings(RECIPES_PER_PAGE=2)
+class PaginationTests(RecipeTestCase):
+    def test_cursor_walks_every_recipe_once_with_ties(self):
+        recipes = [make_recipe(self.publisher, self.admin, title=f'Recipe {i}', social_rank=i // 2) for i in range(5)]
+        expected = [r.id for r in sorted(recipes, key=lambda r: (-r.social_rank, -r.id))]
+
+        seen, pages, url = [], [], reverse('home')
+        while url:
+            page = self.client.get(url).context['page']
+            pages.append(page)
+            seen.extend(recipe.id for recipe in page)
+            url = page.next_url and reverse('home') + page.next_url
+        self.assertEqual(seen, expected)
+
+        previous = self.client.get(reverse('home') + pages[-1].previous_url).context['page']
+        self.assertEqual([r.id for r in previous], [r.id for r in pages[-2]])
+
+    def test_cursor_keeps_datetime_precision(self):
+        for i in range(3):
+            make_recipe(self.publisher, self.admin, title=f'Recipe {i}')
+        first = self.client.get(reverse('home'), {'filter': 'recent'}).context['page']
+        second = self.client.get(reverse('home') + first.next_url).context['page']
+        self.assertEqual(len({r.id for r in first} | {r.id for r in second}), 3)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        make_recipe(self.publisher, self.admin, title='Only')
+        response = self.client.get(reverse('home'), {'cursor': 'not-a-cursor'})
+        self.assertEqual([r.title for r in response.context['page']], ['Only'])
+
+    def test_unusable_cursor_keys_fall_back_to_first_page(self):
+        make_recipe(self.publisher, self.admin, title='Only')
+        cursors = [
+            ({'filter': 'recent'}, {'s': ['-created_at', '-id'], 'k': [{}, 1], 'd': 'n'}),
+            ({}, {'s': ['-social_rank', '-id'], 'k': [50.0, 2 ** 70], 'd': 'n'}),
+            ({}, {'s': ['-social_rank', '-id'], 'k': ['inf', 1], 'd': 'n'}),
+        ]
+        for params, data in cursors:
+            with self.subTest(data=data):
+                params = {**params, 'cursor': encode_cursor(data)}
+                response = self.client.get(reverse('home'), params)
+                self.assertEqual([r.title for r in response.context['page']], ['Only'])
+                response = self.client.get(reverse('api_recipes'), params)
+                self.assertEqual([r['title'] for r in response.json()['results']], ['Only'])
+
+
+class QueryPlanTests(RecipeTestCase):
+    HOME_FILTERS = ['', 'popular', 'recent', 'trending', 'vegetarian', 'vegan', 'gluten-free']
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for i in range(60):
+            make_recipe(
+                cls.publisher, cls.admin, title=f'Recipe {i}', social_rank=i % 7,
+                is_vegetarian=i % 2 == 0, is_vegan=i % 3 == 0, is_gluten_free=i % 5 == 0,
+            )
+
+    def assertIndexedPlans(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = [row[3] for row in cursor.fetchall()]
+            # "SCAN x USING INDEX" walks an index in order and stops at the
+            # page LIMIT; a bare "SCAN x" reads the whole table.
+            for step in plan:
+                self.assertFalse(
+                    step.startswith('SCAN') and 'USING' not in step,
+                    f'Full scan for {params}: {plan}\n{query["sql"]}',
+                )
+                self.assertNotIn('TEMP B-TREE', step, f'Sort for {params}: {plan}\n{query["sql"]}')
+        return response
+
+    def test_home_filters_use_indexes(self):
+        for filter_type in self.HOME_FILTERS:
+            params = {'filter': filter_type} if filter_type else {}
+            page = self.assertIndexedPlans(reverse('home'), params).context['page']
+            if page.has_next:
+                self.assertIndexedPlans(reverse('home'), {**params, 'cursor': page.next_cursor})
+
+    def test_filter_combinations_use_indexes(self):
+        diet_sets = ['', 'vegan', 'gluten-free,vegetarian', 'gluten-free,vegan,vegetarian']
+        for diet, sort, publisher, max_time in itertools.product(
+            diet_sets, ['popular', 'recent', 'trending'], ['', self.publisher.id], ['', '30'],
+        ):
+            params = {'diet': diet, 'sort': sort, 'publisher': publisher, 'max_time': max_time}
+            page = self.assertIndexedPlans(reverse('home'), params).context['page']
+            if page.has_next:
+                self.assertIndexedPlans(reverse('home'), {**params, 'cursor': page.next_cursor})
+
+    def test_recipe_detail_uses_indexes(self):
+        refresh_similar_recipes()
+        recipe = Recipe.objects.get(title='Recipe 0')
+        response = self.assertIndexedPlans(reverse('recipe_detail', args=[recipe.id]), {})
+        self.assertTrue(response.context['similar_recipes'])
+
+    def test_manage_recipes_uses_index(self):
+        self.client.force_login(self.admin)
+        page = self.assertIndexedPlans(reverse('manage_recipes'), {}).context['page']
+        self.assertIndexedPlans(reverse('manage_recipes'), {'cursor': page.next_cursor})
+
+
+class ListingCacheTests(RecipeTestCase):
+    def titles(self, **params):
+        return [recipe.title for recipe in self.client.get(reverse('home'), params).context['page']]
+
+    def test_repeat_listing_is_served_from_cache(self):
+        make_recipe(self.publisher, self.admin, title='Cached')
+        self.titles(filter='popular')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(filter='popular'), ['Cached'])
+
+    def test_saves_invalidate_only_affected_listings(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = make_recipe(self.publisher, self.admin, title='Salad', is_vegan=True)
+        self.assertEqual(self.titles(filter='vegan'), ['Salad'])
+        self.assertEqual(self.titles(filter='vegetarian'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.get(id=recipe.id)
+            recipe.is_vegan = False
+            recipe.is_vegetarian = True
+            recipe.save()
+        self.assertEqual(self.titles(filter='vegan'), [])
+        self.assertEqual(self.titles(filter='vegetarian'), ['Salad'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_recipe(self.publisher, self.admin, title='Bread', is_gluten_free=True)
+        with self.assertNumQueries(0):
+            self.titles(filter='vegetarian')
+
+    def test_publisher_rename_invalidates_listings(self):
+        make_recipe(self.publisher, self.admin, title='Stew')
+        self.assertContains(self.client.get(reverse('home')), 'Closet Cooking')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.publisher.publisher_name = 'Open Kitchen'
+            self.publisher.save()
+        self.assertContains(self.client.get(reverse('home')), 'Open Kitchen')
+
+
+class RecipeFilterTests(RecipeTestCase):
+    def titles(self, **params):
+        return [recipe.title for recipe in self.client.get(reverse('home'), params).context['page']]
+
+    def test_combines_criteria_in_one_query(self):
+        other = Publisher.objects.create(publisher_name='Other', publisher_url='https://example.org')
+        make_recipe(self.publisher, self.admin, title='Quick Bowl', social_rank=90, is_vegan=True, is_gluten_free=True, cooking_time=20)
+        make_recipe(self.publisher, self.admin, title='Slow Stew', social_rank=95, is_vegan=True, is_gluten_free=True, cooking_time=90)
+        make_recipe(self.publisher, self.admin, title='Toast', social_rank=99, is_vegan=True, cooking_time=5)
+        make_recipe(self.publisher, self.admin, title='Mystery', social_rank=80, is_vegan=True, is_gluten_free=True)
+        make_recipe(other, self.admin, title='Rice', social_rank=70, is_vegan=True, is_gluten_free=True, cooking_time=25)
+
+        with CaptureQueriesContext(connection) as queries:
+            titles = self.titles(diet='vegan,gluten-free', max_time='30', sort='popular')
+        self.assertEqual(titles, ['Quick Bowl', 'Rice'])
+        self.assertEqual(sum('FROM "app_recipe"' in query['sql'] for query in queries), 2)
+        self.assertEqual(self.titles(diet=['vegan', 'gluten-free'], publisher=other.id), ['Rice'])
+        self.assertEqual(self.titles(min_time='60'), ['Slow Stew'])
+        # Legacy single filters still work and default to newest first
+        self.assertEqual(self.titles(filter='vegan'), ['Rice', 'Mystery', 'Toast', 'Slow Stew', 'Quick Bowl'])
+
+    def test_equivalent_queries_share_a_canonical_key(self):
+        def key(query):
+            return RecipeFilters.from_params(QueryDict(query)).key
+
+        self.assertEqual(key('filter=vegan'), key('diet=vegan&sort=recent'))
+        self.assertEqual(key('diet=vegan&diet=gluten-free'), key('diet=gluten-free,vegan,vegan'))
+        self.assertEqual(key('max_time=030&min_time=0&search=  Soup '), key('max_time=30&search=soup&sort=relevance'))
+        self.assertNotEqual(key('diet=vegan'), key('diet=vegan&sort=popular'))
+        self.assertEqual(RecipeFilters.from_params(QueryDict('filter=vegan&max_time=30')).query_dict().urlencode(), 'diet=vegan&max_time=30')
+
+        make_recipe(self.publisher, self.admin, title='Salad', is_vegan=True)
+        self.titles(filter='vegan')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(diet='vegan', sort='recent'), ['Salad'])
+
+    def test_rejects_unsupported_combinations(self):
+        for params in [
+            {'diet': 'keto'},
+            {'sort': 'cooking_time'},
+            {'filter': 'cheap'},
+            {'sort': 'relevance'},
+            {'publisher': [self.publisher.id, self.publisher.id + 1]},
+            {'publisher': 'closet'},
+            {'publisher': '0'},
+            {'publisher': '99999999999999999999999'},
+            {'min_time': '60', 'max_time': '30'},
+            {'max_time': 'soon'},
+            {'max_time': '-5'},
+        ]:
+            self.assertEqual(self.client.get(reverse('home'), params).status_code, 400, params)
+        response = self.client.get(reverse('api_recipes'), {'diet': 'keto'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Unknown diet: keto.'})
+        response = self.client.get(reverse('api_recipes'), {'publisher': '99999999999999999999999'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'publisher must be a publisher id.'})
+
+
+class FacetCountTests(RecipeTestCase):
+    def facets(self, **params):
+        facets = self.client.get(reverse('home'), params).context['facets']
+        return {facet['label']: facet['count'] for group in facets.values() for facet in group}
+
+    def test_counts_follow_criteria_in_one_cached_query(self):
+        make_recipe(self.publisher, self.admin, title='Lentil Soup', is_vegetarian=True, is_vegan=True, cooking_time=40)
+        make_recipe(self.publisher, self.admin, title='Chicken Soup', is_gluten_free=True, cooking_time=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_recipe(self.publisher, self.admin, title='Lentil Salad', is_vegetarian=True)
+        get_search_backend().rebuild()
+
+        counts = {
+            'Popular': 3, 'Recent': 3, 'Trending': 3, 'Vegetarian': 2, 'Vegan': 1, 'Gluten-free': 1,
+            # Lentil Salad has no cooking time
+            'Under 15 min': 1, 'Under 30 min': 1, 'Under 60 min': 2,
+        }
+        # The page, then one aggregate for every facet
+        with self.assertNumQueries(2):
+            self.assertEqual(self.facets(), counts)
+        # Another sort reuses the counts
+        with self.assertNumQueries(1):
+            self.assertEqual(self.facets(sort='trending'), counts)
+        self.assertEqual(self.facets(search='  LENTIL '), {
+            'Best match': 2, 'Popular': 2, 'Recent': 2, 'Trending': 2, 'Vegetarian': 2, 'Vegan': 1, 'Gluten-free': 0,
+            'Under 15 min': 0, 'Under 30 min': 0, 'Under 60 min': 1,
+        })
+        # Each dietary count is for adding that flag; time counts replace the bound
+        self.assertEqual(self.facets(diet='vegetarian', max_time='30'), {
+            'Popular': 0, 'Recent': 0, 'Trending': 0, 'Vegetarian': 0, 'Vegan': 0, 'Gluten-free': 0,
+            'Under 15 min': 0, 'Under 30 min': 0, 'Under 60 min': 1,
+        })
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dal = make_recipe(self.publisher, self.admin, title='Lentil Dal', is_vegan=True, is_vegetarian=True)
+        get_search_backend().index_recipe(dal.id)
+        self.assertEqual(self.facets(search='lentil')['Vegan'], 2)
+        self.assertEqual(self.facets()['Popular'], 4)
+
+
+class AutocompleteTests(RecipeTestCase):
+    def test_index_ranks_prefix_and_phrase_matches(self):
+        index = AutocompleteIndex(limit=2)
+        index.load([
+            ((RECIPE, 1), 'Spicy Chicken Curry', 50),
+            ((RECIPE, 2), 'Chicken Soup', 90),
+            ((RECIPE, 3), 'Chickpea Curry', 70),
+            ((RECIPE, 4), 'Curry Chicken', 60),
+        ])
+        self.assertEqual([key for key, _ in index.suggest('ch')], [(RECIPE, 2), (RECIPE, 3)])
+        self.assertEqual([key for key, _ in index.suggest('CHICKEN c')], [(RECIPE, 1)])
+        self.assertEqual(index.suggest('soup chicken'), [])
+
+        index.add((RECIPE, 5), 'Chicken Curry', 95)
+        self.assertEqual(index.suggest('chicken cu'), [((RECIPE, 5), 'Chicken Curry'), ((RECIPE, 1), 'Spicy Chicken Curry')])
+        index.add((RECIPE, 2), 'Tomato Soup', 90)
+        index.remove((RECIPE, 5))
+        self.assertEqual([key for key, _ in index.suggest('chi')], [(RECIPE, 3), (RECIPE, 4)])
+        for key in list(index.entries):
+            index.remove(key)
+        self.assertEqual((index.words, index.postings, index.prefix_postings, index.phrases), ([], {}, {}, {}))
+
+    def test_endpoint_follows_saves_without_queries(self):
+        recipe = make_recipe(self.publisher, self.admin, title='Chicken Curry')
+        url = reverse('autocomplete')
+        # The first lookup queues the build instead of waiting for it
+        with mock.patch('app.autocomplete.enqueue') as enqueue:
+            for _ in range(2):
+                response = self.client.get(url, {'q': 'cl'})
+                self.assertEqual(response.json()['results'], [])
+                self.assertIn('max-age=0', response['Cache-Control'])
+        enqueue.assert_called_once_with(refresh_autocomplete_index)
+        refresh_autocomplete_index()
+
+        self.assertEqual(self.client.get(url, {'q': 'cl'}).json()['results'], [{
+            'type': 'publisher', 'label': 'Closet Cooking',
+            'url': reverse('home') + f'?publisher={self.publisher.id}',
+        }])
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'q': 'chicken c'})
+        self.assertEqual(response.json()['results'], [{
+            'type': 'recipe', 'label': 'Chicken Curry', 'url': reverse('recipe_detail', args=[recipe.id]),
+        }])
+        self.assertIn('max-age=60', response['Cache-Control'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.title = 'Lamb Curry'
+            recipe.save()
+            make_recipe(self.publisher, self.admin, title='Chicken Soup')
+        with self.assertNumQueries(0):
+            results = self.client.get(url, {'q': 'chicken'}).json()['results']
+        self.assertEqual([result['label'] for result in results], ['Chicken Soup'])
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertEqual(self.client.get(url, {'q': 'lamb'}).json()['results'], [])
+        self.assertEqual(self.client.get(url).json()['results'], [])
+
+    def test_sync_reads_only_what_changed(self):
+        # Without captureOnCommitCallbacks no signal reaches the index, as
+        # if another process made these changes
+        kept = make_recipe(self.publisher, self.admin, title='Lentil Soup')
+        gone = make_recipe(self.publisher, self.admin, title='Lemon Tart')
+        rebuild_autocomplete_index()
+        Recipe.objects.filter(id=kept.id).update(title='Leek Soup', updated_at=timezone.now())
+        gone.delete()
+        make_recipe(self.publisher, self.admin, title='Lemon Curd', social_rank=10)
+
+        url = reverse('autocomplete')
+        with override_settings(AUTOCOMPLETE_SYNC_SECONDS=1), mock.patch('time.monotonic', return_value=time.monotonic() + 2):
+            with mock.patch('app.autocomplete._rows') as rows, mock.patch('app.autocomplete.enqueue') as enqueue:
+                self.client.get(url, {'q': 'le'})
+                enqueue.assert_called_once_with(refresh_autocomplete_index)
+                refresh_autocomplete_index()
+            rows.assert_not_called()
+            results = self.client.get(url, {'q': 'le'}).json()['results']
+        self.assertEqual([result['label'] for result in results], ['Leek Soup', 'Lemon Curd'])
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_autocomplete', titles=500, vocabulary=100, queries=5, updates=20, stdout=out)
+        self.assertIn('500 titles', out.getvalue())
+        self.assertIn('add or remove', out.getvalue())
+
+
+class FragmentCacheTests(RecipeTestCase):
+    def test_cards_come_from_one_get_many_and_follow_edits(self):
+        recipes = [make_recipe(self.publisher, self.admin, title=f'Soup {i}') for i in range(3)]
+        self.client.get(reverse('home'))
+
+        cache = fragment_cache()
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many, \
+                mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            self.assertContains(self.client.get(reverse('home')), 'Soup 2')
+        get_many.assert_called_once()
+        set_many.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipes[0].title = 'Stew'
+            recipes[0].save()
+            self.publisher.publisher_name = 'Open Kitchen'
+            self.publisher.save()
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Stew')
+        self.assertContains(response, 'By Open Kitchen', count=3)
+
+
+class TrendingTests(RecipeTestCase):
+    def test_trending_decays_social_rank_by_age(self):
+        now = timezone.now()
+        make_recipe(self.publisher, self.admin, title='Old hit', social_rank=100, created_at=now - timedelta(days=10))
+        make_recipe(self.publisher, self.admin, title='Fresh', social_rank=10, created_at=now)
+        make_recipe(self.publisher, self.admin, title='Recent hit', social_rank=100, created_at=now - timedelta(days=1))
+        page = self.client.get(reverse('home'), {'filter': 'trending'}).context['page']
+        self.assertEqual([recipe.title for recipe in page], ['Recent hit', 'Fresh', 'Old hit'])
+
+    def test_refresh_writes_only_moved_scores(self):
+        recipes = [make_recipe(self.publisher, self.admin, title=f'Recipe {i}') for i in range(3)]
+        # A write that bypasses Recipe.save() leaves the stored score stale
+        Recipe.objects.filter(id=recipes[0].id).update(social_rank=99)
+        updated_at = Recipe.objects.get(id=recipes[0].id).updated_at
+
+        out = StringIO()
+        call_command('refresh_trending_scores', stdout=out)
+        self.assertIn('Checked 3 recipes; updated 1 trending scores.', out.getvalue())
+        recipe = Recipe.objects.get(id=recipes[0].id)
+        self.assertEqual(recipe.trending_score, trending_score(99, recipe.created_at))
+        self.assertEqual(recipe.updated_at, updated_at)
+
+
+class SimilarRecipeTests(RecipeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.recipes = {
+            title: make_recipe(self.publisher, self.admin, title=title)
+            for title in ['Chicken Curry', 'Chicken Soup', 'Lentil Curry', 'Chocolate Cake', 'Lemon Cake', 'Tomato Soup']
+        }
+        sync_methods(self.recipes['Chicken Curry'], ['Add the lentils'])
+
+    def similar(self, title):
+        rows = SimilarRecipe.objects.filter(recipe__title=title).order_by('rank')
+        return [row.similar.title for row in rows.select_related('similar')]
+
+    def test_detail_shows_precomputed_neighbours(self):
+        out = StringIO()
+        call_command('refresh_similar_recipes', stdout=out)
+        self.assertIn('for 6 recipes (full run', out.getvalue())
+        # Unrelated recipes are not stored
+        self.assertEqual(self.similar('Chicken Curry'), ['Lentil Curry', 'Chicken Soup'])
+        self.assertFalse(SimilarRecipe.objects.filter(score__lte=0).exists())
+
+        response = self.client.get(reverse('recipe_detail', args=[self.recipes['Chicken Curry'].id]))
+        self.assertEqual([row.similar.title for row in response.context['similar_recipes']], ['Lentil Curry', 'Chicken Soup'])
+        self.assertContains(response, 'Similar Recipes')
+        self.assertNotContains(response, 'Lemon Cake')
+
+    def test_incremental_run_follows_edits_and_deletes(self):
+        refresh_similar_recipes(k=2)
+        self.assertEqual(self.similar('Lemon Cake'), ['Chocolate Cake'])
+
+        recipe = self.recipes['Tomato Soup']
+        recipe.title = 'Lemon Soup'
+        recipe.save()
+        run = refresh_similar_recipes(k=2)
+        self.assertFalse(run.full)
+        self.assertLess(run.recomputed, len(self.recipes))
+        self.assertEqual(self.similar('Lemon Soup'), ['Chicken Soup', 'Lemon Cake'])
+        self.assertEqual(self.similar('Lemon Cake'), ['Chocolate Cake', 'Lemon Soup'])
+
+        self.recipes['Chocolate Cake'].delete()
+        self.assertTrue(SimilarRecipe.objects.filter(recipe=self.recipes['Lemon Cake'], similar=None).exists())
+        refresh_similar_recipes(k=2)
+        self.assertEqual(self.similar('Lemon Cake'), ['Lemon Soup'])
+        self.assertFalse(SimilarRecipe.objects.filter(similar=None).exists())
+
+        self.assertEqual(refresh_similar_recipes(k=2).recomputed, 0)
+
+
+class RoleQueryTests(RecipeTestCase):
+    def test_admin_pages_load_user_and_role_in_one_query(self):
+        recipe = make_recipe(self.publisher, self.admin)
+        self.client.force_login(self.admin)
+        # session, user + role, then the page's own query
+        for url in [reverse('manage_recipes'), reverse('add_publisher')]:
+            with self.assertNumQueries(3):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        # recipe with publisher and creator, methods, similar recipes,
+        # session, user + role
+        with self.assertNumQueries(5):
+            self.assertContains(self.client.get(reverse('recipe_detail', args=[recipe.id])), 'Edit Recipe')
+        # session, user + role, recipe with publisher, its methods, publishers
+        with self.assertNumQueries(5):
+            self.assertEqual(self.client.get(reverse('edit_recipe', args=[recipe.id])).status_code, 200)
+
+    def test_role_change_applies_on_next_request(self):
+        self.client.force_login(self.admin)
+        self.admin.role = Role.objects.create(role_name='user')
+        self.admin.save()
+        self.assertRedirects(self.client.get(reverse('manage_recipes')), reverse('home'))
+
+
+class SavedRecipeTests(RecipeTestCase):
+    def test_toggle_saves_and_unsaves(self):
+        recipe = make_recipe(self.publisher, self.admin)
+        self.client.force_login(self.admin)
+        url = reverse('save_recipe', args=[recipe.id])
+        self.assertRedirects(self.client.post(url), reverse('recipe_detail', args=[recipe.id]))
+        self.assertEqual(list(self.admin.saved_recipes.all()), [recipe])
+        self.assertRedirects(self.client.post(url, {'next': reverse('home')}), reverse('home'))
+        self.assertFalse(SavedRecipe.objects.exists())
+        self.assertRedirects(
+            self.client.post(url, {'next': 'https://evil.example.com/'}),
+            reverse('recipe_detail', args=[recipe.id]),
+        )
+        self.assertEqual(self.client.post(reverse('save_recipe', args=[recipe.id + 1])).status_code, 404)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            SavedRecipe.objects.create(user=self.admin, recipe=recipe)
+
+    def test_hearts_cost_one_query_per_page(self):
+        recipes = [make_recipe(self.publisher, self.admin, title=f'Recipe {i}') for i in range(10)]
+        self.admin.saved_recipes.add(recipes[3], recipes[7])
+        self.client.force_login(self.admin)
+        self.client.get(reverse('home'))
+        # session, user + role, then the saved lookup for the cached page
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.content.decode().count('fas fa-heart'), 2)
+        self.assertEqual(response.content.decode().count('far fa-heart'), 8)
+
+        # The flag is part of the recipe query; the last is similar recipes
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('recipe_detail', args=[recipes[3].id]))
+        self.assertContains(response, 'fas fa-heart')
+        self.assertTrue(response.context['recipe'].is_saved)
+
+        # Cached pages and cards are shared, not per user
+        self.client.logout()
+        response = self.client.get(reverse('home'))
+        self.assertNotContains(response, 'fa-heart')
+
+
+class EmailOrUsernameLoginTests(RecipeTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.cook = User.objects.create_user('cook', email='Cook@Example.com', password='s3cret-pass', role=cls.admin_role)
+
+    def hashes(self):
+        return mock.patch.object(
+            PBKDF2PasswordHasher, 'encode', autospec=True, side_effect=PBKDF2PasswordHasher.encode,
+        )
+
+    def test_logs_in_by_username_or_any_case_email(self):
+        for identifier in ['cook', 'cook@example.com']:
+            with self.assertNumQueries(1):
+                self.assertEqual(authenticate(username=identifier, password='s3cret-pass'), self.cook)
+        response = self.client.post(reverse('login'), {'email': 'COOK@example.com', 'password': 's3cret-pass'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+    def test_failed_logins_hash_exactly_once(self):
+        for identifier in ['cook@example.com', 'nobody@example.com']:
+            with self.hashes() as encode:
+                self.assertIsNone(authenticate(username=identifier, password='wrong'))
+            self.assertEqual(encode.call_count, 1, identifier)
+
+    def test_email_lookup_uses_unique_index(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create_user('other', email='COOK@example.com', role=self.admin_role)
+        # Blank emails are exempt
+        User.objects.create_user('a', role=self.admin_role)
+        User.objects.create_user('b', role=self.admin_role)
+
+        sql, params = User.objects.with_email('cook@example.com').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            self.assertIn('user_email_ci_unique', str(cursor.fetchall()))
+
+
+@override_settings(LOGIN_THROTTLE_RATES={'ip': (4, 60), 'account': (2, 60)})
+class LoginThrottleTests(RecipeTestCase):
+    def login(self, identifier, ip='10.0.0.1'):
+        return self.client.post(reverse('login'), {'email': identifier, 'password': 'wrong'}, REMOTE_ADDR=ip)
+
+    def test_sheds_floods_before_hashing(self):
+        shed = shed_counts().get('account', 0)
+        for _ in range(2):
+            self.assertEqual(self.login('admin').status_code, 200)
+        with mock.patch('app.views.authenticate') as authenticate, self.assertLogs('app.throttle', 'WARNING'):
+            response = self.login('ADMIN')
+        authenticate.assert_not_called()
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '30'))
+        self.assertEqual(shed_counts()['account'], shed + 1)
+
+        # The same IP can still try another account until its own bucket runs out
+        self.assertEqual(self.login('other').status_code, 200)
+        with self.assertLogs('app.throttle', 'WARNING'):
+            self.assertEqual(self.login('another').status_code, 429)
+        self.assertEqual(self.login('another', ip='10.0.0.2').status_code, 200)
+
+    def test_buckets_refill_over_time(self):
+        backend = get_throttle_backend()
+        with mock.patch('app.throttle.time.monotonic', return_value=1000):
+            self.assertEqual([backend.take('k', 2, 10)[0] for _ in range(3)], [True, True, False])
+        with mock.patch('app.throttle.time.monotonic', return_value=1005):
+            self.assertEqual([backend.take('k', 2, 10)[0] for _ in range(2)], [True, False])
+
+    @override_settings(LOGIN_THROTTLE_BACKEND='app.throttle.CacheThrottleBackend')
+    def test_cache_backend_shares_buckets(self):
+        for _ in range(2):
+            self.login('admin')
+        get_throttle_backend.cache_clear()
+        with self.assertLogs('app.throttle', 'WARNING'):
+            self.assertEqual(self.login('admin').status_code, 429)
+
+
+class BenchmarkTests(RecipeTestCase):
+    def test_catalog_is_reproducible(self):
+        generate_catalog(publishers=2, recipes=10, methods=2, seed=7)
+        first = list(Recipe.objects.order_by('recipe_id').values_list('title', 'social_rank', 'is_vegan'))
+        Recipe.objects.all().delete()
+        generate_catalog(publishers=2, recipes=10, methods=2, seed=7)
+        self.assertEqual(list(Recipe.objects.order_by('recipe_id').values_list('title', 'social_rank', 'is_vegan')), first)
+        self.assertEqual(RecipeMethod.objects.count(), 20)
+
+    def test_run_reports_every_scenario_and_compares(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'run.json')
+            call_command(
+                'benchmark', recipes=30, publishers=3, requests=3, warmup=0, output=output, stdout=StringIO(),
+            )
+            with open(output) as f:
+                results = json.load(f)
+            # The catalog was rolled back
+            self.assertFalse(Recipe.objects.exists())
+
+            scenarios = results['scenarios']
+            self.assertEqual(len(scenarios), 13)
+            self.assertTrue(all(result['statuses'] == [200] for result in scenarios.values()))
+            self.assertLessEqual(scenarios['home:vegan']['p50_ms'], scenarios['home:vegan']['p99_ms'])
+
+            slower = copy.deepcopy(scenarios)
+            slower['recipe_detail']['p95_ms'] *= 2
+            rows = {row['scenario']: row for row in compare(scenarios, slower)}
+            self.assertTrue(rows['recipe_detail']['regressed'])
+            self.assertFalse(rows['home:default']['regressed'])
+            call_command('compare_benchmarks', output, output, stdout=StringIO())
+
+
+class RequestMetricsTests(RecipeTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_stats()
+
+    def test_server_timing_and_slow_log(self):
+        make_recipe(self.publisher, self.admin, title='Soup')
+        with override_settings(REQUEST_METRICS_SLOW_MS=0), self.assertLogs('app.middleware', 'WARNING') as logs:
+            response = self.client.get(reverse('home'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="2 queries", tpl;dur=[\d.]+;desc="Templates", total;dur=')
+        self.assertIn('FROM "app_recipe"', logs.output[0])
+
+    def test_stats_are_aggregated_per_url_name_for_admins(self):
+        for _ in range(2):
+            self.client.get(reverse('home'))
+        self.client.force_login(self.admin)
+        stats = self.client.get(reverse('request_stats')).json()
+        self.assertEqual(stats['routes']['home']['requests'], 2)
+        # Page and facet counts, then the second request was served from
+        # the listing cache
+        self.assertEqual(stats['routes']['home']['queries_mean'], 1)
+
+        self.client.force_login(User.objects.create_user('guest', role=Role.objects.create(role_name='user')))
+        self.assertRedirects(self.client.get(reverse('request_stats')), reverse('home'), fetch_redirect_response=False)
+
+    @override_settings(REQUEST_METRICS_ENABLED=False)
+    def test_disabled_middleware_is_dropped(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('home')))
+        self.assertEqual(route_stats(), {})
+
+
+class ProfilingTests(RecipeTestCase):
+    def setUp(self):
+        super().setUp()
+        profiles = tempfile.TemporaryDirectory()
+        self.addCleanup(profiles.cleanup)
+        self.enterContext(override_settings(PROFILE_DIR=profiles.name))
+
+    def test_admin_flag_captures_browsable_profile(self):
+        self.client.force_login(self.admin)
+        capture_id = self.client.get(reverse('home'), {'_profile': '1'})['X-Profile-Id']
+
+        self.assertContains(self.client.get(reverse('profiles')), reverse('profile_detail', args=[capture_id]))
+        self.assertContains(self.client.get(reverse('profile_detail', args=[capture_id])), 'recipe_listing_page')
+        response = self.client.get(reverse('download_profile', args=[capture_id]))
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b''.join(response.streaming_content))
+            f.flush()
+            self.assertTrue(pstats.Stats(f.name).total_calls)
+        self.assertEqual(self.client.get(reverse('profile_detail', args=['..'])).status_code, 404)
+
+    def test_flag_needs_admin_or_signed_token(self):
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('home'), {'_profile': '1'}))
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('home'), HTTP_X_PROFILE='forged:token'))
+        self.assertIn('X-Profile-Id', self.client.get(reverse('home'), HTTP_X_PROFILE=profile_token()))
+
+        # Profiling runs the view after every other middleware, CSRF included
+        client = Client(enforce_csrf_checks=True)
+        response = client.post(reverse('login'), {'email': 'admin', 'password': 'pass'}, HTTP_X_PROFILE=profile_token())
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(PROFILE_SAMPLE_RATES={'recipe_detail': 1.0}, PROFILE_MAX_CAPTURES=2)
+    def test_sampling_keeps_a_ring_buffer(self):
+        recipe = make_recipe(self.publisher, self.admin)
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('home')))
+        ids = [self.client.get(reverse('recipe_detail', args=[recipe.id]))['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual([capture['id'] for capture in list_captures()], ids[:0:-1])
+        self.assertEqual(list_captures()[0]['trigger'], 'sample')
+
+
+class SQLiteTuningTests(TestCase):
+    def test_new_connections_get_the_pragma_profile(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 2)  # FULL: the test database is in memory, not WAL
+
+    def test_synchronous_follows_the_files_journal_mode(self):
+        self.assertEqual(connection_pragmas('wal')['synchronous'], 'NORMAL')
+        self.assertEqual(connection_pragmas('delete')['synchronous'], 'FULL')
+        self.assertNotIn('journal_mode', connection_pragmas('wal'))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            settings_dict = {**connection.settings_dict, 'NAME': os.path.join(tmp, 'db.sqlite3')}
+            # The file keeps WAL once switched, whether or not later
+            # connections would switch it
+            for set_mode, journal_mode, synchronous in ((False, 'delete', 2), (True, 'wal', 1), (False, 'wal', 1)):
+                with self.subTest(set_mode=set_mode), override_settings(SQLITE_SET_JOURNAL_MODE=set_mode):
+                    wrapper = SQLiteDatabaseWrapper(settings_dict)
+                    try:
+                        with wrapper.cursor() as cursor:
+                            cursor.execute('PRAGMA journal_mode')
+                            self.assertEqual(cursor.fetchone()[0], journal_mode)
+                            cursor.execute('PRAGMA synchronous')
+                            self.assertEqual(cursor.fetchone()[0], synchronous)
+                    finally:
+                        wrapper.close()
+
+    def test_concurrency_benchmark_compares_profiles(self):
+        out = StringIO()
+        call_command(
+            'benchmark_sqlite_concurrency', profile=['default', 'wal'], seconds=0.2, rows=50, readers=1, writers=1,
+            stdout=out,
+        )
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split()[:2] for line in lines[2:]], [
+            ['default', 'persistent'], ['default', 'per'], ['wal', 'persistent'], ['wal', 'per'],
+        ])
+
+
+class MethodSyncTests(RecipeTestCase):
+    def steps(self, recipe):
+        return list(recipe.methods.values_list('step_number', 'instruction'))
+
+    def test_sync_writes_only_the_difference(self):
+        recipe = make_recipe(self.publisher, self.admin, title='Long')
+        steps = [f'Step {i}' for i in range(1, 51)]
+        sync_methods(recipe, steps)
+        first_ids = list(recipe.methods.values_list('id', flat=True))
+
+        # savepoint, select, bulk update, release
+        with self.assertNumQueries(4):
+            sync_methods(recipe, steps[:10] + ['Changed'] + steps[11:])
+        self.assertEqual(list(recipe.methods.values_list('id', flat=True)), first_ids)
+        self.assertEqual(self.steps(recipe)[10], (11, 'Changed'))
+
+        sync_methods(recipe, ['  ', 'Only step', ''])
+        self.assertEqual(self.steps(recipe), [(1, 'Only step')])
+
+
+class ImportRecipesTests(RecipeTestCase):
+    def import_file(self, records, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in records))
+            f.flush()
+            call_command('import_recipes', f.name, *args, stdout=StringIO(), stderr=StringIO())
+
+    def test_import_upserts_on_recipe_id(self):
+        records = [
+            {'recipe_id': 'r1', 'title': 'Ramen', 'publisher': 'Closet Cooking', 'methods': ['Boil', 'Serve']},
+            {'recipe_id': 'r2', 'title': 'Udon', 'publisher': 'Noodle House', 'is_vegan': True},
+        ]
+        self.import_file(records, '--batch-size', '1')
+        records[0]['title'] = 'Spicy Ramen'
+        records[0]['methods'] = ['Boil']
+        self.import_file(records)
+
+        self.assertEqual(Recipe.objects.count(), 2)
+        ramen = Recipe.objects.get(recipe_id='r1')
+        self.assertEqual(ramen.title, 'Spicy Ramen')
+        self.assertEqual(ramen.publisher, self.publisher)
+        self.assertEqual(list(ramen.methods.values_list('instruction', flat=True)), ['Boil'])
+        self.assertTrue(Recipe.objects.get(recipe_id='r2', publisher__publisher_name='Noodle House').is_vegan)
+        self.assertEqual(get_search_backend().search('spicy'), [ramen.id])
+
+    def test_bad_dates_skip_their_row_only(self):
+        self.import_file([
+            {'recipe_id': 'r1', 'title': 'Ramen', 'publisher': 'Closet Cooking', 'created_at': '2024-02-30T00:00:00'},
+            {'recipe_id': 'r2', 'title': 'Udon', 'publisher': 'Closet Cooking', 'created_at': 'last week'},
+            {'recipe_id': 'r3', 'title': 'Soba', 'publisher': 'Closet Cooking', 'created_at': '2024-02-28T12:00:00'},
+        ])
+        soba = Recipe.objects.get()
+        self.assertEqual(soba.recipe_id, 'r3')
+        self.assertEqual(soba.created_at, timezone.make_aware(datetime(2024, 2, 28, 12)))
+
+
+class ExportRecipesTests(RecipeTestCase):
+    def export(self, **params):
+        response = self.client.get(reverse('export_recipes'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_streams_methods_in_constant_queries(self):
+        self.client.force_login(self.admin)
+        for i in range(5):
+            recipe = make_recipe(self.publisher, self.admin, title=f'Recipe {i}')
+            RecipeMethod.objects.create(recipe=recipe, step_number=1, instruction=f'Step for {i}')
+
+        # session, user + role, then one recipe and one method query per chunk
+        with self.assertNumQueries(4):
+            lines = self.export().splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([r['title'] for r in records], [f'Recipe {i}' for i in range(5)])
+        self.assertEqual(records[3]['methods'], ['Step for 3'])
+
+        csv_lines = self.export(format='csv').splitlines()
+        self.assertTrue(csv_lines[0].startswith('recipe_id,title,publisher'))
+
+    def test_incremental_export_filters_on_updated_at(self):
+        self.client.force_login(self.admin)
+        make_recipe(self.publisher, self.admin, title='Old')
+        cutoff = timezone.now()
+        make_recipe(self.publisher, self.admin, title='New')
+        records = [json.loads(line) for line in self.export(since=cutoff.isoformat()).splitlines()]
+        self.assertEqual([r['title'] for r in records], ['New'])
+
+    def test_impossible_since_is_a_bad_request(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('export_recipes'), {'since': '2024-02-30T00:00:00'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_command_rejects_impossible_since(self):
+        with self.assertRaisesMessage(CommandError, 'Invalid --since timestamp'):
+            call_command('export_recipes', since='2024-02-30T00:00:00', stdout=StringIO())
+
+
+class RecipeApiTests(RecipeTestCase):
+    def test_listing_mirrors_home_and_revalidates(self):
+        make_recipe(self.publisher, self.admin, title='Falafel', is_vegan=True)
+        make_recipe(self.publisher, self.admin, title='Steak')
+        response = self.client.get(reverse('api_recipes'), {'filter': 'vegan'})
+        self.assertEqual([r['title'] for r in response.json()['results']], ['Falafel'])
+
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('api_recipes'), {'filter': 'vegan'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_detail_etag_tracks_recipe_publisher_and_methods(self):
+        recipe = make_recipe(self.publisher, self.admin, title='Risotto')
+        step = RecipeMethod.objects.create(recipe=recipe, step_number=1, instruction='Stir')
+        url = reverse('api_recipe_detail', args=[recipe.id])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['methods'], [{'step_number': 1, 'instruction': 'Stir'}])
+
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        step.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get(url)['ETag']
+        self.publisher.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_of_an_impossible_id_is_not_found(self):
+        url = reverse('api_recipe_detail', args=[99999999999999999999999])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class MediaRootMixin:
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+
+class StubImageHandler(BaseHTTPRequestHandler):
+    # Canned responses keyed by path: (status, content type, body, delay, headers)
+    routes = {}
+    hits = {}
+
+    def do_GET(self):
+        status, content_type, body, delay, headers = self.routes[self.path]
+        self.hits[self.path] = self.hits.get(self.path, 0) + 1
+        time.sleep(delay)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up first, which is what timeout tests expect
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServerMixin:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubImageHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+        # Image fetches refuse loopback addresses unless allowed
+        cls.enterClassContext(override_settings(IMAGE_FETCH_ALLOWED_NETWORKS=['127.0.0.1/32']))
+
+    def stub(self, path, body=b'', status=200, content_type='image/jpeg', delay=0, headers=None):
+        StubImageHandler.routes[path] = (status, content_type, body, delay, headers or {})
+        StubImageHandler.hits[path] = 0
+        return f'http://127.0.0.1:{self.server.server_port}{path}'
+
+
+@override_settings(AVATAR_RETRY_BACKOFF=0, AVATAR_READ_TIMEOUT=0.2, AVATAR_MAX_BYTES=1024)
+class AvatarDownloadTests(StubServerMixin, MediaRootMixin, RecipeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('guest', role=self.admin_role)
+
+    def test_downloads_avatar(self):
+        buffer = BytesIO()
+        Image.new('RGB', (8, 8)).save(buffer, 'JPEG')
+        download_avatar(self.user.id, self.stub('/ok.jpg', buffer.getvalue()))
+        self.user.refresh_from_db()
+        with self.user.profile_picture.open('rb') as f:
+            self.assertEqual(f.read(), buffer.getvalue())
+        self.assertTrue(self.user.profile_thumbnails_ready)
+
+    def test_retries_server_errors_then_gives_up(self):
+        url = self.stub('/flaky.jpg', status=503)
+        with self.assertLogs('app.avatars', 'WARNING'):
+            download_avatar(self.user.id, url)
+        self.assertEqual(StubImageHandler.hits['/flaky.jpg'], 4)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.profile_picture_url, '/static/assets/image.jpg')
+
+    def test_rejects_oversized_and_slow_images(self):
+        with self.assertLogs('app.avatars', 'WARNING'):
+            download_avatar(self.user.id, self.stub('/huge.jpg', b'x' * 2048))
+            download_avatar(self.user.id, self.stub('/slow.jpg', b'x', delay=0.3))
+        self.assertEqual(StubImageHandler.hits['/huge.jpg'], 1)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.profile_picture)
+
+    def test_login_pipeline_only_queues_the_download(self):
+        backend = SimpleNamespace(name='google-oauth2')
+        url = self.stub('/queued.jpg', b'jpeg-bytes')
+        with mock.patch('app.pipeline.enqueue') as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                get_avatar(backend, None, {}, {'picture': url, 'given_name': 'Ada'}, user=self.user)
+        enqueue.assert_called_once_with(download_avatar, self.user.id, url)
+        self.assertEqual(StubImageHandler.hits['/queued.jpg'], 0)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Ada')
+
+
+@override_settings(BACKGROUND_JOBS_EAGER=True)
+class ProfileThumbnailTests(MediaRootMixin, RecipeTestCase):
+    def jpeg_with_exif(self, size=(800, 600)):
+        buffer = BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera maker'
+        Image.new('RGB', size, 'orange').save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_generates_thumbnails_without_exif(self):
+        self.client.force_login(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('update_profile_picture'), {'profile_picture': self.jpeg_with_exif()})
+
+        user = User.objects.get(id=self.admin.id)
+        self.assertTrue(user.profile_thumbnails_ready)
+        self.assertTrue(user.profile_picture_small_webp_url.endswith('-small.webp'))
+        storage = user.profile_picture.storage
+        for url, fmt, pixels in [
+            (user.profile_picture_small_url, 'JPEG', 100),
+            (user.profile_picture_large_webp_url, 'WEBP', 300),
+        ]:
+            with storage.open(url[len(storage.base_url):]) as f, Image.open(f) as image:
+                self.assertEqual((image.format, image.size), (fmt, (pixels, pixels)))
+                self.assertFalse(image.getexif())
+        with user.profile_picture.open('rb') as f, Image.open(f) as image:
+            self.assertFalse(image.getexif())
+
+    def test_uploads_sharing_a_stem_keep_their_own_thumbnails(self):
+        other = User.objects.create_user('other', role=self.admin_role)
+        for user, name, fmt, color in [(self.admin, 'avatar.jpg', 'JPEG', 'orange'), (other, 'avatar.png', 'PNG', 'blue')]:
+            buffer = BytesIO()
+            Image.new('RGB', (200, 200), color).save(buffer, fmt)
+            self.client.force_login(user)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('update_profile_picture'), {'profile_picture': SimpleUploadedFile(name, buffer.getvalue())})
+
+        # The second user replacing theirs leaves the first one's alone
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('update_profile_picture'), {'profile_picture': self.jpeg_with_exif()})
+        user = User.objects.get(id=self.admin.id)
+        storage = user.profile_picture.storage
+        with storage.open(user.profile_picture_small_url[len(storage.base_url):]) as f, Image.open(f) as image:
+            red, green, blue = image.convert('RGB').getpixel((50, 50))
+            self.assertGreater(red, 200)
+            self.assertLess(blue, 50)
+
+    def test_urls_fall_back_to_original_until_processed(self):
+        self.admin.profile_picture = 'profile_pics/pending.jpg'
+        self.assertEqual(self.admin.profile_picture_small_url, '/media/profile_pics/pending.jpg')
+
+
+class ImageProxyTests(StubServerMixin, MediaRootMixin, RecipeTestCase):
+    def png(self, size=(1000, 800)):
+        buffer = BytesIO()
+        Image.new('RGBA', size, (255, 0, 0, 128)).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def proxy_url(self, url, variant):
+        return Template("{% load recipe_images %}{{ url|proxied_image:variant }}").render(
+            Context({'url': url, 'variant': variant})
+        )
+
+    def test_fetches_once_and_serves_resized_variants(self):
+        url = self.stub('/photo.png', self.png(), content_type='image/png')
+        for variant, size in [('card', (800, 500)), ('thumbnail', (100, 100)), ('hero', (1000, 800))]:
+            response = self.client.get(self.proxy_url(url, variant))
+            self.assertEqual(response['Content-Type'], 'image/jpeg')
+            self.assertIn('immutable', response['Cache-Control'])
+            with Image.open(BytesIO(b''.join(response.streaming_content))) as image:
+                self.assertEqual((image.format, image.size), ('JPEG', size))
+        self.assertEqual(StubImageHandler.hits['/photo.png'], 1)
+
+        response = self.client.get(self.proxy_url(url, 'card'), HTTP_IF_NONE_MATCH=response['ETag'].replace('hero', 'card'))
+        self.assertEqual(response.status_code, 304)
+
+    def test_rejects_unsigned_urls_and_falls_back_on_errors(self):
+        self.assertEqual(self.client.get('/img/card/not-a-token/').status_code, 404)
+        self.assertEqual(self.proxy_url('/static/x.jpg', 'card'), '/static/x.jpg')
+
+        url = self.stub('/missing.png', status=404)
+        with self.assertLogs('app.views', 'WARNING'):
+            response = self.client.get(self.proxy_url(url, 'card'))
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        # Failures are remembered instead of refetched on every page view
+        with self.assertLogs('app.views', 'WARNING'):
+            self.client.get(self.proxy_url(url, 'card'))
+        self.assertEqual(StubImageHandler.hits['/missing.png'], 1)
+
+    def test_refuses_private_addresses_and_redirects_to_them(self):
+        url = self.stub('/internal.png', self.png(), content_type='image/png')
+        with override_settings(IMAGE_FETCH_ALLOWED_NETWORKS=[]), self.assertRaises(ImageFetchError):
+            get_variant(url, 'card')
+        self.assertEqual(StubImageHandler.hits['/internal.png'], 0)
+        with self.assertRaises(ImageFetchError):
+            get_variant('http://[::1]/photo.png', 'card')
+
+        metadata = self.stub('/metadata', status=302, headers={'Location': 'http://169.254.169.254/latest/meta-data/'})
+        with self.assertRaises(ImageFetchError):
+            get_variant(metadata, 'card')
+        self.assertEqual(StubImageHandler.hits['/metadata'], 1)
+
+        moved = self.stub('/moved', status=301, headers={'Location': '/internal.png'})
+        self.assertTrue(os.path.exists(get_variant(moved, 'card')[0]))
+        self.assertEqual(StubImageHandler.hits['/internal.png'], 1)
+
+    def test_evicts_least_recently_used_files(self):
+        first = self.stub('/first.png', self.png(), content_type='image/png')
+        second = self.stub('/second.png', self.png((900, 900)), content_type='image/png')
+        self.client.get(self.proxy_url(first, 'card'))
+        first_path, first_digest = get_variant(first, 'card')
+        os.utime(first_path, (0, 0))
+
+        # Below IMAGE_PROXY_EVICT_EVERY_BYTES a miss doesn't walk the cache
+        with override_settings(IMAGE_PROXY_MAX_BYTES=os.path.getsize(first_path)):
+            with mock.patch('app.image_proxy.os.walk') as walk:
+                self.client.get(self.proxy_url(second, 'card'))
+            walk.assert_not_called()
+        self.assertTrue(os.path.exists(first_path))
+
+        third = self.stub('/third.png', self.png((700, 700)), content_type='image/png')
+        with override_settings(
+            IMAGE_PROXY_MAX_BYTES=os.path.getsize(first_path), IMAGE_PROXY_EVICT_EVERY_BYTES=0, BACKGROUND_JOBS_EAGER=True,
+        ):
+            response = self.client.get(self.proxy_url(third, 'card'))
+        # The variant just written is served, not evicted under the request
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertFalse(os.path.exists(first_path))
+        self.assertTrue(os.path.exists(get_variant(third, 'card')[0]))
+        self.assertEqual(StubImageHandler.hits['/third.png'], 1)
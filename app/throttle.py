@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Requests refused since the process started, by scope ('ip', 'account')
+_shed = Counter()
+_shed_lock = threading.Lock()
+
+
+def _refill(state, now, capacity, per_seconds):
+    # A bucket holds up to capacity tokens and refills completely in
+    # per_seconds; an unseen key starts full.
+    if state is None:
+        return capacity, 0
+    tokens, updated, rejected = state
+    return min(capacity, tokens + max(now - updated, 0) * capacity / per_seconds), rejected
+
+
+class BaseThrottleBackend:
+    def take(self, key, capacity, per_seconds):
+        """
+        Take a token from key's bucket. Return (allowed, rejected), where
+        rejected counts the requests refused in a row so far.
+        """
+        raise NotImplementedError
+
+    def _take(self, state, now, capacity, per_seconds):
+        tokens, rejected = _refill(state, now, capacity, per_seconds)
+        if tokens >= 1:
+            return True, (tokens - 1, now, 0)
+        return False, (tokens, now, rejected + 1)
+
+
+class LocalThrottleBackend(BaseThrottleBackend):
+    """
+    Buckets in this process's memory. Each worker process enforces the
+    limits on its own, so the effective limit scales with the worker count.
+    """
+
+    def __init__(self):
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, per_seconds):
+        now = time.monotonic()
+        with self._lock:
+            allowed, state = self._take(self._buckets.pop(key, None), now, capacity, per_seconds)
+            self._buckets[key] = state
+            # Forget the least recently used buckets, so a flood of distinct
+            # keys can't grow memory without bound
+            while len(self._buckets) > settings.LOGIN_THROTTLE_MAX_KEYS:
+                self._buckets.popitem(last=False)
+        return allowed, state[2]
+
+
+class CacheThrottleBackend(BaseThrottleBackend):
+    """
+    Buckets in the LOGIN_THROTTLE_CACHE cache, shared by every worker that
+    uses it. Reads and writes aren't atomic, so concurrent requests for the
+    same key can occasionally get one token too many.
+    """
+
+    def take(self, key, capacity, per_seconds):
+        cache = caches[settings.LOGIN_THROTTLE_CACHE]
+        now = time.time()
+        allowed, state = self._take(cache.get(key), now, capacity, per_seconds)
+        # An untouched bucket is full again after per_seconds anyway
+        cache.set(key, state, math.ceil(per_seconds))
+        return allowed, state[2]
+
+
+@lru_cache(maxsize=None)
+def get_throttle_backend():
+    return import_string(settings.LOGIN_THROTTLE_BACKEND)()
+
+
+def client_ip(request):
+    # Behind N trusted proxies the client is the Nth address from the right
+    # of X-Forwarded-For; anything further left is client-supplied.
+    proxies = settings.LOGIN_THROTTLE_PROXY_COUNT
+    if proxies:
+        forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _key(scope, value):
+    return f'login-throttle:{scope}:{hashlib.sha256(value.encode()).hexdigest()[:32]}'
+
+
+def throttle_login(request, identifier):
+    """
+    Spend a token from the client IP's bucket and then the submitted
+    identifier's. Return the scope that ran out, or None if the attempt
+    may go ahead.
+    """
+    backend = get_throttle_backend()
+    keys = [('ip', client_ip(request)), ('account', (identifier or '').strip().lower())]
+    for scope, value in keys:
+        capacity, per_seconds = settings.LOGIN_THROTTLE_RATES[scope]
+        allowed, rejected = backend.take(_key(scope, value), capacity, per_seconds)
+        if not allowed:
+            with _shed_lock:
+                _shed[scope] += 1
+            # Once per burst rather than once per refused request
+            if rejected == 1:
+                logger.warning('Throttling logins by %s for %s', scope, value)
+            return scope
+    return None
+
+
+def shed_counts():
+    with _shed_lock:
+        return dict(_shed)
+
+
+def throttled_response(scope):
+    capacity, per_seconds = settings.LOGIN_THROTTLE_RATES[scope]
+    response = HttpResponse('Too many login attempts. Please try again later.', status=429, content_type='text/plain')
+    # Time for one token to come back
+    response['Retry-After'] = str(math.ceil(per_seconds / capacity))
+    return response
@@ -0,0 +1,85 @@
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+THUMBNAIL_DIR = 'profile_pics/thumbs'
+
+
+def thumbnail_name(name, size, fmt):
+    # The whole stored name, which storage keeps unique: avatar.jpg and
+    # avatar.png belong to different users and must not share thumbnails
+    return f'{THUMBNAIL_DIR}/{name}-{size}.{fmt}'
+
+
+def delete_profile_thumbnails(field_file):
+    if not field_file:
+        return
+    for size in settings.PROFILE_THUMBNAIL_SIZES:
+        for fmt in THUMBNAIL_FORMATS:
+            field_file.storage.delete(thumbnail_name(field_file.name, size, fmt))
+
+
+def _encode(image, fmt, **options):
+    buffer = io.BytesIO()
+    # Pillow only writes EXIF when asked to, so re-encoding strips it
+    image.save(buffer, format=fmt, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def _replace(storage, name, content):
+    storage.delete(name)
+    storage.save(name, content)
+
+
+def process_profile_picture(user_id):
+    """
+    Background job: write square WebP and JPEG thumbnails for each size in
+    PROFILE_THUMBNAIL_SIZES, re-encode the original without its EXIF data
+    and mark the user's thumbnails ready.
+    """
+    user = User.objects.get(id=user_id)
+    picture = user.profile_picture
+    if not picture:
+        return
+    storage = picture.storage
+
+    try:
+        with picture.open('rb') as f:
+            image = Image.open(f)
+            image.load()
+    except (OSError, UnidentifiedImageError) as e:
+        logger.warning('Cannot process profile picture %s: %s', picture.name, e)
+        return
+    original_format = image.format
+    has_exif = bool(image.getexif())
+
+    # Apply the EXIF orientation before the data is dropped
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    for size, pixels in settings.PROFILE_THUMBNAIL_SIZES.items():
+        thumbnail = ImageOps.fit(image, (pixels, pixels), Image.LANCZOS)
+        _replace(storage, thumbnail_name(picture.name, size, 'webp'), _encode(
+            thumbnail, 'WEBP', quality=settings.PROFILE_THUMBNAIL_QUALITY, method=6,
+        ))
+        _replace(storage, thumbnail_name(picture.name, size, 'jpeg'), _encode(
+            thumbnail.convert('RGB'), 'JPEG', quality=settings.PROFILE_THUMBNAIL_QUALITY,
+            optimize=True, progressive=True,
+        ))
+
+    if has_exif and original_format in ('JPEG', 'PNG', 'WEBP'):
+        if original_format == 'JPEG':
+            image = image.convert('RGB')
+        _replace(storage, picture.name, _encode(image, original_format, quality=90))
+
+    # Only if the picture wasn't replaced while we were working
+    User.objects.filter(id=user.id, profile_picture=picture.name).update(profile_thumbnails_ready=True)
@@ -0,0 +1,25 @@
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+# Scores count half-lives from this fixed point in time
+EPOCH = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def trending_score(social_rank, created_at):
+    """
+    Social rank decayed by age, stored in log space:
+
+        2 ** score == (1 + social_rank) * 2 ** (created_at / half_life)
+
+    which is proportional, at any given moment, to
+    (1 + social_rank) * 0.5 ** (age / half_life). Every score decays at the
+    same rate, so their order never changes with time and a score only
+    moves when the recipe's social_rank or created_at does.
+    """
+    if timezone.is_naive(created_at):
+        created_at = timezone.make_aware(created_at)
+    half_lives = (created_at - EPOCH).total_seconds() / (settings.TRENDING_HALF_LIFE_HOURS * 3600)
+    return math.log2(1 + max(social_rank, 0)) + half_lives
@@ -20,6 +20,18 @@ urlpatterns = [
     path('recipe/manage/', views.manage_recipes, name='manage_recipes'),
     path('recipe/<int:recipe_id>/edit/', views.edit_recipe, name='edit_recipe'),
     path('recipe/<int:recipe_id>/delete/', views.delete_recipe, name='delete_recipe'),
+    path('recipe/export/', views.export_recipes, name='export_recipes'),
+    path('recipe/stats/', views.request_stats, name='request_stats'),
+    path('recipe/profiles/', views.profiles, name='profiles'),
+    path('recipe/profiles/<str:capture_id>/', views.profile_detail, name='profile_detail'),
+    path('recipe/profiles/<str:capture_id>/download/', views.download_profile, name='download_profile'),
+
+    # JSON read API
+    path('api/recipes/', views.api_recipes, name='api_recipes'),
+    path('api/recipes/<int:recipe_id>/', views.api_recipe_detail, name='api_recipe_detail'),
+    path('api/autocomplete/', views.autocomplete, name='autocomplete'),
+    # Resized, locally cached copies of remote recipe images
+    path('img/<str:variant>/<str:token>/', views.image_proxy, name='image_proxy'),
     path('social-auth/', include('social_django.urls', namespace='social')),
 
 ]
@@ -4,65 +4,120 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
-from .models import Recipe, User, Publisher, RecipeMethod
-from django.db.models import Q
-from django.http import HttpResponse
+from .models import Recipe, User, Publisher, SavedRecipe, SimilarRecipe
+from django.db.models import Count, Exists, Max, OuterRef
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
-from datetime import timedelta
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.http import condition, require_safe
 from functools import wraps
+import hashlib
 import os
 from django.templatetags.static import static
 from django.urls import reverse
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+import logging
+import requests
+from PIL import Image
+from .autocomplete import RECIPE, get_autocomplete_index
+from .cache import get_listing
+from .export import EXPORT_FORMATS, iter_recipes
+from .facets import filter_facets
+from .filters import MAX_ID, RELEVANCE, InvalidFilter, RecipeFilters
+from .fetch import ImageFetchError
+from .image_proxy import get_variant, unsign_url
+from .methods import create_methods, sync_methods
+from .metrics import route_stats
+from . import profiling
+from .pagination import KeysetPaginator, RankedPaginator, page_urls, paginate
+from .search import get_search_backend
+from .tasks import enqueue
+from .throttle import shed_counts, throttle_login, throttled_response
+from .thumbnails import delete_profile_thumbnails, process_profile_picture
+
+logger = logging.getLogger(__name__)
 
 def admin_required(view_func):
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
-        if not request.user.is_authenticated or not request.user.role.role_name == 'admin':
+        if not request.user.is_authenticated or not request.user.is_admin:
             messages.error(request, 'You do not have permission to access this page.')
             return redirect('home')
         return view_func(request, *args, **kwargs)
     return _wrapped_view
 
-def home(request):
-    search_query = request.GET.get('search', '')
-    filter_type = request.GET.get('filter', '')
+def recipe_listing_page(request, filters):
+    # Shared by the home page and the JSON listing API
+    recipes = filters.apply(Recipe.objects.select_related('publisher'))
     
-    recipes = Recipe.objects.select_related('publisher').all()
+    def build_page():
+        cursor = request.GET.get('cursor')
+        if not filters.search:
+            return KeysetPaginator(recipes, filters.ordering, settings.RECIPES_PER_PAGE).page(cursor)
+        ranked_ids = get_search_backend().search(filters.search)
+        # Search results keep their relevance order unless a sort was requested
+        if filters.sort == RELEVANCE:
+            paginator = RankedPaginator(recipes, ranked_ids, settings.RECIPES_PER_PAGE)
+        else:
+            paginator = KeysetPaginator(recipes.filter(id__in=ranked_ids), filters.ordering, settings.RECIPES_PER_PAGE)
+        return paginator.page(cursor)
     
-    # Apply search filter if exists
-    if search_query:
-        recipes = recipes.filter(
-            Q(title__icontains=search_query) |
-            Q(publisher__publisher_name__icontains=search_query)
+    # Pages are cached per canonical criteria and cursor until a recipe or
+    # publisher they could contain changes
+    page = get_listing(filters, request.GET.get('cursor'), build_page)
+    return page_urls(request, page)
+
+def mark_saved(user, recipes):
+    # Listing pages are cached for everyone, so the per-user flag is set
+    # afterwards: one indexed lookup for the whole page
+    saved_ids = set()
+    if user.is_authenticated and recipes:
+        saved_ids = set(
+            SavedRecipe.objects.filter(user=user, recipe_id__in=[recipe.id for recipe in recipes])
+            .values_list('recipe_id', flat=True)
         )
-    
-    # Apply category filters
-    if filter_type:
-        if filter_type == 'popular':
-            recipes = recipes.order_by('-social_rank')
-        elif filter_type == 'recent':
-            recipes = recipes.order_by('-created_at')
-        elif filter_type == 'trending':
-            # Get recipes from the last 7 days with highest social rank
-            week_ago = timezone.now() - timedelta(days=7)
-            recipes = recipes.filter(created_at__gte=week_ago).order_by('-social_rank')
-        elif filter_type == 'vegetarian':
-            recipes = recipes.filter(is_vegetarian=True)
-        elif filter_type == 'vegan':
-            recipes = recipes.filter(is_vegan=True)
-        elif filter_type == 'gluten-free':
-            recipes = recipes.filter(is_gluten_free=True)
-    else:
-        # Default sorting by social rank
-        recipes = recipes.order_by('-social_rank')
+    for recipe in recipes:
+        recipe.is_saved = recipe.id in saved_ids
+
+def home(request):
+    try:
+        filters = RecipeFilters.from_params(request.GET)
+    except InvalidFilter as e:
+        return HttpResponseBadRequest(str(e))
+    page = recipe_listing_page(request, filters)
+    mark_saved(request.user, page.object_list)
     
     return render(request, 'index.html', {
-        'recipes': recipes,
-        'current_filter': filter_type,
-        'search_query': search_query
+        'recipes': page,
+        'page': page,
+        'facets': filter_facets(filters),
+        'filters': filters,
+        'search_query': filters.search
     })
 
+@require_safe
+def autocomplete(request):
+    query = request.GET.get('q', '')[:settings.AUTOCOMPLETE_MAX_QUERY_LENGTH]
+    index = get_autocomplete_index()
+    results = []
+    # No suggestions while this process is still building its index
+    for (kind, pk), label in index.suggest(query) if index else []:
+        if kind == RECIPE:
+            url = reverse('recipe_detail', args=[pk])
+        else:
+            url = reverse('home') + f'?publisher={pk}'
+        results.append({'type': kind, 'label': label, 'url': url})
+    response = JsonResponse({'results': results})
+    # Every keystroke asks; let the browser reuse answers for a minute, but
+    # not the empty ones given before the index is ready
+    patch_cache_control(response, max_age=60 if index else 0)
+    return response
+
 def about(request):
     return render(request, 'about.html')
 
@@ -83,15 +138,12 @@ def login_view(request):
     if request.method == 'POST':
         identifier = request.POST.get('email')
         password = request.POST.get('password')
+        # Refuse floods before they cost a password hash
+        scope = throttle_login(request, identifier)
+        if scope:
+            return throttled_response(scope)
+        # Matches the username or the email (see app.backends)
         user = authenticate(request, username=identifier, password=password)
-        
-        if user is None:
-            # Try to find user by email
-            try:
-                user_obj = User.objects.get(email=identifier)
-                user = authenticate(request, username=user_obj.username, password=password)
-            except User.DoesNotExist:
-                user = None
                 
         if user is not None:
             if user.is_active:
@@ -139,7 +191,11 @@ def update_profile(request):
         user.username = request.POST.get('username')
         user.first_name = request.POST.get('first_name')
         user.last_name = request.POST.get('last_name')
-        user.email = request.POST.get('email')
+        email = request.POST.get('email') or ''
+        if email and User.objects.with_email(email).exclude(id=user.id).exists():
+            messages.error(request, 'That email address is already in use.')
+            return redirect('profile')
+        user.email = email
         user.save()
         messages.success(request, 'Profile updated successfully!')
     return redirect('profile')
@@ -149,13 +205,17 @@ def update_profile_picture(request):
     if request.method == 'POST' and request.FILES.get('profile_picture'):
         try:
             user = request.user
-            # Delete old profile picture if it exists
+            # Delete old profile picture and its thumbnails if they exist
             if user.profile_picture and os.path.isfile(user.profile_picture.path):
+                delete_profile_thumbnails(user.profile_picture)
                 os.remove(user.profile_picture.path)
             
-            # Save new profile picture
+            # Save new profile picture; thumbnails are made in the background
             user.profile_picture = request.FILES['profile_picture']
+            user.profile_thumbnails_ready = False
             user.save()
+            user_id = user.id
+            transaction.on_commit(lambda: enqueue(process_profile_picture, user_id))
             messages.success(request, 'Profile picture updated successfully!')
         except Exception as e:
             messages.error(request, f'Error updating profile picture: {str(e)}')
@@ -185,27 +245,41 @@ def change_password(request):
     return redirect('profile')
 
 def recipe_detail(request, recipe_id):
-    recipe = get_object_or_404(Recipe.objects.select_related('publisher', 'created_by').prefetch_related('methods'), id=recipe_id)
-    methods = recipe.methods.all().order_by('step_number')
-    is_admin = request.user.is_authenticated and request.user.role.role_name == 'admin'
+    recipes = Recipe.objects.select_related('publisher', 'created_by').prefetch_related('methods')
+    if request.user.is_authenticated:
+        recipes = recipes.annotate(is_saved=Exists(SavedRecipe.objects.filter(user=request.user, recipe=OuterRef('pk'))))
+    recipe = get_object_or_404(recipes, id=recipe_id)
+    # Prefetched, already in RecipeMethod's step_number order
+    methods = recipe.methods.all()
+    is_admin = request.user.is_authenticated and request.user.is_admin
+    # Precomputed by refresh_similar_recipes; one walk of (recipe, rank).
+    # A deleted neighbour leaves an empty row until the next run.
+    similar_recipes = (
+        SimilarRecipe.objects.filter(recipe_id=recipe.id, similar__isnull=False).select_related('similar').order_by('rank')
+    )
     
     return render(request, 'recipe-detail.html', {
         'recipe': recipe,
         'methods': methods,
+        'similar_recipes': similar_recipes,
         'is_admin': is_admin
     })
 
 @login_required
 def save_recipe(request, recipe_id):
     if request.method == 'POST':
-        recipe = get_object_or_404(Recipe, id=recipe_id)
-        user = request.user
-        if recipe in user.saved_recipes.all():
-            user.saved_recipes.remove(recipe)
+        if not Recipe.objects.filter(id=recipe_id).exists():
+            raise Http404
+        # Both branches touch a single row through the (user, recipe) index
+        deleted, _ = SavedRecipe.objects.filter(user=request.user, recipe_id=recipe_id).delete()
+        if deleted:
             messages.success(request, 'Recipe removed from saved recipes.')
         else:
-            user.saved_recipes.add(recipe)
+            SavedRecipe.objects.get_or_create(user=request.user, recipe_id=recipe_id)
             messages.success(request, 'Recipe saved successfully!')
+        next_url = request.POST.get('next')
+        if next_url and url_has_allowed_host_and_scheme(next_url, {request.get_host()}, request.is_secure()):
+            return redirect(next_url)
     return redirect('recipe_detail', recipe_id=recipe_id)
 
 @login_required
@@ -216,30 +290,26 @@ def add_recipe(request):
             publisher_id = request.POST.get('publisher')
             publisher = get_object_or_404(Publisher, id=publisher_id)
 
-            # Create recipe
-            recipe = Recipe.objects.create(
-                title=request.POST.get('title'),
-                description=request.POST.get('description'),
-                source_url=request.POST.get('source_url', ''),
-                image_url=request.POST.get('image_url'),
-                cooking_time=int(request.POST.get('cooking_time', 0)),
-                social_rank=float(request.POST.get('social_rank', 0)),
-                publisher=publisher,
-                created_by=request.user,
-                is_vegetarian=request.POST.get('is_vegetarian') == 'on',
-                is_vegan=request.POST.get('is_vegan') == 'on',
-                is_gluten_free=request.POST.get('is_gluten_free') == 'on'
-            )
-
-            # Create recipe methods from dynamic steps
-            methods = request.POST.getlist('method[]')
-            for i, method in enumerate(methods, 1):
-                if method.strip():
-                    RecipeMethod.objects.create(
-                        recipe=recipe,
-                        step_number=i,
-                        instruction=method.strip()
-                    )
+            # Create the recipe, its methods and its search entry together
+            with transaction.atomic():
+                recipe = Recipe.objects.create(
+                    title=request.POST.get('title'),
+                    description=request.POST.get('description'),
+                    source_url=request.POST.get('source_url', ''),
+                    image_url=request.POST.get('image_url'),
+                    cooking_time=int(request.POST.get('cooking_time', 0)),
+                    social_rank=float(request.POST.get('social_rank', 0)),
+                    publisher=publisher,
+                    created_by=request.user,
+                    is_vegetarian=request.POST.get('is_vegetarian') == 'on',
+                    is_vegan=request.POST.get('is_vegan') == 'on',
+                    is_gluten_free=request.POST.get('is_gluten_free') == 'on'
+                )
+
+                # Create recipe methods from dynamic steps
+                create_methods(recipe, request.POST.getlist('method[]'))
+
+                get_search_backend().index_recipe(recipe.id)
 
             messages.success(request, 'Recipe added successfully!')
             return redirect('recipe_detail', recipe_id=recipe.id)
@@ -282,6 +352,7 @@ def add_publisher(request):
                     publisher.publisher_name = name
                     publisher.publisher_url = url
                     publisher.save()
+                    get_search_backend().index_publisher(publisher.id)
                     messages.success(request, 'Publisher updated successfully!')
             except Publisher.DoesNotExist:
                 messages.error(request, 'Publisher not found.')
@@ -308,14 +379,16 @@ def add_publisher(request):
 @admin_required
 def manage_recipes(request):
     recipes = Recipe.objects.select_related('publisher', 'created_by').all()
-    return render(request, 'manage-recipes.html', {'recipes': recipes})
+    page = paginate(request, KeysetPaginator(recipes, ('-created_at', '-id'), settings.MANAGE_RECIPES_PER_PAGE))
+    return render(request, 'manage-recipes.html', {'recipes': page, 'page': page})
 
 @login_required
 @admin_required
 def edit_recipe(request, recipe_id):
-    recipe = get_object_or_404(Recipe, id=recipe_id)
+    recipe = get_object_or_404(Recipe.objects.select_related('publisher').prefetch_related('methods'), id=recipe_id)
     publishers = Publisher.objects.all()
-    methods = recipe.methods.all().order_by('step_number')
+    # Prefetched, already in RecipeMethod's step_number order
+    methods = recipe.methods.all()
     
     if request.method == 'POST':
         try:
@@ -323,29 +396,25 @@ def edit_recipe(request, recipe_id):
             publisher_id = request.POST.get('publisher')
             publisher = get_object_or_404(Publisher, id=publisher_id)
             
-            # Update recipe
-            recipe.title = request.POST.get('title')
-            recipe.description = request.POST.get('description')
-            recipe.source_url = request.POST.get('source_url')
-            recipe.image_url = request.POST.get('image_url')
-            recipe.cooking_time = int(request.POST.get('cooking_time', 0))
-            recipe.social_rank = float(request.POST.get('social_rank', 0))
-            recipe.publisher = publisher
-            recipe.is_vegetarian = request.POST.get('is_vegetarian') == 'on'
-            recipe.is_vegan = request.POST.get('is_vegan') == 'on'
-            recipe.is_gluten_free = request.POST.get('is_gluten_free') == 'on'
-            recipe.save()
-            
-            # Update methods
-            recipe.methods.all().delete()
-            methods = request.POST.get('recipe_methods', '').split('\n')
-            for i, method in enumerate(methods, 1):
-                if method.strip():
-                    RecipeMethod.objects.create(
-                        recipe=recipe,
-                        step_number=i,
-                        instruction=method.strip()
-                    )
+            # Update recipe, methods and search entry together, so a failure
+            # part way through leaves the recipe as it was
+            with transaction.atomic():
+                recipe.title = request.POST.get('title')
+                recipe.description = request.POST.get('description')
+                recipe.source_url = request.POST.get('source_url')
+                recipe.image_url = request.POST.get('image_url')
+                recipe.cooking_time = int(request.POST.get('cooking_time', 0))
+                recipe.social_rank = float(request.POST.get('social_rank', 0))
+                recipe.publisher = publisher
+                recipe.is_vegetarian = request.POST.get('is_vegetarian') == 'on'
+                recipe.is_vegan = request.POST.get('is_vegan') == 'on'
+                recipe.is_gluten_free = request.POST.get('is_gluten_free') == 'on'
+                recipe.save()
+                
+                # Update only the methods that changed
+                sync_methods(recipe, request.POST.get('recipe_methods', '').split('\n'))
+                
+                get_search_backend().index_recipe(recipe.id)
             
             messages.success(request, 'Recipe updated successfully!')
             return redirect('recipe_detail', recipe_id=recipe.id)
@@ -364,8 +433,177 @@ def edit_recipe(request, recipe_id):
 def delete_recipe(request, recipe_id):
     recipe = get_object_or_404(Recipe, id=recipe_id)
     if request.method == 'POST':
+        get_search_backend().remove_recipe(recipe.id)
         recipe.delete()
         messages.success(request, 'Recipe deleted successfully!')
         return redirect('manage_recipes')
     return render(request, 'delete-recipe-confirm.html', {'recipe': recipe})
 
+@login_required
+@admin_required
+def export_recipes(request):
+    export_format = request.GET.get('format', 'jsonl')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('Unsupported export format.')
+    
+    # Incremental exports only ship recipes updated since the last sync
+    since = None
+    if request.GET.get('since'):
+        try:
+            since = parse_datetime(request.GET['since'])
+        except ValueError:
+            # Well formed but impossible, e.g. February 30th
+            since = None
+        if since is None:
+            return HttpResponseBadRequest('Invalid since timestamp.')
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+    
+    serialize, content_type = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(serialize(iter_recipes(since)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="recipes.{export_format}"'
+    return response
+
+def recipe_summary(recipe):
+    return {
+        'id': recipe.id,
+        'title': recipe.title,
+        'publisher': {
+            'name': recipe.publisher.publisher_name,
+            'url': recipe.publisher.publisher_url,
+        },
+        'source_url': recipe.source_url,
+        'image_url': recipe.image_url,
+        'social_rank': recipe.social_rank,
+        'cooking_time': recipe.cooking_time,
+        'is_vegetarian': recipe.is_vegetarian,
+        'is_vegan': recipe.is_vegan,
+        'is_gluten_free': recipe.is_gluten_free,
+        'created_at': recipe.created_at,
+        'updated_at': recipe.updated_at,
+        'url': reverse('api_recipe_detail', args=[recipe.id]),
+    }
+
+def recipe_list_etag(request):
+    # The page usually comes from the listing cache, so an unchanged poll
+    # costs a cache lookup and a hash; keep it for the view on a miss.
+    try:
+        filters = RecipeFilters.from_params(request.GET)
+    except InvalidFilter as e:
+        request.recipe_listing_error = str(e)
+        return None
+    page = request.recipe_listing_page = recipe_listing_page(request, filters)
+    versions = [(recipe.id, recipe.updated_at, recipe.publisher.updated_at) for recipe in page]
+    return hashlib.sha1(repr((versions, page.next_cursor, page.previous_cursor)).encode()).hexdigest()
+
+@require_safe
+@condition(etag_func=recipe_list_etag)
+def api_recipes(request):
+    if hasattr(request, 'recipe_listing_error'):
+        return JsonResponse({'error': request.recipe_listing_error}, status=400)
+    page = request.recipe_listing_page
+    return JsonResponse({
+        'results': [recipe_summary(recipe) for recipe in page],
+        'next': request.path + page.next_url if page.has_next else None,
+        'previous': request.path + page.previous_url if page.has_previous else None,
+    })
+
+def recipe_detail_etag(request, recipe_id):
+    # One aggregate query; deleting a step changes the count even when the
+    # newest remaining step is unchanged.
+    if recipe_id > MAX_ID:
+        return None
+    versions = (
+        Recipe.objects.filter(id=recipe_id)
+        .annotate(methods_updated=Max('methods__updated_at'), methods_count=Count('methods'))
+        .values_list('updated_at', 'publisher__updated_at', 'methods_updated', 'methods_count')
+        .first()
+    )
+    if versions is None:
+        return None
+    return hashlib.sha1(repr((recipe_id,) + versions).encode()).hexdigest()
+
+@require_safe
+@condition(etag_func=recipe_detail_etag)
+def api_recipe_detail(request, recipe_id):
+    # Larger ids can't be in the database, and would overflow the query
+    if recipe_id > MAX_ID:
+        raise Http404
+    recipe = get_object_or_404(Recipe.objects.select_related('publisher'), id=recipe_id)
+    data = recipe_summary(recipe)
+    data['description'] = recipe.description
+    data['methods'] = [
+        {'step_number': step_number, 'instruction': instruction}
+        for step_number, instruction in recipe.methods.order_by('step_number').values_list('step_number', 'instruction')
+    ]
+    return JsonResponse(data)
+
+@login_required
+@admin_required
+@require_safe
+def request_stats(request):
+    # Per-process figures since this worker started
+    return JsonResponse({
+        'pid': os.getpid(),
+        'routes': route_stats(),
+        'login_throttle_shed': shed_counts(),
+    })
+
+@login_required
+@admin_required
+@require_safe
+def profiles(request):
+    return render(request, 'profiles.html', {
+        'captures': profiling.list_captures(),
+        'token': profiling.profile_token(),
+        'token_max_age': settings.PROFILE_TOKEN_MAX_AGE // 60,
+        'query_param': profiling.QUERY_PARAM,
+        'header': profiling.HEADER,
+    })
+
+@login_required
+@admin_required
+@require_safe
+def profile_detail(request, capture_id):
+    capture = profiling.get_capture(capture_id)
+    if capture is None:
+        raise Http404
+    return render(request, 'profile-detail.html', {'capture': capture})
+
+@login_required
+@admin_required
+@require_safe
+def download_profile(request, capture_id):
+    if profiling.get_capture(capture_id) is None:
+        raise Http404
+    return FileResponse(
+        open(profiling.capture_pstats_path(capture_id), 'rb'),
+        as_attachment=True, filename=f'{capture_id}.pstats',
+    )
+
+@require_safe
+def image_proxy(request, variant, token):
+    if variant not in settings.IMAGE_PROXY_VARIANTS:
+        raise Http404
+    try:
+        url = unsign_url(token)
+    except signing.BadSignature:
+        raise Http404
+    try:
+        path, digest = get_variant(url, variant)
+        image = open(path, 'rb')
+    except (requests.RequestException, ImageFetchError, OSError, Image.DecompressionBombError) as e:
+        # Fall back to hot-linking rather than showing a broken image
+        logger.warning('Image proxy cannot serve %s: %s', url, e)
+        return redirect(url)
+
+    # Variant names embed the content hash, so a URL's bytes never change
+    etag = f'"{digest}-{variant}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = FileResponse(image, content_type='image/jpeg')
+        response['ETag'] = etag
+    else:
+        image.close()
+    response['Cache-Control'] = f'public, max-age={settings.IMAGE_PROXY_MAX_AGE}, immutable'
+    return response
@@ -61,6 +61,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'app.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,6 +70,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Must stay last (see its docstring)
+    'app.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'recipe_finder.urls'
@@ -98,9 +102,78 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections (and their PRAGMA setup) between requests, and
+        # check them before reuse
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# PRAGMAs applied to every new SQLite connection (see app/db.py). 'wal'
+# lets readers carry on while add_recipe/edit_recipe write; 'durable' also
+# fsyncs every commit; 'default' leaves SQLite's own settings alone.
+# benchmark_sqlite_concurrency compares them.
+SQLITE_PRAGMA_PROFILE = 'wal'
+# journal_mode is stored in the database file, not per connection, and
+# switching it rewrites the file. Connections leave it alone unless this is
+# True, so commands don't rewrite the checked-in dev db.sqlite3. Switch a
+# deployment's database once, by setting this to True there or by running
+# PRAGMA journal_mode=WAL; in manage.py dbshell; it then stays in WAL.
+# Until then readers still wait for writers.
+SQLITE_SET_JOURNAL_MODE = False
+SQLITE_PRAGMA_PROFILES = {
+    'default': {},
+    'wal': {
+        'journal_mode': 'WAL',
+        # Safe with WAL: a power loss can lose the last commits, not corrupt.
+        # Connections to a database not (yet) in WAL keep FULL instead.
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -20000,  # KiB
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+    },
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Listing pages live in their own LRU-bounded cache. Point 'listings' at a
+# shared backend (e.g. django.core.cache.backends.redis.RedisCache) when
+# running several workers so they all see the same invalidations.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'listings': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'recipe-listings',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
+    # Rendered recipe cards and rows; keys are versioned, so entries never
+    # go stale and only age out
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'recipe-fragments',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+
+RECIPE_LISTING_CACHE = 'listings'
+RECIPE_FRAGMENT_CACHE = 'fragments'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -150,5 +223,128 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom user model
 AUTH_USER_MODEL = 'app.User'
 
+# Logs in by username or email, and loads the session user with their role
+# in one query
+AUTHENTICATION_BACKENDS = ['app.backends.EmailOrUsernameBackend']
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Per-request SQL/template timing (see app/middleware.py): Server-Timing
+# headers, a slow-request log and per-URL stats at /recipe/stats/.
+# Disabling it removes the middleware entirely.
+REQUEST_METRICS_ENABLED = True
+REQUEST_METRICS_SLOW_MS = 500
+# Slowest queries logged for a slow request
+REQUEST_METRICS_SLOWEST_QUERIES = 5
+# Recent requests per URL name kept for the stats percentiles
+REQUEST_METRICS_SAMPLES = 1000
+
+# On-demand cProfile captures (see app/profiling.py), browsable by admins at
+# /recipe/profiles/. Kept outside MEDIA_ROOT so they are never served
+# publicly; only the newest PROFILE_MAX_CAPTURES are kept.
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILE_MAX_CAPTURES = 50
+# Functions listed in each capture's summary, by cumulative time
+PROFILE_TOP_N = 40
+# Seconds a signed X-Profile token stays valid
+PROFILE_TOKEN_MAX_AGE = 60 * 60
+# Fraction of requests to profile per URL name, e.g. {'home': 0.01}
+PROFILE_SAMPLE_RATES = {}
+
+# Login throttling (see app/throttle.py): token buckets per client IP and
+# per submitted username/email, as (burst, seconds to refill completely).
+# CacheThrottleBackend shares buckets between workers through
+# LOGIN_THROTTLE_CACHE; the local backend keeps them per process.
+LOGIN_THROTTLE_BACKEND = 'app.throttle.LocalThrottleBackend'
+LOGIN_THROTTLE_CACHE = 'default'
+LOGIN_THROTTLE_RATES = {
+    'ip': (20, 60),
+    'account': (5, 300),
+}
+LOGIN_THROTTLE_MAX_KEYS = 100000
+# Number of trusted reverse proxies that append to X-Forwarded-For
+LOGIN_THROTTLE_PROXY_COUNT = 0
+
+# Recipe search
+# Use 'app.search.SimpleSearchBackend' on databases without SQLite FTS5.
+RECIPE_SEARCH_BACKEND = 'app.search.SQLiteFTSBackend'
+RECIPE_SEARCH_MAX_RESULTS = 1000
+# How strongly social_rank boosts full-text relevance (per rank point)
+RECIPE_SEARCH_SOCIAL_RANK_WEIGHT = 0.01
+
+# Search-as-you-type suggestions (app.autocomplete), served from an index
+# held by each process and built by a background job on first use; until
+# then suggestions are empty. Building costs every worker process one read
+# of all titles plus roughly 30s of CPU, mostly holding the GIL, per
+# million recipes. Afterwards it picks up other processes' changes by
+# syncing once it is this old (0 never syncs), reading only the rows saved
+# since.
+AUTOCOMPLETE_LIMIT = 8
+AUTOCOMPLETE_SYNC_SECONDS = 60
+AUTOCOMPLETE_MAX_QUERY_LENGTH = 100
+
+# Pagination (page sizes for the keyset-paginated listings)
+RECIPES_PER_PAGE = 24
+MANAGE_RECIPES_PER_PAGE = 50
+
+# Trending listing: social_rank halves in weight every this many hours of
+# age. Run refresh_trending_scores after changing it.
+TRENDING_HALF_LIFE_HOURS = 48
+
+# Similar recipes on recipe_detail, precomputed by refresh_similar_recipes
+# (see app/similar.py). A run holds a count per distinct word while it
+# picks the SIMILAR_RECIPES_MAX_FEATURES words, then 8 bytes per recipe per
+# feature it has (a few dozen, typically) as sparse vectors. On top of that,
+# at a time, one SIMILAR_RECIPES_CHUNK_SIZE x recipes x 4 bytes block of
+# scores plus about 32 x recipes x 9 bytes of working space: about 1.3 GB
+# at a million recipes with these defaults.
+SIMILAR_RECIPES_COUNT = 6
+SIMILAR_RECIPES_MAX_FEATURES = 1024
+SIMILAR_RECIPES_CHUNK_SIZE = 256
+
+# Background jobs (see app/tasks.py)
+BACKGROUND_JOB_WORKERS = 2
+# Run jobs inline instead of on the worker threads
+BACKGROUND_JOBS_EAGER = False
+
+# Avatar and recipe image fetches refuse hosts that resolve to private,
+# loopback, link-local or reserved addresses, except in these networks
+# (CIDR strings, e.g. an internal image CDN)
+IMAGE_FETCH_ALLOWED_NETWORKS = []
+
+# Social avatar downloads
+AVATAR_CONNECT_TIMEOUT = 3
+AVATAR_READ_TIMEOUT = 5
+AVATAR_MAX_BYTES = 5 * 1024 * 1024
+AVATAR_RETRIES = 3
+# Seconds before the first retry; doubles on each further attempt
+AVATAR_RETRY_BACKOFF = 2
+
+# Profile picture thumbnails (square edge in pixels, about 2x the CSS size)
+PROFILE_THUMBNAIL_SIZES = {
+    'small': 100,
+    'large': 300,
+}
+PROFILE_THUMBNAIL_QUALITY = 80
+
+# Recipe image proxy (see app/image_proxy.py). Variants are rendered as JPEG
+# at about 2x their CSS size; cropped variants keep the exact aspect ratio.
+IMAGE_PROXY_VARIANTS = {
+    'thumbnail': {'size': (100, 100), 'crop': True},
+    'card': {'size': (800, 500), 'crop': True},
+    'hero': {'size': (1200, 1200), 'crop': False},
+}
+IMAGE_PROXY_QUALITY = 80
+# Relative to MEDIA_ROOT; least recently used files go past IMAGE_PROXY_MAX_BYTES
+IMAGE_PROXY_DIR = 'image_cache'
+IMAGE_PROXY_MAX_BYTES = 500 * 1024 * 1024
+# Each process queues an eviction (a walk of the cache directory) after
+# writing this much, so the cache can run over by about this per process
+IMAGE_PROXY_EVICT_EVERY_BYTES = 20 * 1024 * 1024
+IMAGE_PROXY_MAX_SOURCE_BYTES = 10 * 1024 * 1024
+IMAGE_PROXY_CONNECT_TIMEOUT = 3
+IMAGE_PROXY_READ_TIMEOUT = 5
+# Seconds to wait before fetching a failed image again
+IMAGE_PROXY_FAILURE_TIMEOUT = 10 * 60
+IMAGE_PROXY_MAX_AGE = 365 * 24 * 60 * 60